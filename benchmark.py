@@ -0,0 +1,34 @@
+# nestest.nes 吞吐量测试
+# 以 automation 模式 (PC = $C000) 运行 nestest, 执行完 nestest.log 覆盖的全部指令后统计每秒执行的指令数
+import time
+
+from my_fc.fc import FC
+
+NESTEST_INSTRUCTIONS = 8991
+
+
+def run_nestest(rom_name='nestest.nes', count=NESTEST_INSTRUCTIONS):
+    fc = FC()
+    fc.load_rom(rom_name)
+    cpu = fc.cpu
+    registers = cpu._registers
+    registers.PC = 0xC000
+    registers.A, registers.X, registers.Y = 0, 0, 0
+    registers.S = 0xFD
+    registers.P = 0x24
+
+    start = time.perf_counter()
+    for _ in range(count):
+        cpu.execute()
+    return time.perf_counter() - start
+
+
+def bench(rom_name='nestest.nes', rounds=20):
+    elapsed = min(run_nestest(rom_name) for _ in range(rounds))
+    ips = NESTEST_INSTRUCTIONS / elapsed
+    print('{}: {} instructions in {:.4f}s, {:.0f} ins/s'.format(rom_name, NESTEST_INSTRUCTIONS, elapsed, ips))
+    return ips
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,170 @@
+class Bus:
+    '''
+    CPU 地址总线
+    +---------+-------+-------+-----------------------+
+    | 地址    | 大小  | 标记  |         描述          |
+    +---------+-------+-------+-----------------------+
+    | $0000   | $800  |       | RAM                   |
+    | $0800   | $800  | M     | RAM                   |
+    | $1000   | $800  | M     | RAM                   |
+    | $1800   | $800  | M     | RAM                   |
+    | $2000   | 8     |       | Registers             |
+    | $2008   | $1FF8 | R     | Registers             |
+    | $4000   | $20   |       | Registers             |
+    | $4020   | $1FDF |       | Expansion ROM         |
+    | $6000   | $2000 |       | SRAM                  |
+    | $8000   | $4000 |       | PRG-ROM               |
+    | $C000   | $4000 |       | PRG-ROM               |
+    +---------+-------+-------+-----------------------+
+    标记图例: M = $0000的镜像
+              R = $2000-2008 每 8 bytes 的镜像
+            (e.g. $2008=$2000, $2018=$2000, etc.)
+
+    64K 地址空间按高 8 位分成 256 页, 每页在页表里要么是一个指向后备存储的 256 字节 memoryview,
+    要么是一个处理函数
+    RAM ROM 这种普通存储直接按 memoryview 读写, 不经过任何处理函数; 镜像也在页表里就已经解析好了
+    '''
+
+    def __init__(self, memory: bytearray, ppu, cpu=None):
+        self._memory = memory
+        self._view = memoryview(memory)
+        self._ppu = ppu
+        self._cpu = cpu  # OAMDMA 期间 CPU 要停下来, 周期数记在 cpu 上
+
+        self.read_pages = [None] * 256
+        self.write_pages = [None] * 256
+        self.read_handlers = [None] * 256
+        self.write_handlers = [None] * 256
+
+        # $0000-$1FFF: 2K RAM, 后面 3 份都是镜像
+        for page in range(0x00, 0x20):
+            self.map_memory(page, (page & 0x07) << 8)
+
+        # $2000-$3FFF: PPU 寄存器, 每 8 字节一个镜像
+        for page in range(0x20, 0x40):
+            self.map_handler(page, self.read_ppu, self.write_ppu)
+
+        # $4000-$40FF: APU / 手柄 / OAMDMA 寄存器
+        self.map_handler(0x40, self.read_io, self.write_io)
+
+        # $4100-$7FFF: 扩展 ROM 和 SRAM
+        for page in range(0x41, 0x80):
+            self.map_memory(page, page << 8)
+
+        # $8000-$FFFF: PRG-ROM, 只读, 写入交给 write_rom
+        for page in range(0x80, 0x100):
+            self.map_memory(page, page << 8)
+            self.map_write_handler(page, self.write_rom)
+
+    def map_memory(self, page, offset):
+        # 把 page 这一页映射到后备存储里从 offset 开始的 256 字节
+        view = self._view[offset:offset + 0x100]
+        self.read_pages[page] = view
+        self.write_pages[page] = view
+        self.read_handlers[page] = None
+        self.write_handlers[page] = None
+
+    def map_rom(self, page, pages):
+        '''
+        从 page 开始的 len(pages) 页的读取直接指向 pages (卡带 ROM 上每页 256 字节的只读 memoryview)
+        写入不变, 仍然交给 write_rom, mapper 切换 bank 时只是替换页表里的这几个引用
+        '''
+        self.read_pages[page:page + len(pages)] = pages
+        self.read_handlers[page:page + len(pages)] = [None] * len(pages)
+
+    def load(self, address, data):
+        # 把 data 复制进从 address (页对齐) 开始的地址, 比如载入 trainer; 普通存储整页复制, 其他页逐字节写
+        for offset in range(0, len(data), 0x100):
+            chunk = data[offset:offset + 0x100]
+            page = self.write_pages[(address + offset) >> 8]
+            if page is not None:
+                page[:len(chunk)] = chunk
+            else:
+                for i, byte in enumerate(chunk):
+                    self.write(address + offset + i, byte)
+
+    def unmap_rom(self):
+        # 拔出卡带: $8000-$FFFF 恢复成 CPU 自己的内存, 不再引用 ROM 的页
+        for page in range(0x80, 0x100):
+            self.map_memory(page, page << 8)
+            self.map_write_handler(page, self.write_rom)
+
+    def map_sram(self, sram):
+        # $6000-$7FFF 换成电池供电的 SRAM: 读直接读它的 memoryview, 写交给它记录脏页
+        for page in range(0x60, 0x80):
+            self.read_pages[page] = sram.page(page)
+            self.read_handlers[page] = None
+            self.map_write_handler(page, sram.write)
+
+    def unmap_sram(self):
+        for page in range(0x60, 0x80):
+            self.map_memory(page, page << 8)
+
+    def map_handler(self, page, read, write):
+        self.read_pages[page] = None
+        self.write_pages[page] = None
+        self.read_handlers[page] = read
+        self.write_handlers[page] = write
+
+    def map_write_handler(self, page, write):
+        self.write_pages[page] = None
+        self.write_handlers[page] = write
+
+    def read(self, address: int):
+        page = self.read_pages[address >> 8]
+        if page is not None:
+            return page[address & 0xFF]
+        return self.read_handlers[address >> 8](address)
+
+    def write(self, address: int, data):
+        page = self.write_pages[address >> 8]
+        if page is not None:
+            page[address & 0xFF] = data
+        else:
+            self.write_handlers[address >> 8](address, data)
+
+    def sync_ppu(self):
+        # 访问 PPU 之前先让 PPU 追上 CPU 现在的周期
+        if self._cpu is not None:
+            self._ppu.catch_up(self._cpu.cycles)
+
+    def read_ppu(self, address):
+        self.sync_ppu()
+        return self._ppu.read_address_from_cpu(0x2000 | (address & 0x07))
+
+    def write_ppu(self, address, data):
+        self.sync_ppu()
+        self._ppu.write_address_from_cpu(0x2000 | (address & 0x07), data)
+
+    def read_io(self, address):
+        if address == 0x4014:
+            # OAMDMA 只能写, 读到的是数据总线上残留的值: 绝对寻址时就是刚取到的地址高字节
+            return address >> 8
+        return self._memory[address]
+
+    def write_io(self, address, data):
+        if address == 0x4014:
+            self.oam_dma(data)
+        elif address in self._ppu.ADD_range:
+            self._ppu.write_address_from_cpu(address, data)
+        else:
+            self._memory[address] = data
+
+    def oam_dma(self, page):
+        '''
+        把 CPU 的第 page 页 ($XX00-$XXFF) 整页复制到 OAM
+        普通存储直接把页表里的 memoryview 切片复制过去, 其他页才一个字节一个字节地读
+        复制期间 CPU 停 513 个周期, 从奇数周期开始时再多等 1 个周期
+        '''
+        self.sync_ppu()
+        view = self.read_pages[page]
+        if view is None:
+            base = page << 8
+            view = bytes(self.read(base | i) for i in range(0x100))
+        self._ppu.oam_dma(view)
+        if self._cpu is not None:
+            self._cpu.cycles += 514 if self._cpu.cycles & 1 else 513
+
+    def write_rom(self, address, data):
+        # PRG-ROM 不能写, 有寄存器的 mapper 会接管这些页的写入
+        pass
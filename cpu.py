@@ -2,11 +2,13 @@ import math
 from enum import IntFlag
 from typing import List
 
-from my_fc.flagbyte import FlagByte
 from my_fc import opcodes
 from my_fc import ppu
 from my_fc import logdiffer
 from my_fc import base_class
+from my_fc import bus
+from my_fc import scheduler
+from my_fc import translator
 
 
 class Vector(IntFlag):
@@ -16,14 +18,6 @@ class Vector(IntFlag):
 
 
 class Registers:
-    PC = 0  # Program Counter
-
-    # A = 0  # Accumulator
-    # X = 0  # Indexes
-    # Y = 0  # Indexes
-    # S = 0xFD  # Stack Pointer
-    _INNER = bytearray([0, 0, 0, 0xFD])
-    _P = FlagByte(0x24)  # Status Register
     r'''
     7  bit  0
     ---- ----
@@ -46,101 +40,94 @@ class Registers:
     当 P 被指令 PLP RTI 设置为栈中弹出的值时，不影响 第 4 5 位
     '''
 
-    @property
-    def A(self):
-        return self._INNER[0]
-
-    @A.setter
-    def A(self, value):
-        self._INNER[0] = value
-
-    @property
-    def X(self):
-        return self._INNER[1]
-
-    @X.setter
-    def X(self, value):
-        self._INNER[1] = value
-
-    @property
-    def Y(self):
-        return self._INNER[2]
-
-    @Y.setter
-    def Y(self, value):
-        self._INNER[2] = value
+    # 每个 CPU 实例都有自己的一组寄存器, 全部是普通的整数字段
+    __slots__ = ('PC', 'A', 'X', 'Y', 'S', '_P', 'z_result', 'n_result')
 
-    @property
-    def S(self):
-        return self._INNER[3]
+    def __init__(self):
+        self.PC = 0  # Program Counter
+        self.A = 0  # Accumulator
+        self.X = 0  # Indexes
+        self.Y = 0  # Indexes
+        self.S = 0xFD  # Stack Pointer
+        self._P = 0x24  # Status Register
+        self.z_result = 1
+        self.n_result = 0
 
-    @S.setter
-    def S(self, value):
-        self._INNER[3] = value
+    # 除 N Z 以外的各个标志位直接存在整数 _P 里
+    # N Z 几乎每条指令都会设置, 所以只记下最近一次设置它们的结果, 真正需要时才换算成标志位:
+    #   Z = 1 当且仅当 z_result == 0
+    #   N = n_result 的第 7 位
+    # 只有 P 被压栈 (PHP BRK 中断) 或者分支指令检查它们时才需要换算
+    NZ_MASK = 0b10000010
 
     @property
     def carry(self):
-        return self._P[0]
+        return self._P & 0x01
 
     @carry.setter
     def carry(self, value):
-        self._P[0] = value
+        self._P = (self._P & ~0x01) | (0x01 if value else 0)
 
     @property
     def zero(self):
-        return self._P[1]
+        return 1 if self.z_result == 0 else 0
 
     @zero.setter
     def zero(self, value):
-        self._P[1] = value
+        self.z_result = 0 if value else 1
 
     @property
     def interrupt_disable(self):
-        return self._P[2]
+        return (self._P >> 2) & 1
 
     @interrupt_disable.setter
     def interrupt_disable(self, value):
-        self._P[2] = value
+        self._P = (self._P & ~0x04) | (0x04 if value else 0)
 
     @property
     def decimal(self):
-        return self._P[3]
+        return (self._P >> 3) & 1
 
     @decimal.setter
     def decimal(self, value):
-        self._P[3] = value
+        self._P = (self._P & ~0x08) | (0x08 if value else 0)
 
     @property
     def b_flag(self):
-        return self._P[4]
+        return (self._P >> 4) & 1
 
     @b_flag.setter
     def b_flag(self, value):
-        self._P[4] = value
+        self._P = (self._P & ~0x10) | (0x10 if value else 0)
 
     @property
     def overflow(self):
-        return self._P[6]
+        return (self._P >> 6) & 1
 
     @overflow.setter
     def overflow(self, value):
-        self._P[6] = value
+        self._P = (self._P & ~0x40) | (0x40 if value else 0)
 
     @property
     def negative(self):
-        return self._P[7]
+        return (self.n_result >> 7) & 1
 
     @negative.setter
     def negative(self, value):
-        self._P[7] = value
+        self.n_result = 0x80 if value else 0
 
     @property
     def P(self):
-        return self._P.value
+        p = self._P & ~self.NZ_MASK
+        if self.z_result == 0:
+            p |= 0x02
+        return p | (self.n_result & 0x80)
 
     @P.setter
     def P(self, value):
-        self._P = FlagByte(value)
+        self._P = value & ~self.NZ_MASK
+        self.z_result = 0 if value & 0x02 else 1
+        self.n_result = value & 0x80
 
     @classmethod
     def to_real_address(cls, sp):
@@ -148,6 +135,9 @@ class Registers:
 
 
 class Cpu(base_class.BaseClass):
+    # 可以出现在空转循环里的指令: 只读内存, 结果只取决于读到的值, 重复执行不会改变状态
+    IDLE_LOOP_INS = ('LDA', 'LDX', 'LDY', 'LAX', 'BIT', 'CMP', 'CPX', 'CPY', 'AND', 'ORA', 'NOP')
+
     def __init__(self, ppu: ppu.PPU):
         super(Cpu, self).__init__()
         json_path = 'nestest_log.json'
@@ -159,6 +149,13 @@ class Cpu(base_class.BaseClass):
         self._registers = Registers()
         self._ppu = ppu
 
+        self.bus = bus.Bus(self._memory, ppu, self)
+        self._read_pages = self.bus.read_pages
+        self._write_pages = self.bus.write_pages
+        self._read_handlers = self.bus.read_handlers
+        self._write_handlers = self.bus.write_handlers
+        self._stack = memoryview(self._memory)[0x100:0x200]  # $0100-$01FF, 用 S 直接下标
+
         self.address_len = {  # 寻址模式和其对应的字节数
             'ABS': 3,  # 绝对寻址
             'IMM': 2,  # 立即寻址
@@ -175,561 +172,871 @@ class Cpu(base_class.BaseClass):
         }
 
         self.opcodes = opcodes.codes
+        self._handlers, self._handlers_by_name = self.build_handlers()
+        self._resolvers = {
+            'ABS': self.address_abs,
+            'IMM': self.address_imm,
+            'IMP': self.address_imp,
+            'ZPG': self.address_zpg,
+            'ABX': self.address_abx,
+            'ABY': self.address_aby,
+            'INX': self.address_inx,
+            'INY': self.address_iny,
+            'ZPX': self.address_zpx,
+            'ZPY': self.address_zpy,
+            'REL': self.address_rel,
+            'IND': self.address_ind,
+        }
+
+        # 有效地址跨页要多花 1 个周期的操作码用这一组解析函数
+        self._page_cross_resolvers = {
+            'ABX': self.address_abx_page_cross,
+            'ABY': self.address_aby_page_cross,
+            'INY': self.address_iny_page_cross,
+        }
+
+        self.cycles = 0  # 上电以来执行的 CPU 周期数
+        self.next_event_cycle = None  # 当前时间片结束的周期 (下一个事件发生的时间), 空转循环最多快进到这里
+        self.scheduler = scheduler.Scheduler(self)
+        self._irq_sources = set()  # 正在拉低 IRQ 线的设备 (mapper, APU)
+        self.stop_on_brk = False  # 调试用: BRK 时停止运行, 而不是进入中断
+        self._idle_loops = {}  # 循环开始的 pc => 每一轮的周期数, 0 表示不是空转循环
+        self._decode_cache = {}  # pc => (handler, resolver, operand, length, cycles)
+        self._code_mark = bytearray(0x8000)  # RAM 中被解码过的字节
+        self._code_version = 0  # 缓存的代码每失效一次 (改写 RAM 里的代码, 切换 PRG bank) 加 1, 正在执行的块靠它发现自己过期了
+
+        self.prg_banks = [-1, -1, -1, -1]  # $8000-$FFFF 四个 8K 窗口当前装载的 PRG bank, -1 表示还是 CPU 自己的内存
+        self._window_code = [{}, {}, {}, {}]  # 每个 8K 窗口里解码过的指令, pc => 缓存项
+        self._banked_code = {}  # (窗口, bank) => 换出去的 bank 的缓存项, 换回来时直接放回解码缓存
+        self.translate = False  # 为 True 时 run() 使用基本块翻译执行引擎
+        self._translator = translator.Translator(self)
 
     @property
     def ppu(self):
         return self._ppu
 
-    def run(self):
+    def reset(self):
         # self._registers.PC = 0xC000  # TODO debug mode, 从第一个16k 的 programdata 的末端开始运行
-        self._registers.PC = self.from_low_high_to_int(self._memory[0xFFFC], self._memory[0xFFFD])
-        self._memory[0x2002] = 0b10100000
+        self._registers.PC = self.from_low_high_to_int(self.read_address(Vector.RESET), self.read_address(Vector.RESET + 1))
 
+    def run(self):
+        self.reset()
+
+        step = self.execute_block if self.translate else self.execute
         while self._running:
-            self.execute()
+            step()
 
-    def execute(self):
+    def trace_info(self):
         # 在获取这一行指令的机器码前
         # 就取得各个寄存器的值（包括 PC)
         # 以和 nestest.log 对比
         # 当然，各个用来做键的字符串，要和下面展示的一样才可以（
-        info = {
-            'PC': self._registers.PC,
-            'A': self._registers.A,
-            'X': self._registers.X,
-            'Y': self._registers.Y,
-            'P': self._registers.P,
-            'S': self._registers.S,
+        # 每执行一条指令前调用一次 self.log_differ.diff(self.trace_info()) 即可逐行对比
+        registers = self._registers
+        pc = registers.PC
+        operand, length = (self._decode_cache.get(pc) or self.decode(pc))[2:4]
+        ins, address_way = self.opcodes[self.read_address(pc)]
+        registers.PC = pc + length
+        address = self._resolvers[address_way](operand)
+        registers.PC = pc
+        if address_way == 'IMM':
+            # nestest_log.json 里立即寻址的 address 记的是立即数本身
+            address = operand
+        return {
+            'PC': pc,
+            'op': ins,
+            'address': address,
+            'A': registers.A,
+            'X': registers.X,
+            'Y': registers.Y,
+            'P': registers.P,
+            'S': registers.S,
         }
 
-        code = self.read_address(self._registers.PC)
+    def execute(self):
+        registers = self._registers
+        pc = registers.PC
+        entry = self._decode_cache.get(pc)
+        if entry is None:
+            entry = self.decode(pc)
+        handler, resolver, operand, length, cycles = entry
+
+        registers.PC = pc + length
+        self.cycles += cycles
+        handler(resolver(operand))
+        self._count += 1
+
+    def run_cycles(self, budget):
+        '''
+        一直执行到用完 budget 个周期为止 (最后一条指令可能会超出一点)
+        调度器可以用它把 CPU PPU APU 按固定的时间片交替运行
+        :param budget:
+        :return: 实际执行的周期数
+        '''
+        start = self.cycles
+        end = start + budget
+        scheduler = self.scheduler
+        step = self.execute_block if self.translate else self.execute
+        while self._running and self.cycles < end:
+            # 一直跑到下一个事件, 中间不检查中断; 时间片内不会有外部事件, 空转循环可以直接快进到时间片结束
+            # 执行过程中安排了更早的事件时, scheduler 会把 next_event_cycle 提前
+            self.next_event_cycle = min(end, scheduler.next_cycle(end))
+            while self._running and self.cycles < self.next_event_cycle:
+                step()
+            scheduler.run_due(self.cycles)
+        self.next_event_cycle = None
+        return self.cycles - start
+
+    def interrupt(self, vector: Vector, brk=False):
+        # 压入 PC 和 P, 屏蔽 IRQ, 跳到中断向量; 只有 BRK 压入的 P 的第 4 位是 1
+        registers = self._registers
+        self.push_stack_word(registers.PC)
+        self.push_stack((registers.P & 0xEF) | 0x20 | (0x10 if brk else 0))
+        registers.interrupt_disable = 1
+        registers.PC = self.read_address(vector) | (self.read_address(vector + 1) << 8)
+
+    def nmi(self, cycle=None):
+        self.interrupt(Vector.NMI)
+        self.cycles += 7
+
+    def set_irq(self, source, active):
+        '''
+        source 拉低 (active) 或者释放 IRQ 线
+        IRQ 是电平触发的, 只要还有设备拉着并且没有屏蔽, 就安排一次中断
+        '''
+        if active:
+            self._irq_sources.add(source)
+            self.poll_irq()
+        else:
+            self._irq_sources.discard(source)
+
+    def poll_irq(self):
+        # 在 IRQ 线拉低, 或者 CLI PLP RTI 清掉 I 标志时调用
+        if self._irq_sources and not self._registers.interrupt_disable:
+            self.scheduler.schedule('irq', self.cycles, self.irq)
+
+    def irq(self, cycle=None):
+        if self._irq_sources and not self._registers.interrupt_disable:
+            self.interrupt(Vector.IRQBRK)
+            self.cycles += 7
+
+    def skip_idle_loop(self, start, end):
+        '''
+        分支刚刚跳回 start, [start, end) 是一个循环
+        如果这是一个只读不写的轮询循环 (比如 LDA $2002 / BPL), 那么在下一个事件到来之前
+        每一轮读到的值都一样, 寄存器和标志位也一样, 直接跳过这些轮次, 只把周期数记上
+        '''
+        loop = self._idle_loops.get(start)
+        if loop is None:
+            # 第一次跳回来时可能是从循环中间进入的, 先完整地执行一轮再快进
+            self._idle_loops[start] = self.analyse_idle_loop(start, end)
+        elif loop:
+            rounds = (self.next_event_cycle - self.cycles) // loop
+            if rounds > 0:
+                self.cycles += rounds * loop
+
+    def analyse_idle_loop(self, start, end):
+        '''
+        判断 [start, end) 是不是没有副作用的轮询循环
+        循环体只能是从固定地址读数据的指令 (RAM, $2002, ROM), 最后一条是跳回 start 的分支
+        :return: 每一轮的周期数, 不是空转循环时返回 0
+        '''
+        if start < 0x8000 or end - start > 16:
+            return 0
+        cycles = 0
+        pc = start
+        while pc < end:
+            code = self.read_address(pc)
+            ins, address_way = self.opcodes[code]
+            length = self.address_len[address_way]
+            cycles += opcodes.cycles[code]
+            if pc + length == end:
+                # 最后一条必须是跳回 start 的分支, 跳转本身多花 1 或 2 个周期
+                if address_way != 'REL':
+                    return 0
+                return cycles + (2 if (start ^ end) & 0xFF00 else 1)
+            if ins not in self.IDLE_LOOP_INS or address_way not in ('IMM', 'IMP', 'ZPG', 'ABS'):
+                return 0
+            if address_way == 'ABS':
+                address = self.read_address(pc + 1) | (self.read_address(pc + 2) << 8)
+                if 0x2000 <= address < 0x6000 and address != 0x2002:
+                    return 0
+            pc += length
+        return 0
+
+    def execute_block(self):
+        '''
+        可选的执行引擎, 一次执行一整个翻译好的基本块
+        :return: 执行的指令条数
+        '''
+        return self._translator.execute()
+
+    def bank_of(self, pc):
+        if pc < 0x8000:
+            return -1
+        return self.prg_banks[(pc - 0x8000) >> 13]
+
+    def decode(self, pc):
+        '''
+        解码 pc 处的指令, 结果放进以 pc 为键的解码缓存
+        缓存项: (处理函数, 寻址模式解析函数, 操作数, 指令长度, 基础周期数)
+        PRG-ROM 里的缓存项一直有效, 直到 mapper 切换了对应的 bank
+        RAM 里的缓存项在指令所在的字节被写入时丢弃
+        :param pc:
+        :return: entry
+        '''
+        code = self.read_address(pc)
         if code not in self.opcodes:
             raise ValueError('无法解析的操作命令')
-        code_tuple = self.opcodes[code]
-        ins, address_way = code_tuple
-
-        address, data = self.to_real_address(address_way)
-        # info['op'] = ins
-        # info['address'] = address
-        # #
-        # # # 用存了以上信息的 info 调用 diff 方法
-        # # # 第一次调用 diff() 方法，是和 log 的第一行进行比较
-        # # # 第二次调用，则和第二行进行比较，以此类推
-        # # # 所以像这样每次只传一行的信息进去即可
-        # try:
-        #     self.log_differ.diff(info)
-        # except logdiffer.AllTestsPassed:
-        #     # 通过所有测试之后会引发这个 AllTestsPassed 的自定义异常
-        #     # 感谢 AD 聚聚友情 PR
-        #     self._running = False
-
-        # 测试PPU相关处理代码
-        # print(self._count)
-        # if self._count == 20000:
-        #     d = [int(i) for i in self.ppu.memory[0x2000:0x23FF + 1]]
-        #     if d == [32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 82, 117, 110, 32, 97, 108, 108, 32, 116, 101, 115, 116,
-        #              115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 66, 114, 97, 110,
-        #              99, 104, 32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 45, 45, 32, 70, 108, 97, 103, 32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 73, 109, 109, 101, 100, 105, 97, 116, 101,
-        #              32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 45, 45, 32,
-        #              73, 109, 112, 108, 105, 101, 100, 32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 83, 116, 97, 99, 107, 32, 116, 101, 115, 116, 115, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 65, 99, 99, 117, 109,
-        #              117, 108, 97, 116, 111, 114, 32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 45, 45, 32, 40, 73, 110, 100, 105, 114, 101, 99, 116, 44, 88, 41, 32, 116, 101, 115, 116,
-        #              115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 90, 101, 114, 111, 112, 97, 103, 101,
-        #              32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 45, 45,
-        #              32, 65, 98, 115, 111, 108, 117, 116, 101, 32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 40, 73, 110, 100, 105, 114, 101, 99, 116, 41, 44, 89,
-        #              32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 65, 98, 115,
-        #              111, 108, 117, 116, 101, 44, 89, 32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 45, 45, 32, 90, 101, 114, 111, 112, 97, 103, 101, 44, 88, 32, 116, 101, 115, 116,
-        #              115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 45, 45, 32, 65, 98, 115, 111, 108, 117,
-        #              116, 101, 44, 88, 32, 116, 101, 115, 116, 115, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 85, 112, 47, 68, 111, 119, 110, 58, 32,
-        #              115, 101, 108, 101, 99, 116, 32, 116, 101, 115, 116, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 83, 116, 97, 114, 116, 58, 32, 114, 117, 110, 32, 116, 101, 115, 116, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 83, 101, 108, 101, 99, 116, 58, 32, 73, 110, 118,
-        #              97, 108, 105, 100, 32, 111, 112, 115, 33, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32,
-        #              32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 32, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-        #              0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-        #              0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]:
-        #         raise ValueError('成功啦')
-        #     else:
-        #         raise ValueError('失败啦')
-
-        self.habdle_ins(ins, address, data)
-        self._count += 1
+        address_way = self.opcodes[code][1]
+        length = self.address_len[address_way]
+
+        read = self.read_address
+        if length == 1:
+            operand = 0
+        elif length == 2:
+            operand = read(pc + 1)
+        else:
+            operand = read(pc + 1) | (read(pc + 2) << 8)
+
+        if code in opcodes.PAGE_CROSS:
+            resolver = self._page_cross_resolvers[address_way]
+        else:
+            resolver = self._resolvers[address_way]
+        entry = (self._handlers[code], resolver, operand, length, opcodes.cycles[code])
+        if pc < 0x8000:
+            self.mark_code(pc, pc + length)
+        elif (pc ^ (pc + length - 1)) & 0xE000:
+            # 跨两个 8K 窗口的指令不缓存, 两边哪一个切换 bank 它都会变
+            return entry
+        else:
+            self._window_code[(pc - 0x8000) >> 13][pc] = entry
+        self._decode_cache[pc] = entry
+        return entry
+
+    def mark_code(self, start, end):
+        # [start, end) 里的字节被解码过; $0800-$1FFF 的镜像折叠到 2K RAM 上标记, 和写入时检查的位置一致
+        if start < 0x2000:
+            for address in range(start, end):
+                self._code_mark[address & 0x07FF] = 1
+        else:
+            self._code_mark[start:end] = b'\x01' * (end - start)
+
+    def invalidate_decode(self, address):
+        '''
+        address 处的字节被改写, 丢弃所有覆盖了这个字节的缓存项
+        address 是折叠后的实际位置, 2K RAM 里的字节可能是从任何一个镜像地址解码的
+        '''
+        cache = self._decode_cache
+        mirrors = range(address, 0x2000, 0x800) if address < 0x800 else (address,)
+        for mirror in mirrors:
+            for pc in range(mirror - 2, mirror + 1):
+                entry = cache.get(pc)
+                if entry is not None and pc + entry[3] > mirror:
+                    del cache[pc]
+        self._translator.invalidate(address)
+        self._code_version += 1
+
+    def reset_code_cache(self):
+        '''
+        换了卡带 (载入新的 ROM 或 mapper) 时调用
+        所有缓存都只以 pc 和 bank 号为键, 新 ROM 的 bank 号和旧的一样, 必须全部丢弃
+        '''
+        self.prg_banks[:] = [-1, -1, -1, -1]
+        self._decode_cache.clear()
+        self._window_code = [{}, {}, {}, {}]
+        self._banked_code.clear()
+        self._idle_loops.clear()
+        self._code_mark[:] = bytes(len(self._code_mark))
+        self._translator.clear()
+        self._code_version += 1
+
+    def switch_prg_bank(self, window, bank):
+        '''
+        mapper 把 $8000 + window * $2000 的 8K 窗口换成第 bank 个 PRG bank 之后调用
+        只换出这一个窗口的解码缓存项, 按 (窗口, bank) 存起来, 这个 bank 换回来时直接放回去, 不用重新解码
+        翻译好的块以 (bank, pc) 为键并且不跨窗口, 不需要丢弃
+        '''
+        old = self.prg_banks[window]
+        if old == bank:
+            return
+        cache = self._decode_cache
+        code = self._window_code[window]
+        for pc in code:
+            del cache[pc]
+        if old >= 0:
+            self._banked_code[window, old] = code
+        code = self._banked_code.pop((window, bank), {})
+        cache.update(code)
+        self._window_code[window] = code
+        self.prg_banks[window] = bank
+        self._code_version += 1
+
+        start = 0x8000 + window * 0x2000
+        for pc in [pc for pc in self._idle_loops if start - 16 <= pc < start + 0x2000]:
+            del self._idle_loops[pc]
+
+    def habdle_ins(self, ins, address):
+        self._handlers_by_name[ins](address)
 
-    def habdle_ins(self, ins, address, data):
-        if ins == 'JMP':
-            self._registers.PC = address
-        elif ins == 'BRK':
+    def build_handlers(self):
+        '''
+        由 opcodes.codes 构建以操作码为下标的 256 项处理函数表
+        同一个助记符的所有操作码共享同一个绑定方法, 执行时直接按下标取出调用, 不再逐个比较字符串
+        :return: handlers, handlers_by_name
+        '''
+        handlers_by_name = {}
+        handlers = [None] * 256
+        for code, (ins, _) in self.opcodes.items():
+            if ins not in handlers_by_name:
+                handler = getattr(self, 'ins_{}'.format(ins.lower()), None)
+                if handler is None:
+                    handler = self.not_implemented(ins)
+                handlers_by_name[ins] = handler
+            handlers[code] = handlers_by_name[ins]
+        return handlers, handlers_by_name
+
+    @staticmethod
+    def not_implemented(ins):
+        def handler(address):
+            raise NotImplementedError("稍等一下, {} 指令还没实现".format(ins))
+
+        return handler
+
+    def branch(self, address):
+        # 分支跳转时多花 1 个周期, 跳到另一页时再多花 1 个周期
+        registers = self._registers
+        pc = registers.PC
+        self.cycles += 2 if (pc ^ address) & 0xFF00 else 1
+        registers.PC = address
+        if address < pc and self.next_event_cycle is not None:
+            self.skip_idle_loop(address, pc)
+
+    def ins_jmp(self, address):
+        self._registers.PC = address
+
+    def ins_brk(self, address):
+        if self.stop_on_brk:
             self._running = False
             return
-        elif ins == 'LDX':
-            self._registers.X = data
-            self.set_zero_negative(data)
-        elif ins == 'STX':
-            self.write_address(address, self._registers.X)
-        elif ins == 'JSR':
-            pc = self._registers.PC - 1
-            self.push_stack(pc, hex_digit=True)
-            self._registers.PC = address
-        elif ins == 'SEC':
-            self._registers.carry = 1
-        elif ins == 'SEI':
-            self._registers.interrupt_disable = 1
-        elif ins == 'SED':
-            self._registers.decimal = 1
-        elif ins == 'BCS':
-            if self._registers.carry == 1:
-                self._registers.PC = address
-        elif ins == 'CLC':
-            self._registers.carry = 0
-        elif ins == 'BCC':
-            if self._registers.carry == 0:
-                self._registers.PC = address
-        elif ins == 'LDA':
-            self._registers.A = data
-            self.set_zero_negative(data)
-        elif ins == 'BEQ':
-            if self._registers.zero == 1:
-                self._registers.PC = address
-        elif ins == 'BNE':
-            if self._registers.zero == 0:
-                self._registers.PC = address
-        elif ins == 'STA':
-            self.write_address(address, self._registers.A)
-        elif ins == 'STY':
-            self.write_address(address, self._registers.Y)
-        elif ins == 'BIT':
-            zf = 0 if self._registers.A & data else 1
-            self._registers.zero = zf
-            self.set_negative(data)
-            self.set_overflow(data)
-        elif ins == 'BVS':
-            if self._registers.overflow == 1:
-                self._registers.PC = address
-        elif ins == 'BVC':
-            if self._registers.overflow == 0:
-                self._registers.PC = address
-        elif ins == 'BPL':
-            if self._registers.negative == 0:
-                self._registers.PC = address
-        elif ins == 'RTS':
-            pc = self.pop_stack(hex_digit=True)
-            self._registers.PC = pc + 1
-        elif ins == 'PHP':
-            p = FlagByte(self._registers.P)
-            p[4] = 1  # 当 P 被 指令 PHP BRK 压入栈时， 压入的 P 的第 4 位被设置成 1
-            self.push_stack(p.value)
-        elif ins == 'PLA':
-            data_ = self.pop_stack()
-            self.set_zero_negative(data_)
-            self._registers.A = data_
-        elif ins == 'PLP':
-            data_ = FlagByte(self.pop_stack())
-            # 用弹出的值的 第 0 1 2 3 6 7 位 来设置 P 的 第 0 1 2 3 6 7 位 的值
-            pre_p = self._registers.P
-            pre_p = FlagByte(pre_p)
-            data_[4] = pre_p[4]
-            data_[5] = pre_p[5]
-            self._registers.P = data_.value
-        elif ins == 'AND':
+        # BRK 后面还有一个填充字节, 返回地址跳过它
+        self._registers.PC += 1
+        self.interrupt(Vector.IRQBRK, brk=True)
+
+    def ins_ldx(self, address):
+        data = self.read_address(address)
+        self._registers.X = data
+        self.set_zero_negative(data)
+
+    def ins_stx(self, address):
+        self.write_address(address, self._registers.X)
+
+    def ins_jsr(self, address):
+        pc = self._registers.PC - 1
+        self.push_stack_word(pc)
+        self._registers.PC = address
+
+    def ins_sec(self, address):
+        self._registers.carry = 1
+
+    def ins_sei(self, address):
+        self._registers.interrupt_disable = 1
+
+    def ins_cli(self, address):
+        self._registers.interrupt_disable = 0
+        self.poll_irq()
+
+    def ins_sed(self, address):
+        self._registers.decimal = 1
+
+    def ins_bcs(self, address):
+        if self._registers.carry == 1:
+            self.branch(address)
+
+    def ins_clc(self, address):
+        self._registers.carry = 0
+
+    def ins_bcc(self, address):
+        if self._registers.carry == 0:
+            self.branch(address)
+
+    def ins_lda(self, address):
+        data = self.read_address(address)
+        self._registers.A = data
+        self.set_zero_negative(data)
+
+    def ins_beq(self, address):
+        if self._registers.z_result == 0:
+            self.branch(address)
+
+    def ins_bne(self, address):
+        if self._registers.z_result != 0:
+            self.branch(address)
+
+    def ins_sta(self, address):
+        self.write_address(address, self._registers.A)
+
+    def ins_sty(self, address):
+        self.write_address(address, self._registers.Y)
+
+    def ins_bit(self, address):
+        data = self.read_address(address)
+        self._registers.z_result = self._registers.A & data
+        self.set_negative(data)
+        self.set_overflow(data)
+
+    def ins_bvs(self, address):
+        if self._registers.overflow == 1:
+            self.branch(address)
+
+    def ins_bvc(self, address):
+        if self._registers.overflow == 0:
+            self.branch(address)
+
+    def ins_bpl(self, address):
+        if not self._registers.n_result & 0x80:
+            self.branch(address)
+
+    def ins_rts(self, address):
+        pc = self.pop_stack_word()
+        self._registers.PC = (pc + 1) & 0xFFFF
+
+    def ins_php(self, address):
+        # 当 P 被 指令 PHP BRK 压入栈时， 压入的 P 的第 4 位被设置成 1
+        self.push_stack(self._registers.P | 0x10)
+
+    def ins_pla(self, address):
+        data_ = self.pop_stack()
+        self.set_zero_negative(data_)
+        self._registers.A = data_
+
+    def ins_plp(self, address):
+        data_ = self.pop_stack()
+        # 用弹出的值的 第 0 1 2 3 6 7 位 来设置 P 的 第 0 1 2 3 6 7 位 的值
+        self._registers.P = (data_ & 0xCF) | (self._registers.P & 0x30)
+        self.poll_irq()
+
+    def ins_and(self, address):
+        data = self.read_address(address)
+        a = self._registers.A
+        a &= data
+        self.set_zero_negative(a)
+        self._registers.A = a
+
+    def ins_cmp(self, address):
+        data = self.read_address(address)
+        result = self._registers.A - data
+        self.set_zero_negative(result)
+        self.set_carry(result >= 0)
+
+    def ins_cld(self, address):
+        self._registers.decimal = 0
+
+    def ins_pha(self, address):
+        self.push_stack(self._registers.A)
+
+    def ins_ora(self, address):
+        data = self.read_address(address)
+        self._registers.A |= data
+        self.set_zero_negative(self._registers.A)
+
+    def ins_clv(self, address):
+        self._registers.overflow = 0
+
+    def ins_eor(self, address):
+        data = self.read_address(address)
+        self._registers.A ^= data
+        self.set_zero_negative(self._registers.A)
+
+    def ins_adc(self, address):
+        data = self.read_address(address)
+        a = self._registers.A
+        result = self._registers.A + data + self._registers.carry
+        self.set_carry(result >> 8)
+        low = result & 0xFF
+        self._registers.A = low
+        self.set_overflow_by_expression(not ((a ^ data) & 0x80) and ((a ^ low) & 0x80))
+        self.set_zero_negative(low)
+
+    def ins_ldy(self, address):
+        data = self.read_address(address)
+        self._registers.Y = data
+        self.set_zero_negative(data)
+
+    def ins_cpy(self, address):
+        data = self.read_address(address)
+        res = self._registers.Y - data
+        self.set_carry(self._registers.Y >= data)
+        self.set_zero_negative(res)
+
+    def ins_cpx(self, address):
+        data = self.read_address(address)
+        res = self._registers.X - data
+        self.set_carry(self._registers.X >= data)
+        self.set_zero_negative(res)
+
+    def ins_sbc(self, address):
+        data = self.read_address(address)
+        res = self._registers.A - data - (0 if self._registers.carry else 1)
+        low, high = self.split_number(res)
+        self.set_carry(not high)
+        self.set_overflow_by_expression(((self._registers.A ^ data) & 0x80) & ((self._registers.A ^ high) & 0x80))
+        self._registers.A = low
+        self.set_zero_negative(low)
+
+    def ins_iny(self, address):
+        res = self._registers.Y + 1
+        res = self.eight_digit(res)
+        self.set_zero_negative(res)
+        self._registers.Y = res
+
+    def ins_inx(self, address):
+        res = self._registers.X + 1
+        res = self.eight_digit(res)
+        self.set_zero_negative(res)
+        self._registers.X = res
+
+    def ins_dey(self, address):
+        res = self._registers.Y - 1
+        res = self.eight_digit(res)
+        self.set_zero_negative(res)
+        self._registers.Y = res
+
+    def ins_dex(self, address):
+        res = self._registers.X - 1
+        res = self.eight_digit(res)
+        self.set_zero_negative(res)
+        self._registers.X = res
+
+    def ins_tay(self, address):
+        res = self._registers.A
+        self.set_zero_negative(res)
+        self._registers.Y = res
+
+    def ins_tax(self, address):
+        res = self._registers.A
+        self.set_zero_negative(res)
+        self._registers.X = res
+
+    def ins_tya(self, address):
+        res = self._registers.Y
+        self.set_zero_negative(res)
+        self._registers.A = res
+
+    def ins_txa(self, address):
+        res = self._registers.X
+        self.set_zero_negative(res)
+        self._registers.A = res
+
+    def ins_tsx(self, address):
+        res = self._registers.S
+        self.set_zero_negative(res)
+        self._registers.X = res
+
+    def ins_txs(self, address):
+        res = self._registers.X
+        self._registers.S = res
+
+    def ins_rti(self, address):
+        p = self.pop_stack()
+        self._registers.P = (p & 0xCF) | (self._registers.b_flag << 4) | 0x20
+        self._registers.PC = self.pop_stack_word()
+        self.poll_irq()
+
+    def ins_lsr(self, address):
+        if address != -1:
+            a = self.read_address(address)
+        else:
             a = self._registers.A
-            a &= data
-            self.set_zero_negative(a)
+        self._registers.carry = a & 1
+        a >>= 1
+        a = self.eight_digit(a)
+        self.set_zero_negative(a)
+        if address != -1:
+            self.write_address(address, a)
+        else:
             self._registers.A = a
-        elif ins == 'CMP':
-            result = self._registers.A - data
-            self.set_zero_negative(result)
-            self.set_negative(result)
-            self.set_carry(result >= 0)
-        elif ins == 'CLD':
-            self._registers.decimal = 0
-        elif ins == 'PHA':
-            self.push_stack(self._registers.A)
-        elif ins == 'ORA':
-            self._registers.A |= data
-            self.set_zero_negative(self._registers.A)
-        elif ins == 'CLV':
-            self._registers.overflow = 0
-        elif ins == 'EOR':
-            self._registers.A ^= data
-            self.set_zero_negative(self._registers.A)
-        elif ins == 'ADC':
+
+    def ins_asl(self, address):
+        if address != -1:
+            a = self.read_address(address)
+        else:
             a = self._registers.A
-            result = self._registers.A + data + self._registers.carry
-            self.set_carry(result >> 8)
-            low, high = self.split_number(result)
-            self._registers.A = low
-            self.set_overflow_by_expression(not ((a ^ data) & 0x80) and ((a ^ low) & 0x80))
-            self.set_zero_negative(low)
-        elif ins == 'LDY':
-            self._registers.Y = data
-            self.set_zero_negative(data)
-        elif ins == 'CPY':
-            res = self._registers.Y - data
-            self.set_carry(self._registers.Y >= data)
-            self.set_zero_negative(res)
-        elif ins == 'CPX':
-            res = self._registers.X - data
-            self.set_carry(self._registers.X >= data)
-            self.set_zero_negative(res)
-        elif ins == 'SBC':
-            res = self._registers.A - data - (0 if self._registers.carry else 1)
-            low, high = self.split_number(res)
-            self.set_carry(not high)
-            self.set_overflow_by_expression(((self._registers.A ^ data) & 0x80) & ((self._registers.A ^ high) & 0x80))
-            self._registers.A = low
-            self.set_zero_negative(low)
-        elif ins == 'INY':
-            res = self._registers.Y + 1
-            res = self.eight_digit(res)
-            self.set_zero_negative(res)
-            self._registers.Y = res
-        elif ins == 'INX':
-            res = self._registers.X + 1
-            res = self.eight_digit(res)
-            self.set_zero_negative(res)
-            self._registers.X = res
-        elif ins == 'DEY':
-            res = self._registers.Y - 1
-            res = self.eight_digit(res)
-            self.set_zero_negative(res)
-            self._registers.Y = res
-        elif ins == 'DEX':
-            res = self._registers.X - 1
-            res = self.eight_digit(res)
-            self.set_zero_negative(res)
-            self._registers.X = res
-        elif ins == 'TAY':
-            res = self._registers.A
-            self.set_zero_negative(res)
-            self._registers.Y = res
-        elif ins == 'TAX':
-            res = self._registers.A
-            self.set_zero_negative(res)
-            self._registers.X = res
-        elif ins == 'TYA':
-            res = self._registers.Y
-            self.set_zero_negative(res)
-            self._registers.A = res
-        elif ins == 'TXA':
-            res = self._registers.X
-            self.set_zero_negative(res)
-            self._registers.A = res
-        elif ins == 'TSX':
-            res = self._registers.S
-            self.set_zero_negative(res)
-            self._registers.X = res
-        elif ins == 'TXS':
-            res = self._registers.X
-            self._registers.S = res
-        elif ins == 'RTI':
-            p = self.pop_stack()
-            p = FlagByte(p)
-            p[4] = self._registers.b_flag
-            p[5] = 1
-            self._registers.P = p.value
-            self._registers.PC = self.pop_stack(hex_digit=True)
-        elif ins == 'LSR':
-            if address != -1:
-                a = data
-            else:
-                a = self._registers.A
-            self._registers.carry = a & 1
-            a >>= 1
-            a = self.eight_digit(a)
-            self.set_zero_negative(a)
-            if address != -1:
-                self.write_address(address, a)
-            else:
-                self._registers.A = a
-        elif ins == 'ASL':
-            if address != -1:
-                a = data
-            else:
-                a = self._registers.A
-            self._registers.carry = a >> 7
-            a <<= 1
-            a = self.eight_digit(a)
-            self.set_zero_negative(a)
-            if address != -1:
-                self.write_address(address, a)
-            else:
-                self._registers.A = a
-        elif ins == 'ROR':
-            if address != -1:
-                a = data
-            else:
-                a = self._registers.A
-            zero = a & 1
-            a >>= 1
-            a ^= self._registers.carry << 7
-            self._registers.carry = zero
-            a = self.eight_digit(a)
-            self.set_zero_negative(a)
-            if address != -1:
-                self.write_address(address, a)
-            else:
-                self._registers.A = a
-        elif ins == 'ROL':
-            if address != -1:
-                a = data
-            else:
-                a = self._registers.A
-            seven = (a & 1 << 7) >> 7
-            a <<= 1
-            a ^= self._registers.carry
-            self._registers.carry = seven
-            a = self.eight_digit(a)
-            self.set_zero_negative(a)
-            if address != -1:
-                self.write_address(address, a)
-            else:
-                self._registers.A = a
-        elif ins == 'NOP':
-            pass
-        elif ins == 'BMI':
-            if self._registers.negative == 1:
-                self._registers.PC = address
-        elif ins == "INC":
-            d = self.eight_digit(data + 1)
-            self.set_zero_negative(d)
-            self.write_address(address, d)
-        elif ins == "DEC":
-            d = self.eight_digit(data - 1)
-            self.set_zero_negative(d)
-            self.write_address(address, d)
-        elif ins == 'LAX':
-            self._registers.X = self._registers.A = data
-            self.set_zero_negative(data)
-        elif ins == 'SAX':
-            self.write_address(address, self._registers.A & self._registers.X)
-        elif ins == 'DCP':
-            data -= 1
-            data = self.eight_digit(data)
-            self.write_address(address, data)
-            result = self.hex_digit(self._registers.A - data)
-            self.set_carry(result < 0x100)
-            self.set_zero_negative(self.eight_digit(result))
-        elif ins == 'ISB':
-            data += 1
-            data = self.eight_digit(data)
-            self.write_address(address, data)
-
-            resul16 = self.hex_digit(self._registers.A - data - (0 if self._registers.carry else 1))
-            self.set_carry(not resul16 >> 8)
-            result8 = self.eight_digit(resul16)
-            A = self._registers.A
-            self.set_overflow_by_expression(((A ^ result8) & 0x80) and ((A ^ data) & 0x80))
-            self._registers.A = result8
-            self.set_zero_negative(result8)
-        elif ins == 'SLO':
-            self.set_carry(data >> 7)
-            data <<= 1
-            data = self.eight_digit(data)
-            self.write_address(address, data)
-            self._registers.A |= data
-            self.set_zero_negative(self._registers.A)
-        elif ins == 'RLA':
-            data <<= 1
-            data = self.hex_digit(data)
-            if self._registers.carry:
-                data |= 0x1
-            self.set_carry(data > 0xff)
-            result8 = self.eight_digit(data)
-            self.write_address(address, result8)
-            a = self._registers.A & result8
-            self.set_zero_negative(a)
+        self._registers.carry = a >> 7
+        a <<= 1
+        a = self.eight_digit(a)
+        self.set_zero_negative(a)
+        if address != -1:
+            self.write_address(address, a)
+        else:
             self._registers.A = a
-        elif ins == 'SRE':
-            self.set_carry(data & 1)
-            data >>= 1
-            data = self.eight_digit(data)
-            self.write_address(address, data)
+
+    def ins_ror(self, address):
+        if address != -1:
+            a = self.read_address(address)
+        else:
             a = self._registers.A
-            a ^= data
-            self.set_zero_negative(a)
+        zero = a & 1
+        a >>= 1
+        a ^= self._registers.carry << 7
+        self._registers.carry = zero
+        a = self.eight_digit(a)
+        self.set_zero_negative(a)
+        if address != -1:
+            self.write_address(address, a)
+        else:
             self._registers.A = a
-        elif ins == 'RRA':
-            if self._registers.carry:
-                data |= 0x100
-            self._registers.carry = data & 1
-            data >>= 1
-            self.write_address(address, self.eight_digit(data))
 
+    def ins_rol(self, address):
+        if address != -1:
+            a = self.read_address(address)
+        else:
             a = self._registers.A
-            resul16 = a + data + (1 if self._registers.carry else 0)
-            self.set_carry(resul16 >> 8)
-            result8 = self.eight_digit(resul16)
-            self.set_overflow_by_expression(not ((a ^ data) & 0x80) and ((a ^ result8) & 0x80))
-            self._registers.A = result8
-            self.set_zero_negative(result8)
+        seven = (a & 1 << 7) >> 7
+        a <<= 1
+        a ^= self._registers.carry
+        self._registers.carry = seven
+        a = self.eight_digit(a)
+        self.set_zero_negative(a)
+        if address != -1:
+            self.write_address(address, a)
         else:
-            raise NotImplementedError("稍等一下, {} 指令还没实现".format(ins))
+            self._registers.A = a
+
+    def ins_nop(self, address):
+        pass
+
+    def ins_bmi(self, address):
+        if self._registers.n_result & 0x80:
+            self.branch(address)
+
+    def ins_inc(self, address):
+        data = self.read_address(address)
+        d = self.eight_digit(data + 1)
+        self.set_zero_negative(d)
+        self.write_address(address, d)
+
+    def ins_dec(self, address):
+        data = self.read_address(address)
+        d = self.eight_digit(data - 1)
+        self.set_zero_negative(d)
+        self.write_address(address, d)
+
+    def ins_lax(self, address):
+        data = self.read_address(address)
+        self._registers.X = self._registers.A = data
+        self.set_zero_negative(data)
+
+    def ins_sax(self, address):
+        self.write_address(address, self._registers.A & self._registers.X)
+
+    def ins_dcp(self, address):
+        data = self.read_address(address)
+        data -= 1
+        data = self.eight_digit(data)
+        self.write_address(address, data)
+        result = self.hex_digit(self._registers.A - data)
+        self.set_carry(result < 0x100)
+        self.set_zero_negative(self.eight_digit(result))
+
+    def ins_isb(self, address):
+        data = self.read_address(address)
+        data += 1
+        data = self.eight_digit(data)
+        self.write_address(address, data)
+
+        resul16 = self.hex_digit(self._registers.A - data - (0 if self._registers.carry else 1))
+        self.set_carry(not resul16 >> 8)
+        result8 = self.eight_digit(resul16)
+        A = self._registers.A
+        self.set_overflow_by_expression(((A ^ result8) & 0x80) and ((A ^ data) & 0x80))
+        self._registers.A = result8
+        self.set_zero_negative(result8)
+
+    def ins_slo(self, address):
+        data = self.read_address(address)
+        self.set_carry(data >> 7)
+        data <<= 1
+        data = self.eight_digit(data)
+        self.write_address(address, data)
+        self._registers.A |= data
+        self.set_zero_negative(self._registers.A)
+
+    def ins_rla(self, address):
+        data = self.read_address(address)
+        data <<= 1
+        data = self.hex_digit(data)
+        if self._registers.carry:
+            data |= 0x1
+        self.set_carry(data > 0xff)
+        result8 = self.eight_digit(data)
+        self.write_address(address, result8)
+        a = self._registers.A & result8
+        self.set_zero_negative(a)
+        self._registers.A = a
+
+    def ins_sre(self, address):
+        data = self.read_address(address)
+        self.set_carry(data & 1)
+        data >>= 1
+        data = self.eight_digit(data)
+        self.write_address(address, data)
+        a = self._registers.A
+        a ^= data
+        self.set_zero_negative(a)
+        self._registers.A = a
+
+    def ins_rra(self, address):
+        data = self.read_address(address)
+        if self._registers.carry:
+            data |= 0x100
+        self._registers.carry = data & 1
+        data >>= 1
+        self.write_address(address, self.eight_digit(data))
+
+        a = self._registers.A
+        resul16 = a + data + (1 if self._registers.carry else 0)
+        self.set_carry(resul16 >> 8)
+        result8 = self.eight_digit(resul16)
+        self.set_overflow_by_expression(not ((a ^ data) & 0x80) and ((a ^ result8) & 0x80))
+        self._registers.A = result8
+        self.set_zero_negative(result8)
 
     def set_negative(self, data):
-        data = FlagByte(data)
-        negative = data[7]
-        self._registers.negative = negative
+        self._registers.n_result = data
 
     def set_overflow(self, data):
-        data = FlagByte(data)
-        overflow = data[6]
-        self._registers.overflow = overflow
+        self._registers.overflow = (data >> 6) & 1
 
     def set_overflow_by_expression(self, expression):
         self._registers.overflow = 1 if expression else 0
 
     def set_zero_negative(self, data):
-        if data == 0:
-            self._registers.zero = 1
-        else:
-            self._registers.zero = 0
-
-        self.set_negative(data)
+        registers = self._registers
+        registers.z_result = data
+        registers.n_result = data
 
     def set_carry(self, expression):
         self._registers.carry = 1 if expression else 0
 
-    def to_real_address(self, address: str):
-        '''
-        :param address:
-        :return: real_address, data
-        '''
-        old_pc = self._registers.PC
-        self._registers.PC += self.address_len[address]
+    # 各寻址模式的解析函数, 在解码时选定, 只计算有效地址, 不读取目标字节
+    # 需要操作数的指令自己去读, 读-改-写指令只读一次写一次
+    # operand 是解码时取出的操作数, 调用时 PC 已经指向下一条指令
+    def address_abs(self, operand):
+        return operand
+
+    def address_imp(self, operand):
+        return -1
+
+    def address_imm(self, operand):
+        # 立即数就在指令的第二个字节
+        return self._registers.PC - 1
+
+    def address_zpg(self, operand):
+        return operand
+
+    def address_rel(self, operand):
+        return self._registers.PC + (operand - 256 if operand > 127 else operand)
+
+    def address_abx(self, operand):
+        return (operand + self._registers.X) & 0xFFFF
+
+    def address_aby(self, operand):
+        return (operand + self._registers.Y) & 0xFFFF
+
+    def address_inx(self, operand):
         m = self._memory
-        pc = self._registers.PC
-
-        def safe_fetch(addr):
-            if addr > len(self._memory) - 1 or addr < 0:
-                return -1
-            else:
-                return self._memory[addr]
-
-        if address == 'ABS':
-            addr = m[old_pc + 1] | (m[old_pc + 2]) << 8
-            return addr, safe_fetch(addr)
-        elif address == 'IMP':
-            return -1, -1
-        elif address == 'IMM':
-            addr = m[old_pc + 1]
-            return addr, addr
-        elif address == 'ZPG':
-            addr = m[old_pc + 1] | (0x00 << 8)
-            return addr, safe_fetch(addr)
-        elif address == 'REL':
-            addr = pc + self.number_from_bytes([m[old_pc + 1]], signed=True)
-            return addr, safe_fetch(addr)
-        elif address == 'ABX':
-            addr = self._registers.X + (m[old_pc + 1] | (m[old_pc + 2] << 8))
-            return addr, safe_fetch(addr)
-        elif address == 'ABY':
-            addr = self._registers.Y + (m[old_pc + 1] | (m[old_pc + 2] << 8))
-            addr = self.hex_digit(addr)
-            return addr, safe_fetch(addr)
-        elif address == 'INX':
-            ind_x = m[old_pc + 1] + self._registers.X
-            addr = m[self.eight_digit(ind_x)] | (m[self.eight_digit(ind_x + 1)] << 8)
-            return addr, safe_fetch(addr)
-        elif address == 'INY':
-            tmp = m[old_pc + 1]
-            addr = m[self.eight_digit(tmp)] | (m[self.eight_digit(tmp + 1)] << 8)
-            addr += self._registers.Y
-            addr = self.hex_digit(addr)
-            return addr, safe_fetch(addr)
-        elif address == 'IND':
-            addr = m[old_pc + 1] | m[old_pc + 2] << 8
-            addr2 = (addr & 0xFF00) | ((addr + 1) & 0x00FF)
-            real_addr = m[addr] | (m[addr2] << 8)
-            return real_addr, safe_fetch(real_addr)
-        elif address == 'ZPX':
-            addr = (m[old_pc + 1] + self._registers.X) & 0xFF
-            return addr, safe_fetch(addr)
-        elif address == 'ZPY':
-            addr = (m[old_pc + 1] + self._registers.Y) & 0xFF
-            return addr, safe_fetch(addr)
-        else:
-            return -1, -1
+        ind_x = (operand + self._registers.X) & 0xFF
+        return m[ind_x] | (m[(ind_x + 1) & 0xFF] << 8)
+
+    def address_iny(self, operand):
+        m = self._memory
+        addr = m[operand] | (m[(operand + 1) & 0xFF] << 8)
+        return (addr + self._registers.Y) & 0xFFFF
+
+    def address_ind(self, operand):
+        addr2 = (operand & 0xFF00) | ((operand + 1) & 0x00FF)
+        return self.read_address(operand) | (self.read_address(addr2) << 8)
+
+    def address_abx_page_cross(self, operand):
+        addr = (operand + self._registers.X) & 0xFFFF
+        if (addr ^ operand) & 0xFF00:
+            self.cycles += 1
+        return addr
+
+    def address_aby_page_cross(self, operand):
+        addr = (operand + self._registers.Y) & 0xFFFF
+        if (addr ^ operand) & 0xFF00:
+            self.cycles += 1
+        return addr
+
+    def address_iny_page_cross(self, operand):
+        m = self._memory
+        base = m[operand] | (m[(operand + 1) & 0xFF] << 8)
+        addr = (base + self._registers.Y) & 0xFFFF
+        if (addr ^ base) & 0xFF00:
+            self.cycles += 1
+        return addr
+
+    def address_zpx(self, operand):
+        return (operand + self._registers.X) & 0xFF
+
+    def address_zpy(self, operand):
+        return (operand + self._registers.Y) & 0xFF
 
     def read_address(self, address: int):
-        '''
-        CPU 地址空间
-    +---------+-------+-------+-----------------------+
-    | 地址    | 大小  | 标记  |         描述          |
-    +---------+-------+-------+-----------------------+
-    | $0000   | $800  |       | RAM                   |
-    | $0800   | $800  | M     | RAM                   |
-    | $1000   | $800  | M     | RAM                   |
-    | $1800   | $800  | M     | RAM                   |
-    | $2000   | 8     |       | Registers             |
-    | $2008   | $1FF8 | R     | Registers             |
-    | $4000   | $20   |       | Registers             |
-    | $4020   | $1FDF |       | Expansion ROM         |
-    | $6000   | $2000 |       | SRAM                  |
-    | $8000   | $4000 |       | PRG-ROM               |
-    | $C000   | $4000 |       | PRG-ROM               |
-    +---------+-------+-------+-----------------------+
-    标记图例: M = $0000的镜像
-              R = $2000-2008 每 8 bytes 的镜像
-            (e.g. $2008=$2000, $2018=$2000, etc.)
-        :param address:
-        :return:
-        '''
-        if address in self._ppu.ADD_range:
-            return self._ppu.read_address_from_cpu(address)
-        else:
-            return self._memory[address]
+        # 地址空间的划分见 bus.Bus, 普通存储直接从页表里的 memoryview 读, 其余交给处理函数
+        page = self._read_pages[address >> 8]
+        if page is not None:
+            return page[address & 0xFF]
+        return self._read_handlers[address >> 8](address)
 
     def write_address(self, address: int, data):
-        if address in self._ppu.ADD_range:
-            self._ppu.write_address_from_cpu(address, data)
+        if address < 0x8000:
+            # 代码标记在 2K RAM 的实际位置上, 经过镜像写入也要找到它
+            mark = address & 0x07FF if address < 0x2000 else address
+            if self._code_mark[mark]:
+                self.invalidate_decode(mark)
+        page = self._write_pages[address >> 8]
+        if page is not None:
+            page[address & 0xFF] = data
         else:
-            self._memory[address] = data
-
-    def push_stack(self, data, hex_digit=False):
-        sp = self._registers.S
-        if hex_digit is True:
-            low, high = self.low_high(data)
-            self.write_address(self._registers.to_real_address(sp), high)
-            self.write_address(self._registers.to_real_address(sp - 1), low)
-            self._registers.S -= 2
-        else:
-            self.write_address(self._registers.to_real_address(sp), data)
-            self._registers.S -= 1
-
-    def pop_stack(self, hex_digit=False):
-        sp = self._registers.S
-        if hex_digit is True:
-            low = self.read_address(self._registers.to_real_address(sp + 1))
-            high = self.read_address(self._registers.to_real_address(sp + 2))
-            data = self.from_low_high_to_int(low, high)
-            self._registers.S += 2
-        else:
-            data = self.read_address(self._registers.to_real_address(sp + 1))
-            self._registers.S += 1
-        return data
+            self._write_handlers[address >> 8](address, data)
+
+    def push_stack(self, data):
+        # 栈固定在 $0100-$01FF 这一页 RAM, 直接读写这一页的 memoryview, 不经过总线
+        registers = self._registers
+        sp = registers.S
+        if self._code_mark[0x100 | sp]:
+            self.invalidate_decode(0x100 | sp)
+        self._stack[sp] = data
+        registers.S = (sp - 1) & 0xFF
+
+    def pop_stack(self):
+        registers = self._registers
+        sp = (registers.S + 1) & 0xFF
+        registers.S = sp
+        return self._stack[sp]
+
+    def push_stack_word(self, data):
+        # 先压高字节再压低字节, S 在这一页内回绕
+        registers = self._registers
+        stack = self._stack
+        high = registers.S
+        low = (high - 1) & 0xFF
+        if self._code_mark[0x100 | high] or self._code_mark[0x100 | low]:
+            self.invalidate_decode(0x100 | high)
+            self.invalidate_decode(0x100 | low)
+        stack[high] = data >> 8
+        stack[low] = data & 0xFF
+        registers.S = (high - 2) & 0xFF
 
+    def pop_stack_word(self):
+        registers = self._registers
+        stack = self._stack
+        sp = registers.S
+        registers.S = (sp + 2) & 0xFF
+        return stack[(sp + 1) & 0xFF] | (stack[(sp + 2) & 0xFF] << 8)
 
 if __name__ == '__main__':
     c = Cpu()
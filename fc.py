@@ -1,8 +1,11 @@
 import math
+import os
 
 from my_fc.rom import ROM
 from my_fc.cpu import Cpu
-from my_fc.ppu import PPU
+from my_fc.ppu import PPU, Mirroring
+from my_fc.frame import FrameBuffer, FrameDumper
+from my_fc.sram import SaveRam
 
 
 class FC:
@@ -11,23 +14,80 @@ class FC:
 
         self.rom: ROM = rom
         self.argument: list = argument
-        self.ppu: PPU = PPU()
+        # 当前画面, PPU 直接渲染到 frame.indexed 里
+        self.frame: FrameBuffer = FrameBuffer()
+        self.ppu: PPU = PPU(self.frame.indexed)
+        self.frame.attach(self.ppu)
+        self.dumper: FrameDumper = None
+        self.sram: SaveRam = None  # 有电池的卡带的存档
         self.cpu: Cpu = Cpu(self.ppu)
+        self.ppu.connect(self.cpu.scheduler, self.cpu.nmi)
         self.mapper: BaseMapper = BaseMapper(self)
 
     def load_rom(self, rom_name: str = 'nestest.nes'):
-        with open(rom_name, 'rb') as f:
-            rom_info = f.read()
-            self.rom = ROM(rom_info)
+        # ROM 把文件 mmap 进来, PRG CHR 不复制, mapper 直接把它们装进页表
+        self.unload_rom()
+        self.rom = ROM(rom_name)
+        self.ppu.set_mirroring(Mirroring.from_rom(self.rom))
         self.load_mapper(self.rom.mapper_number)
         self.mapper.reset()
+        if self.rom.save_ram:
+            # 存档放在 ROM 旁边, 和 ROM 同名, 扩展名是 .sav; 文件头没写大小时按 8K
+            path = os.path.splitext(rom_name)[0] + '.sav'
+            self.sram = SaveRam(path, self.rom.prgnvram_size or SaveRam.SIZE)
+            self.cpu.bus.map_sram(self.sram)
+        if self.rom.trainer is not None:
+            self.cpu.bus.load(0x7000, self.rom.trainer)
 
     def unload_rom(self):
-        self.rom = None
+        from my_fc.mapper import BaseMapper
+
+        if self.sram is not None:
+            self.cpu.bus.unmap_sram()
+            self.sram.close()
+            self.sram = None
+        rom, self.rom = self.rom, None
+        if rom is not None:
+            # 先放开所有从 ROM 切出来的页 (总线, 图样表, mapper 和它安排的 IRQ), 再关闭 ROM 的文件映射
+            self.cpu.scheduler.cancel('mapper_irq')
+            self.cpu.set_irq(self.mapper, False)
+            self.cpu.bus.unmap_rom()
+            self.mapper = BaseMapper(self)
+            rom.close()
+
+    def close(self):
+        # 退出前调用: 写完还没写的帧, 把存档同步到磁盘
+        self.stop_dump()
+        self.unload_rom()
 
     def run(self):
         self.cpu.running = True
-        self.cpu.run()
+        self.cpu.reset()
+        while self.cpu._running:
+            self.run_frame()
+
+    def run_frame(self):
+        '''
+        运行一帧
+        CPU 每次最多跑到调度器里的下一个事件 (vblank, sprite 0 命中的扫描线, NMI, IRQ, 帧结束), 处理完事件再继续
+        中间 CPU 读写 PPU 寄存器时总线也会让 PPU 先追上
+        '''
+        cpu, ppu = self.cpu, self.ppu
+        frame = ppu.frame_count
+        while ppu.frame_count == frame and cpu._running:
+            cpu.run_cycles(max(ppu.frame_end_cycle() - cpu.cycles, 1))
+        if self.dumper is not None:
+            self.dumper.submit(ppu.frame_count, self.frame)
+
+    def start_dump(self, directory, every=60, fmt='png'):
+        # 无界面模式: 每 every 帧在后台线程里把画面写到 directory
+        self.stop_dump()
+        self.dumper = FrameDumper(directory, every, fmt)
+
+    def stop_dump(self):
+        if self.dumper is not None:
+            self.dumper.close()
+            self.dumper = None
 
     def load_mapper(self, _id: int):
         from my_fc.mapper import load_mapper
@@ -0,0 +1,129 @@
+# 画面输出: 一块预先分配好的内存放同一帧的三种格式, 以及后台线程把帧写成图片文件
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+WIDTH = 256
+HEIGHT = 240
+
+
+class FrameBuffer:
+    '''
+    一块 bytearray 里依次放着索引帧 (240, 256), RGB24 (240, 256, 3), RGBA (240, 256, 4)
+    三个属性都是这块内存上的 numpy 视图, 支持 buffer protocol, 可以直接 memoryview(fc.frame.rgba) 交给别的代码
+    PPU 直接渲染到 indexed 里, RGB24 和 RGBA 在第一次读取时原地转换, 每帧都复用同一块内存, 不重新分配
+    '''
+
+    def __init__(self):
+        size = WIDTH * HEIGHT
+        self._buffer = bytearray(size * 8)
+        self.indexed = np.frombuffer(self._buffer, dtype=np.uint8, count=size).reshape(HEIGHT, WIDTH)
+        self._rgb24 = np.frombuffer(self._buffer, dtype=np.uint8, count=size * 3, offset=size).reshape(HEIGHT, WIDTH, 3)
+        self._rgba = np.frombuffer(self._buffer, dtype=np.uint8, count=size * 4, offset=size * 4).reshape(HEIGHT, WIDTH, 4)
+        self._ppu = None
+        # 上一次转换时的 (PPU 渲染版本, 调色板查找表), 两者都没变就不用再转换
+        self._rgb24_key = None
+        self._rgba_key = None
+
+    def attach(self, ppu):
+        self._ppu = ppu
+
+    def _key(self):
+        ppu = self._ppu
+        return ppu.render_version, ppu.palette_indices()
+
+    @staticmethod
+    def _same(key, other):
+        return other is not None and key[0] == other[0] and key[1] is other[1]
+
+    @property
+    def rgb24(self):
+        key = self._key()
+        if not self._same(key, self._rgb24_key):
+            self._ppu.to_rgb24(out=self._rgb24)
+            self._rgb24_key = key
+        return self._rgb24
+
+    @property
+    def rgba(self):
+        key = self._key()
+        if not self._same(key, self._rgba_key):
+            self._ppu.to_rgba(out=self._rgba)
+            self._rgba_key = key
+        return self._rgba
+
+
+def write_ppm(path, rgb):
+    height, width = rgb.shape[:2]
+    with open(path, 'wb') as f:
+        f.write('P6\n{} {}\n255\n'.format(width, height).encode('ascii'))
+        f.write(memoryview(np.ascontiguousarray(rgb)))
+
+
+def png_chunk(kind: bytes, data: bytes):
+    chunk = kind + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xFFFFFFFF)
+
+
+def write_png(path, rgb):
+    # 不依赖图像库, 每行前面加一个 0 (不使用过滤), 整体 zlib 压缩
+    height, width = rgb.shape[:2]
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', header))
+        f.write(png_chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(png_chunk(b'IEND', b''))
+
+
+class FrameDumper:
+    '''
+    无界面模式下每 every 帧把画面写成一个图片文件
+    模拟器线程只复制一次 RGB24 (必须复制, 因为 FrameBuffer 每帧复用), 编码和写文件都在后台线程里做
+    队列满了就丢掉这一帧, 不让模拟器等待磁盘
+    '''
+    WRITERS = {
+        'ppm': write_ppm,
+        'png': write_png,
+    }
+
+    def __init__(self, directory, every=60, fmt='png', max_pending=8):
+        if fmt not in self.WRITERS:
+            raise ValueError('unsupported format: {}'.format(fmt))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = every
+        self.fmt = fmt
+        self.dropped = 0
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._work, name='frame-dumper', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame_count, frame: FrameBuffer):
+        if frame_count % self.every:
+            return
+        try:
+            self._queue.put_nowait((frame_count, frame.rgb24.copy()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _work(self):
+        write = self.WRITERS[self.fmt]
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            frame_count, rgb = item
+            path = os.path.join(self.directory, 'frame_{:06d}.{}'.format(frame_count, self.fmt))
+            write(path, rgb)
+
+    def close(self):
+        # 写完队列里剩下的帧再退出
+        self._queue.put(None)
+        self._thread.join()
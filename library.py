@@ -0,0 +1,180 @@
+# ROM 库索引: 扫描目录里的 .nes 文件, 把文件头和 PRG CHR 的哈希记在 SQLite 里
+# 以 (路径, 修改时间, 大小) 判断文件有没有变, 重新扫描时只解析变过的文件
+# 解析和计算哈希在进程池里并行做, 查询直接走数据库的索引, 不再打开 ROM
+import hashlib
+import os
+import sqlite3
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from my_fc.rom import ROM
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS roms (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    error TEXT,
+    mapper INTEGER,
+    submapper INTEGER,
+    nes2 INTEGER,
+    prg_size INTEGER,
+    chr_size INTEGER,
+    vmirroring INTEGER,
+    four_screen INTEGER,
+    battery INTEGER,
+    trainer INTEGER,
+    timing INTEGER,
+    crc32 INTEGER,
+    prg_crc32 INTEGER,
+    chr_crc32 INTEGER,
+    prg_sha1 TEXT,
+    chr_sha1 TEXT
+);
+CREATE INDEX IF NOT EXISTS roms_mapper ON roms (mapper, submapper);
+CREATE INDEX IF NOT EXISTS roms_crc32 ON roms (crc32);
+CREATE INDEX IF NOT EXISTS roms_prg_crc32 ON roms (prg_crc32);
+CREATE INDEX IF NOT EXISTS roms_prg_sha1 ON roms (prg_sha1);
+CREATE INDEX IF NOT EXISTS roms_chr_sha1 ON roms (chr_sha1);
+'''
+
+# 解析出来的列, 顺序和 scan_rom 返回的一样
+COLUMNS = (
+    'path', 'mtime_ns', 'size', 'error', 'mapper', 'submapper', 'nes2', 'prg_size', 'chr_size',
+    'vmirroring', 'four_screen', 'battery', 'trainer', 'timing',
+    'crc32', 'prg_crc32', 'chr_crc32', 'prg_sha1', 'chr_sha1',
+)
+
+
+def scan_rom(item):
+    '''
+    在工作进程里解析一个 ROM
+    :param item: (路径, 修改时间, 大小)
+    :return: 按 COLUMNS 排列的一行, 解析失败时只有 error 有值
+    '''
+    path, mtime_ns, size = item
+    try:
+        rom = ROM(path)
+    except (OSError, ValueError) as e:
+        return (path, mtime_ns, size, str(e)) + (None,) * (len(COLUMNS) - 4)
+    try:
+        prg, chr_ = rom.data_prgrom, rom.data_chrrom
+        prg_crc32 = zlib.crc32(prg)
+        return (
+            path, mtime_ns, size, None, rom.mapper_number, rom.submapper, int(rom.header.nes2),
+            len(prg), len(chr_), int(rom.vmirroring), int(rom.four_screen), int(rom.save_ram),
+            int(rom.trainer is not None), int(rom.timing),
+            # 整个 ROM (PRG + CHR, 不含文件头) 的 CRC32 是大多数游戏数据库用的键
+            zlib.crc32(chr_, prg_crc32), prg_crc32, zlib.crc32(chr_),
+            hashlib.sha1(prg).hexdigest(), hashlib.sha1(chr_).hexdigest(),
+        )
+    finally:
+        # 工作进程要扫几千个文件, 不能等垃圾回收才释放映射
+        rom.close()
+
+
+def find_roms(directory):
+    # 递归找出 directory 下所有的 .nes 文件, 返回 (路径, 修改时间, 大小)
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith('.nes'):
+                path = os.path.abspath(os.path.join(root, name))
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime_ns, stat.st_size
+
+
+class RomLibrary:
+    '''
+    ROM 库的索引, 保存在 index_path 指向的 SQLite 数据库里 (':memory:' 表示不保存)
+    '''
+
+    def __init__(self, index_path):
+        self._db = sqlite3.connect(index_path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def scan(self, directory, workers=None, chunksize=16):
+        '''
+        扫描 directory, 只解析新的和变过的文件, 删掉已经不存在的文件
+        :param workers: 进程数, None 表示 CPU 核数, 0 表示在当前进程里解析
+        :return: {'scanned': 解析了多少个, 'removed': 删掉了多少个, 'unchanged': 没变的有多少个}
+        '''
+        db = self._db
+        prefix = os.path.join(os.path.abspath(directory), '')
+        known = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in db.execute(
+                'SELECT path, mtime_ns, size FROM roms WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))
+        }
+        changed = []
+        unchanged = 0
+        for path, mtime_ns, size in find_roms(directory):
+            if known.pop(path, None) == (mtime_ns, size):
+                unchanged += 1
+            else:
+                changed.append((path, mtime_ns, size))
+
+        if workers == 0 or len(changed) < 2:
+            rows = map(scan_rom, changed)
+            self._store(rows, known)
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                self._store(pool.map(scan_rom, changed, chunksize=chunksize), known)
+        return {'scanned': len(changed), 'removed': len(known), 'unchanged': unchanged}
+
+    def _store(self, rows, removed):
+        # 解析结果按完成顺序写入, 和删除一起放在一个事务里
+        insert = 'INSERT OR REPLACE INTO roms ({}) VALUES ({})'.format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+        with self._db:
+            self._db.executemany(insert, rows)
+            self._db.executemany('DELETE FROM roms WHERE path = ?', ((path,) for path in removed))
+
+    def by_mapper(self, mapper, submapper=None):
+        # 用第 mapper 号 mapper 的 ROM
+        if submapper is None:
+            return self._query('mapper = ?', mapper)
+        return self._query('mapper = ? AND submapper = ?', mapper, submapper)
+
+    def find_by_hash(self, digest):
+        '''
+        按哈希查找 ROM
+        digest 可以是整个 ROM 或 PRG CHR 的 CRC32 (整数, 或者 8 位十六进制字符串), 也可以是 PRG CHR 的 SHA-1
+        '''
+        if isinstance(digest, str) and len(digest) == 40:
+            digest = digest.lower()
+            return self._query('prg_sha1 = ? OR chr_sha1 = ?', digest, digest)
+        if isinstance(digest, str):
+            digest = int(digest, 16)
+        return self._query('crc32 = ? OR prg_crc32 = ? OR chr_crc32 = ?', digest, digest, digest)
+
+    def errors(self):
+        # 解析失败的文件和原因
+        return [(row['path'], row['error']) for row in self._db.execute(
+            'SELECT path, error FROM roms WHERE error IS NOT NULL ORDER BY path')]
+
+    def __len__(self):
+        return self._db.execute('SELECT count(*) FROM roms WHERE error IS NULL').fetchone()[0]
+
+    def _query(self, where, *args):
+        sql = 'SELECT * FROM roms WHERE error IS NULL AND ({}) ORDER BY path'.format(where)
+        return [dict(row) for row in self._db.execute(sql, args)]
+
+
+if __name__ == '__main__':
+    import sys
+    with RomLibrary(sys.argv[1]) as library:
+        print(library.scan(sys.argv[2]))
+        for path, error in library.errors():
+            print('{}: {}'.format(path, error))
@@ -4,4 +4,7 @@ from my_fc.fc import FC
 if __name__ == '__main__':
     fc = FC()
     fc.load_rom()
-    fc.run()
+    try:
+        fc.run()
+    finally:
+        fc.close()
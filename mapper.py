@@ -1,36 +1,123 @@
 from my_fc.fc import FC
+from my_fc.ppu import PPU, Mirroring, decode_pattern
+
+# mapper 编号 => mapper 类, 用 @register(编号) 登记
+MAPPERS = {}
+
+
+def register(_id: int):
+    def decorator(cls):
+        cls._id = _id
+        MAPPERS[_id] = cls
+        return cls
+    return decorator
 
 
 class BaseMapper:
+    '''
+    卡带上的 PRG-ROM CHR-ROM 不复制进 CPU PPU 的内存, 而是切成小块的 memoryview 直接装进页表:
+    PRG 按 CPU 总线的页 (256 字节) 切, 一个 8K bank 是 32 页; CHR 按 PPU 图样表的 1K 窗口切
+    切换 bank 只替换页表里的几个引用, CHR 的图块在载入时整体解码一次, 切换时直接换上
+    切换之后通知 CPU (Cpu.switch_prg_bank) 和 PPU (PPU.map_chr), 它们只换出这一个窗口的缓存
+    '''
     _id = 0xFF
 
     def __init__(self, fc: FC):
         self.fc = fc
         self.fc.mapper = self
+        self._prg_pages = []  # PRG-ROM 每 256 字节一个 memoryview
+        self._chr_pages = []  # CHR-ROM 每 1K 一个 memoryview
+        self._chr_tiles = None  # CHR-ROM 解码后的图块, 每 1K 64 个
+        self.chr_banks = [0, 1, 2, 3, 4, 5, 6, 7]  # 图样表 8 个 1K 窗口当前装载的 CHR bank
+        # 上一张卡带解码和翻译过的代码都不能再用, 图样表也不能再指向它的 CHR-ROM
+        fc.cpu.reset_code_cache()
+        fc.ppu.reset_chr()
+        if fc.rom is not None:
+            self.load_banks(fc.rom)
+        # 写 $8000-$FFFF 就是写 mapper 的寄存器
+        bus = fc.cpu.bus
+        for page in range(0x80, 0x100):
+            bus.map_write_handler(page, self.write_register)
+
+    def load_banks(self, rom):
+        prg = memoryview(rom.data_prgrom)
+        self._prg_pages = [prg[i:i + 0x100] for i in range(0, len(prg), 0x100)]
+        chr_ = memoryview(rom.data_chrrom)
+        self._chr_pages = [chr_[i:i + 0x400] for i in range(0, len(chr_), 0x400)]
+        self._chr_tiles = decode_pattern(chr_).reshape(-1, 64, 8, 8) if len(chr_) else None
+
+    @property
+    def count_prgrom8kb(self):
+        return len(self._prg_pages) >> 5
+
+    @property
+    def count_chrrom1kb(self):
+        return len(self._chr_pages)
 
     def load_prgrom_8k(self, src: int, des: int):
-        src_addr_start = src * 8 * 2014 + 0x8000
+        '''
+        把第 des 个 8K PRG bank 装到 $8000 + src * $2000 开始的窗口
+        bank 号超过 ROM 大小时回绕, 和只接了低位地址线的卡带一样
+        '''
+        des %= self.count_prgrom8kb
+        cpu = self.fc.cpu
+        start = 0x8000 + src * 0x2000
+        pages = self._prg_pages[des * 32:(des + 1) * 32]
+        if cpu.bus.read_pages[start >> 8] is pages[0]:
+            return
+        cpu.bus.map_rom(start >> 8, pages)
+        cpu.switch_prg_bank(src, des)
 
-        des_addr_start = des * 8 * 2014
-        des_addr_end = (des + 1) * 8 * 2014
+    def load_prgrom_16k(self, src: int, des: int):
+        self.load_prgrom_8k(src * 2, des * 2)
+        self.load_prgrom_8k(src * 2 + 1, des * 2 + 1)
 
-        self.fc.cpu.memory[src_addr_start:] = self.fc.rom.data_prgrom[des_addr_start:des_addr_end]
+    def load_prgrom_32k(self, des: int):
+        for i in range(4):
+            self.load_prgrom_8k(i, des * 4 + i)
+
+    def load_chrrom_1k(self, src: int, des: int):
+        # 把第 des 个 1K CHR bank 装到图样表的第 src 个窗口, 没有 CHR-ROM (CHR-RAM) 时什么都不做
+        if not self._chr_pages:
+            return
+        des %= self.count_chrrom1kb
+        ppu = self.fc.ppu
+        if ppu.chr_pages[src] is self._chr_pages[des]:
+            return
+        # 已经画完的扫描线要用切换前的图块
+        self.fc.cpu.bus.sync_ppu()
+        ppu.map_chr(src, self._chr_pages[des], self._chr_tiles[des])
+        self.chr_banks[src] = des
+
+    def load_chrrom_4k(self, src: int, des: int):
+        for i in range(4):
+            self.load_chrrom_1k(src * 4 + i, des * 4 + i)
 
     def load_chrrom_8k(self, src: int, des: int):
-        src_addr_start = src * 8 * 1024
-        src_addr_end = (src + 1) * 8 * 1024
+        for i in range(8):
+            self.load_chrrom_1k(src * 8 + i, des * 8 + i)
 
-        des_addr_start = des * 8 * 1024
-        des_addr_end = (des + 1) * 8 * 1024
+    def set_mirroring(self, mirroring):
+        # 有的 mapper 可以切换名称表的镜像方式, 只需要让 PPU 换一张地址表
+        ppu = self.fc.ppu
+        if ppu.mirroring == mirroring:
+            return
+        self.fc.cpu.bus.sync_ppu()
+        ppu.set_mirroring(mirroring)
 
-        self.fc.ppu.memory[src_addr_start:src_addr_end] = self.fc.rom.data_prgrom[des_addr_start:des_addr_end]
+    def write_register(self, address, data):
+        # PRG-ROM 不能写, 有寄存器的 mapper 覆盖这个方法
+        pass
 
     def reset(self):
         pass
 
 
+@register(0)
 class Mapper0(BaseMapper):
-    _id = 0x0
+    '''
+    NROM, 没有 bank 切换
+    '''
 
     def __init__(self, fc: FC):
         super(Mapper0, self).__init__(fc)
@@ -54,15 +141,247 @@ class Mapper0(BaseMapper):
         self.load_chrrom_8k(0, 0)
 
 
-def load_mapper(fc: FC, _id: 000):
-    mapper_str = ''
-    try:
-        mapper_str = "Mapper{}(fc)".format(_id)
-        mapper = eval(mapper_str)
-    except:
-        raise ValueError('{} no found'.format(mapper_str))
+@register(1)
+class Mapper1(BaseMapper):
+    '''
+    MMC1 (SxROM)
+    寄存器通过串行移位寄存器写入: 每次写 $8000-$FFFF 移入数据的第 0 位 (低位在先)
+    第 5 次写入时按地址的第 13 14 位写进对应的寄存器:
+        $8000 控制: 镜像方式, PRG 切换方式, CHR 切换方式
+        $A000 CHR bank 0
+        $C000 CHR bank 1
+        $E000 PRG bank
+    写入的第 7 位是 1 时清空移位寄存器, 并把 PRG 切换方式设置成固定最后一个 bank
+    '''
+    MIRRORING = (Mirroring.SINGLE_LOW, Mirroring.SINGLE_HIGH, Mirroring.VERTICAL, Mirroring.HORIZONTAL)
+
+    def __init__(self, fc: FC):
+        super(Mapper1, self).__init__(fc)
+        self.shift = 0x10  # 第 4 位是哨兵, 移到第 0 位时说明已经移入了 4 位
+        self.control = 0x0C
+        self.chr_bank0 = 0
+        self.chr_bank1 = 0
+        self.prg_bank = 0
+
+    def reset(self):
+        self.shift = 0x10
+        self.control = 0x0C
+        self.update_banks()
+
+    def write_register(self, address, data):
+        if data & 0x80:
+            self.shift = 0x10
+            self.control |= 0x0C
+            self.update_banks()
+            return
+        done = self.shift & 1
+        self.shift = (self.shift >> 1) | ((data & 1) << 4)
+        if not done:
+            return
+        value, self.shift = self.shift, 0x10
+        register = address & 0x6000
+        if register == 0x0000:
+            self.control = value
+        elif register == 0x2000:
+            self.chr_bank0 = value
+        elif register == 0x4000:
+            self.chr_bank1 = value
+        else:
+            self.prg_bank = value
+        self.update_banks()
+
+    def update_banks(self):
+        control = self.control
+        self.set_mirroring(self.MIRRORING[control & 0x03])
+
+        # 512K 的 SUROM 用 CHR bank 0 的第 4 位选择 PRG 的前后 256K
+        outer = self.chr_bank0 & 0x10 if self.count_prgrom8kb > 32 else 0
+        bank = (self.prg_bank & 0x0F) | outer
+        prg_mode = (control >> 2) & 0x03
+        if prg_mode < 2:
+            # 32K 一起切换, 忽略 bank 号的最低位
+            self.load_prgrom_32k(bank >> 1)
+        elif prg_mode == 2:
+            # $8000 固定为第一个 bank, 切换 $C000
+            self.load_prgrom_16k(0, outer)
+            self.load_prgrom_16k(1, bank)
+        else:
+            # $C000 固定为最后一个 bank, 切换 $8000
+            self.load_prgrom_16k(0, bank)
+            self.load_prgrom_16k(1, outer | 0x0F)
+
+        if control & 0x10:
+            self.load_chrrom_4k(0, self.chr_bank0)
+            self.load_chrrom_4k(1, self.chr_bank1)
+        else:
+            self.load_chrrom_8k(0, self.chr_bank0 >> 1)
+
+
+@register(2)
+class Mapper2(BaseMapper):
+    '''
+    UxROM: 写 $8000-$FFFF 切换 $8000 的 16K bank, $C000 固定为最后一个 bank, 图样表是 CHR-RAM
+    '''
+
+    def reset(self):
+        self.load_prgrom_16k(0, 0)
+        self.load_prgrom_16k(1, self.count_prgrom8kb // 2 - 1)
+        self.load_chrrom_8k(0, 0)
+
+    def write_register(self, address, data):
+        self.load_prgrom_16k(0, data)
+
+
+@register(3)
+class Mapper3(Mapper0):
+    '''
+    CNROM: PRG 和 NROM 一样, 写 $8000-$FFFF 切换整个 8K 图样表
+    '''
+
+    def write_register(self, address, data):
+        self.load_chrrom_8k(0, data)
+
+
+@register(4)
+class Mapper4(BaseMapper):
+    '''
+    MMC3 (TxROM)
+    $8000 (偶数地址) 选择下一次写 $8001 的 bank 寄存器 R0-R7, 第 6 位交换 $8000 和 $C000, 第 7 位交换图样表的两半
+    $8001 (奇数地址) 写 bank 寄存器: R0 R1 是 2K 的 CHR bank, R2-R5 是 1K 的 CHR bank, R6 R7 是 8K 的 PRG bank
+    $A000 镜像方式, $A001 PRG-RAM 保护 (不模拟)
+    $C000 IRQ 计数器的重载值, $C001 下一次计数时重载
+    $E000 关闭 IRQ 并清除请求, $E001 打开 IRQ
+
+    扫描线计数器由 PPU 取图样时 A12 的上升沿驱动, 打开渲染时每条可见扫描线和预渲染线的第 260 个点各一次
+    计数器不一条一条地数, 和 PPU 一样记下已经数到的点, 需要时一次数完;
+    再算出计数器减到 0 的那个点, 在调度器里安排一个事件, 到时候拉低 IRQ 线
+    '''
+    CLOCK_DOT = 260
+    CLOCKS_PER_FRAME = PPU.HEIGHT + 1
+
+    def __init__(self, fc: FC):
+        super(Mapper4, self).__init__(fc)
+        self.registers = [0, 2, 4, 5, 6, 7, 0, 1]
+        self.bank_select = 0
+        self.irq_latch = 0
+        self.irq_counter = 0
+        self.irq_reload = False
+        self.irq_enabled = False
+        self._irq_dot = 0  # 扫描线计数器已经数到的 PPU 点
+
+    def reset(self):
+        self.bank_select = 0
+        self._irq_dot = self.fc.cpu.cycles * 3
+        self.update_banks()
+
+    def write_register(self, address, data):
+        even = not address & 1
+        register = address & 0xE000
+        if register == 0x8000:
+            if even:
+                self.bank_select = data
+            else:
+                self.registers[self.bank_select & 0x07] = data
+            self.update_banks()
+        elif register == 0xA000:
+            if even and not self.fc.rom.four_screen:
+                self.set_mirroring(Mirroring.HORIZONTAL if data & 1 else Mirroring.VERTICAL)
+        else:
+            # 先把计数器数到现在, 再改它的状态
+            self.clock_irq(self.fc.cpu.cycles * 3)
+            if register == 0xC000:
+                if even:
+                    self.irq_latch = data
+                else:
+                    self.irq_counter = 0
+                    self.irq_reload = True
+            elif even:
+                self.irq_enabled = False
+                self.fc.cpu.set_irq(self, False)
+            else:
+                self.irq_enabled = True
+            self.schedule_irq()
+
+    def update_banks(self):
+        last = self.count_prgrom8kb - 1
+        r = self.registers
+        if self.bank_select & 0x40:
+            prg = (last - 1, r[7], r[6], last)
+        else:
+            prg = (r[6], r[7], last - 1, last)
+        for window, bank in enumerate(prg):
+            self.load_prgrom_8k(window, bank)
+
+        chr_ = (r[0] & 0xFE, r[0] | 1, r[1] & 0xFE, r[1] | 1, r[2], r[3], r[4], r[5])
+        invert = 4 if self.bank_select & 0x80 else 0
+        for window, bank in enumerate(chr_):
+            self.load_chrrom_1k(window ^ invert, bank)
+
+    @classmethod
+    def scanline_clocks(cls, dot):
+        # 从上电到第 dot 个点 (包括这个点) 为止, 扫描线计数器一共会被驱动多少次
+        frame, position = divmod(dot, PPU.DOTS_PER_FRAME)
+        clocks = min(PPU.HEIGHT, max(0, (position - cls.CLOCK_DOT) // PPU.DOTS_PER_LINE + 1))
+        if position >= PPU.PRE_RENDER_DOT - 1 + cls.CLOCK_DOT:
+            clocks += 1
+        return frame * cls.CLOCKS_PER_FRAME + clocks
+
+    @classmethod
+    def clock_dot(cls, index):
+        # 第 index 次 (从 0 开始) 驱动扫描线计数器的点, 和 scanline_clocks 互逆
+        frame, index = divmod(index, cls.CLOCKS_PER_FRAME)
+        line = index if index < PPU.HEIGHT else PPU.LINES_PER_FRAME - 1
+        return frame * PPU.DOTS_PER_FRAME + line * PPU.DOTS_PER_LINE + cls.CLOCK_DOT
+
+    def clock_irq(self, dot):
+        # 把计数器数到第 dot 个点, 中间减到 0 并且打开了 IRQ 时拉低 IRQ 线
+        if self.fc.ppu.rendering_enabled:
+            clocks = self.scanline_clocks(dot) - self.scanline_clocks(self._irq_dot)
+        else:
+            clocks = 0
+        self._irq_dot = max(self._irq_dot, dot)
+        fired = False
+        while clocks > 0:
+            if self.irq_counter == 0 or self.irq_reload:
+                self.irq_counter = self.irq_latch
+                self.irq_reload = False
+                clocks -= 1
+            else:
+                step = min(clocks, self.irq_counter)
+                self.irq_counter -= step
+                clocks -= step
+            if self.irq_counter == 0:
+                fired = True
+                if self.irq_latch == 0:
+                    # 重载值是 0 时之后每次都重载成 0, 不用再数了
+                    break
+        if fired and self.irq_enabled:
+            self.fc.cpu.set_irq(self, True)
+
+    def schedule_irq(self):
+        # 安排计数器下一次减到 0 的时间
+        scheduler = self.fc.cpu.scheduler
+        if not self.irq_enabled:
+            scheduler.cancel('mapper_irq')
+            return
+        if self.irq_counter == 0 or self.irq_reload:
+            clocks = self.irq_latch + 1
+        else:
+            clocks = self.irq_counter
+        dot = self.clock_dot(self.scanline_clocks(self._irq_dot) + clocks - 1)
+        scheduler.schedule('mapper_irq', -(-dot // 3), self.on_irq)
+
+    def on_irq(self, cycle):
+        # 到时间时可能关掉了渲染, 计数器没有减到 0, 按现在的状态重新安排
+        self.clock_irq(cycle * 3)
+        self.schedule_irq()
+
 
-    return mapper
+def load_mapper(fc: FC, _id: int):
+    mapper = MAPPERS.get(_id)
+    if mapper is None:
+        raise ValueError('Mapper{} no found'.format(_id))
+    return mapper(fc)
 
 
 if __name__ == '__main__':
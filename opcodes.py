@@ -256,3 +256,273 @@ codes = {
     0xFE: ('INC', 'ABX'),
     0xFF: ('ISB', 'ABX'),
 }
+
+
+# 每个操作码的基础周期数
+# 读操作跨页 (PAGE_CROSS) 和分支跳转 (跳转 +1, 跨页再 +1) 的额外周期在执行时另算
+cycles = {
+    0x00: 7,  # BRK IMP
+    0x01: 6,  # ORA INX
+    0x02: 2,  # KIL IMP
+    0x03: 8,  # SLO INX
+    0x04: 3,  # NOP ZPG
+    0x05: 3,  # ORA ZPG
+    0x06: 5,  # ASL ZPG
+    0x07: 5,  # SLO ZPG
+    0x08: 3,  # PHP IMP
+    0x09: 2,  # ORA IMM
+    0x0A: 2,  # ASL IMP
+    0x0B: 2,  # ANC IMM
+    0x0C: 4,  # NOP ABS
+    0x0D: 4,  # ORA ABS
+    0x0E: 6,  # ASL ABS
+    0x0F: 6,  # SLO ABS
+    0x10: 2,  # BPL REL
+    0x11: 5,  # ORA INY
+    0x12: 2,  # KIL IMP
+    0x13: 8,  # SLO INY
+    0x14: 4,  # NOP ZPX
+    0x15: 4,  # ORA ZPX
+    0x16: 6,  # ASL ZPX
+    0x17: 6,  # SLO ZPX
+    0x18: 2,  # CLC IMP
+    0x19: 4,  # ORA ABY
+    0x1A: 2,  # NOP IMP
+    0x1B: 7,  # SLO ABY
+    0x1C: 4,  # NOP ABX
+    0x1D: 4,  # ORA ABX
+    0x1E: 7,  # ASL ABX
+    0x1F: 7,  # SLO ABX
+    0x20: 6,  # JSR ABS
+    0x21: 6,  # AND INX
+    0x22: 2,  # KIL IMP
+    0x23: 8,  # RLA INX
+    0x24: 3,  # BIT ZPG
+    0x25: 3,  # AND ZPG
+    0x26: 5,  # ROL ZPG
+    0x27: 5,  # RLA ZPG
+    0x28: 4,  # PLP IMP
+    0x29: 2,  # AND IMM
+    0x2A: 2,  # ROL IMP
+    0x2B: 2,  # ANC IMM
+    0x2C: 4,  # BIT ABS
+    0x2D: 4,  # AND ABS
+    0x2E: 6,  # ROL ABS
+    0x2F: 6,  # RLA ABS
+    0x30: 2,  # BMI REL
+    0x31: 5,  # AND INY
+    0x32: 2,  # KIL IMP
+    0x33: 8,  # RLA INY
+    0x34: 4,  # NOP ZPX
+    0x35: 4,  # AND ZPX
+    0x36: 6,  # ROL ZPX
+    0x37: 6,  # RLA ZPX
+    0x38: 2,  # SEC IMP
+    0x39: 4,  # AND ABY
+    0x3A: 2,  # NOP IMP
+    0x3B: 7,  # RLA ABY
+    0x3C: 4,  # NOP ABX
+    0x3D: 4,  # AND ABX
+    0x3E: 7,  # ROL ABX
+    0x3F: 7,  # RLA ABX
+    0x40: 6,  # RTI IMP
+    0x41: 6,  # EOR INX
+    0x42: 2,  # KIL IMP
+    0x43: 8,  # SRE INX
+    0x44: 3,  # NOP ZPG
+    0x45: 3,  # EOR ZPG
+    0x46: 5,  # LSR ZPG
+    0x47: 5,  # SRE ZPG
+    0x48: 3,  # PHA IMP
+    0x49: 2,  # EOR IMM
+    0x4A: 2,  # LSR IMP
+    0x4B: 2,  # ASR IMM
+    0x4C: 3,  # JMP ABS
+    0x4D: 4,  # EOR ABS
+    0x4E: 6,  # LSR ABS
+    0x4F: 6,  # SRE ABS
+    0x50: 2,  # BVC REL
+    0x51: 5,  # EOR INY
+    0x52: 2,  # KIL IMP
+    0x53: 8,  # SRE INY
+    0x54: 4,  # NOP ZPX
+    0x55: 4,  # EOR ZPX
+    0x56: 6,  # LSR ZPX
+    0x57: 6,  # SRE ZPX
+    0x58: 2,  # CLI IMP
+    0x59: 4,  # EOR ABY
+    0x5A: 2,  # NOP IMP
+    0x5B: 7,  # SRE ABY
+    0x5C: 4,  # NOP ABX
+    0x5D: 4,  # EOR ABX
+    0x5E: 7,  # LSR ABX
+    0x5F: 7,  # SRE ABX
+    0x60: 6,  # RTS IMP
+    0x61: 6,  # ADC INX
+    0x62: 2,  # KIL IMP
+    0x63: 8,  # RRA INX
+    0x64: 3,  # NOP ZPG
+    0x65: 3,  # ADC ZPG
+    0x66: 5,  # ROR ZPG
+    0x67: 5,  # RRA ZPG
+    0x68: 4,  # PLA IMP
+    0x69: 2,  # ADC IMM
+    0x6A: 2,  # ROR IMP
+    0x6B: 2,  # ARR IMM
+    0x6C: 5,  # JMP IND
+    0x6D: 4,  # ADC ABS
+    0x6E: 6,  # ROR ABS
+    0x6F: 6,  # RRA ABS
+    0x70: 2,  # BVS REL
+    0x71: 5,  # ADC INY
+    0x72: 2,  # KIL IMP
+    0x73: 8,  # RRA INY
+    0x74: 4,  # NOP ZPX
+    0x75: 4,  # ADC ZPX
+    0x76: 6,  # ROR ZPX
+    0x77: 6,  # RRA ZPX
+    0x78: 2,  # SEI IMP
+    0x79: 4,  # ADC ABY
+    0x7A: 2,  # NOP IMP
+    0x7B: 7,  # RRA ABY
+    0x7C: 4,  # NOP ABX
+    0x7D: 4,  # ADC ABX
+    0x7E: 7,  # ROR ABX
+    0x7F: 7,  # RRA ABX
+    0x80: 2,  # NOP IMM
+    0x81: 6,  # STA INX
+    0x82: 2,  # NOP IMM
+    0x83: 6,  # SAX INX
+    0x84: 3,  # STY ZPG
+    0x85: 3,  # STA ZPG
+    0x86: 3,  # STX ZPG
+    0x87: 3,  # SAX ZPG
+    0x88: 2,  # DEY IMP
+    0x89: 2,  # NOP IMM
+    0x8A: 2,  # TXA IMP
+    0x8B: 2,  # XAA IMM
+    0x8C: 4,  # STY ABS
+    0x8D: 4,  # STA ABS
+    0x8E: 4,  # STX ABS
+    0x8F: 4,  # SAX ABS
+    0x90: 2,  # BCC REL
+    0x91: 6,  # STA INY
+    0x92: 2,  # KIL IMP
+    0x93: 6,  # AHX INY
+    0x94: 4,  # STY ZPX
+    0x95: 4,  # STA ZPX
+    0x96: 4,  # STX ZPY
+    0x97: 4,  # SAX ZPY
+    0x98: 2,  # TYA IMP
+    0x99: 5,  # STA ABY
+    0x9A: 2,  # TXS IMP
+    0x9B: 5,  # TAS ABY
+    0x9C: 5,  # SHY ABX
+    0x9D: 5,  # STA ABX
+    0x9E: 5,  # SHX ABY
+    0x9F: 5,  # AHX ABY
+    0xA0: 2,  # LDY IMM
+    0xA1: 6,  # LDA INX
+    0xA2: 2,  # LDX IMM
+    0xA3: 6,  # LAX INX
+    0xA4: 3,  # LDY ZPG
+    0xA5: 3,  # LDA ZPG
+    0xA6: 3,  # LDX ZPG
+    0xA7: 3,  # LAX ZPG
+    0xA8: 2,  # TAY IMP
+    0xA9: 2,  # LDA IMM
+    0xAA: 2,  # TAX IMP
+    0xAB: 2,  # LAX IMM
+    0xAC: 4,  # LDY ABS
+    0xAD: 4,  # LDA ABS
+    0xAE: 4,  # LDX ABS
+    0xAF: 4,  # LAX ABS
+    0xB0: 2,  # BCS REL
+    0xB1: 5,  # LDA INY
+    0xB2: 2,  # KIL IMP
+    0xB3: 5,  # LAX INY
+    0xB4: 4,  # LDY ZPX
+    0xB5: 4,  # LDA ZPX
+    0xB6: 4,  # LDX ZPY
+    0xB7: 4,  # LAX ZPY
+    0xB8: 2,  # CLV IMP
+    0xB9: 4,  # LDA ABY
+    0xBA: 2,  # TSX IMP
+    0xBB: 4,  # LAS ABY
+    0xBC: 4,  # LDY ABX
+    0xBD: 4,  # LDA ABX
+    0xBE: 4,  # LDX ABY
+    0xBF: 4,  # LAX ABY
+    0xC0: 2,  # CPY IMM
+    0xC1: 6,  # CMP INX
+    0xC2: 2,  # NOP IMM
+    0xC3: 8,  # DCP INX
+    0xC4: 3,  # CPY ZPG
+    0xC5: 3,  # CMP ZPG
+    0xC6: 5,  # DEC ZPG
+    0xC7: 5,  # DCP ZPG
+    0xC8: 2,  # INY IMP
+    0xC9: 2,  # CMP IMM
+    0xCA: 2,  # DEX IMP
+    0xCB: 2,  # AXS IMM
+    0xCC: 4,  # CPY ABS
+    0xCD: 4,  # CMP ABS
+    0xCE: 6,  # DEC ABS
+    0xCF: 6,  # DCP ABS
+    0xD0: 2,  # BNE REL
+    0xD1: 5,  # CMP INY
+    0xD2: 2,  # KIL IMP
+    0xD3: 8,  # DCP INY
+    0xD4: 4,  # NOP ZPX
+    0xD5: 4,  # CMP ZPX
+    0xD6: 6,  # DEC ZPX
+    0xD7: 6,  # DCP ZPX
+    0xD8: 2,  # CLD IMP
+    0xD9: 4,  # CMP ABY
+    0xDA: 2,  # NOP IMP
+    0xDB: 7,  # DCP ABY
+    0xDC: 4,  # NOP ABX
+    0xDD: 4,  # CMP ABX
+    0xDE: 7,  # DEC ABX
+    0xDF: 7,  # DCP ABX
+    0xE0: 2,  # CPX IMM
+    0xE1: 6,  # SBC INX
+    0xE2: 2,  # NOP IMM
+    0xE3: 8,  # ISB INX
+    0xE4: 3,  # CPX ZPG
+    0xE5: 3,  # SBC ZPG
+    0xE6: 5,  # INC ZPG
+    0xE7: 5,  # ISB ZPG
+    0xE8: 2,  # INX IMP
+    0xE9: 2,  # SBC IMM
+    0xEA: 2,  # NOP IMP
+    0xEB: 2,  # SBC IMM
+    0xEC: 4,  # CPX ABS
+    0xED: 4,  # SBC ABS
+    0xEE: 6,  # INC ABS
+    0xEF: 6,  # ISB ABS
+    0xF0: 2,  # BEQ REL
+    0xF1: 5,  # SBC INY
+    0xF2: 2,  # KIL IMP
+    0xF3: 8,  # ISB INY
+    0xF4: 4,  # NOP ZPX
+    0xF5: 4,  # SBC ZPX
+    0xF6: 6,  # INC ZPX
+    0xF7: 6,  # ISB ZPX
+    0xF8: 2,  # SED IMP
+    0xF9: 4,  # SBC ABY
+    0xFA: 2,  # NOP IMP
+    0xFB: 7,  # ISB ABY
+    0xFC: 4,  # NOP ABX
+    0xFD: 4,  # SBC ABX
+    0xFE: 7,  # INC ABX
+    0xFF: 7,  # ISB ABX
+}
+
+# 有效地址跨页时要多花 1 个周期的操作码 (只读不写的 ABX ABY INY 寻址)
+PAGE_CROSS = {
+    0x11, 0x19, 0x1C, 0x1D, 0x31, 0x39, 0x3C, 0x3D,
+    0x51, 0x59, 0x5C, 0x5D, 0x71, 0x79, 0x7C, 0x7D,
+    0xB1, 0xB3, 0xB9, 0xBB, 0xBC, 0xBD, 0xBE, 0xBF,
+    0xD1, 0xD9, 0xDC, 0xDD, 0xF1, 0xF9, 0xFC, 0xFD,
+}
@@ -1,65 +1,251 @@
+from enum import IntEnum, unique
 from typing import List
 
-from my_fc.flagbyte import FlagByte
+import numpy as np
+
 from my_fc.base_class import BaseClass
 
 
+# 64 种颜色的主调色板, r g b a
+PALETTE = np.array([
+    (0x7F, 0x7F, 0x7F, 0xFF), (0x20, 0x00, 0xB0, 0xFF), (0x28, 0x00, 0xB8, 0xFF), (0x60, 0x10, 0xA0, 0xFF),
+    (0x98, 0x20, 0x78, 0xFF), (0xB0, 0x10, 0x30, 0xFF), (0xA0, 0x30, 0x00, 0xFF), (0x78, 0x40, 0x00, 0xFF),
+    (0x48, 0x58, 0x00, 0xFF), (0x38, 0x68, 0x00, 0xFF), (0x38, 0x6C, 0x00, 0xFF), (0x30, 0x60, 0x40, 0xFF),
+    (0x30, 0x50, 0x80, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF),
+
+    (0xBC, 0xBC, 0xBC, 0xFF), (0x40, 0x60, 0xF8, 0xFF), (0x40, 0x40, 0xFF, 0xFF), (0x90, 0x40, 0xF0, 0xFF),
+    (0xD8, 0x40, 0xC0, 0xFF), (0xD8, 0x40, 0x60, 0xFF), (0xE0, 0x50, 0x00, 0xFF), (0xC0, 0x70, 0x00, 0xFF),
+    (0x88, 0x88, 0x00, 0xFF), (0x50, 0xA0, 0x00, 0xFF), (0x48, 0xA8, 0x10, 0xFF), (0x48, 0xA0, 0x68, 0xFF),
+    (0x40, 0x90, 0xC0, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF),
+
+    (0xFF, 0xFF, 0xFF, 0xFF), (0x60, 0xA0, 0xFF, 0xFF), (0x50, 0x80, 0xFF, 0xFF), (0xA0, 0x70, 0xFF, 0xFF),
+    (0xF0, 0x60, 0xFF, 0xFF), (0xFF, 0x60, 0xB0, 0xFF), (0xFF, 0x78, 0x30, 0xFF), (0xFF, 0xA0, 0x00, 0xFF),
+    (0xE8, 0xD0, 0x20, 0xFF), (0x98, 0xE8, 0x00, 0xFF), (0x70, 0xF0, 0x40, 0xFF), (0x70, 0xE0, 0x90, 0xFF),
+    (0x60, 0xD0, 0xE0, 0xFF), (0x60, 0x60, 0x60, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF),
+
+    (0xFF, 0xFF, 0xFF, 0xFF), (0x90, 0xD0, 0xFF, 0xFF), (0xA0, 0xB8, 0xFF, 0xFF), (0xC0, 0xB0, 0xFF, 0xFF),
+    (0xE0, 0xB0, 0xFF, 0xFF), (0xFF, 0xB8, 0xE8, 0xFF), (0xFF, 0xC8, 0xB8, 0xFF), (0xFF, 0xD8, 0xA0, 0xFF),
+    (0xFF, 0xF0, 0x90, 0xFF), (0xC8, 0xF0, 0x80, 0xFF), (0xA0, 0xF0, 0xA0, 0xFF), (0xA0, 0xFF, 0xC8, 0xFF),
+    (0xA0, 0xFF, 0xF0, 0xFF), (0xA0, 0xA0, 0xA0, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF),
+], dtype=np.uint8)
+# 同样的颜色打包成 uint32, 内存中的字节顺序和 PALETTE 一样是 R G B A
+PALETTE_PACKED = PALETTE.view('<u4').reshape(64)
+
+
+@unique
+class Mirroring(IntEnum):
+    HORIZONTAL = 0  # $2000 = $2400, $2800 = $2C00
+    VERTICAL = 1  # $2000 = $2800, $2400 = $2C00
+    SINGLE_LOW = 2  # 4 个名称表都是第一块显存
+    SINGLE_HIGH = 3  # 4 个名称表都是第二块显存
+    FOUR_SCREEN = 4  # 卡带上有额外的显存, 4 个名称表各不相同
+
+    @classmethod
+    def from_rom(cls, rom):
+        if rom.four_screen:
+            return cls.FOUR_SCREEN
+        return cls.VERTICAL if rom.vmirroring else cls.HORIZONTAL
+
+
+# 每种镜像方式下 4 个名称表分别对应哪一块 1K 显存
+NAMETABLE_BANKS = {
+    Mirroring.HORIZONTAL: (0, 0, 1, 1),
+    Mirroring.VERTICAL: (0, 1, 0, 1),
+    Mirroring.SINGLE_LOW: (0, 0, 0, 0),
+    Mirroring.SINGLE_HIGH: (1, 1, 1, 1),
+    Mirroring.FOUR_SCREEN: (0, 1, 2, 3),
+}
+
+
+def build_address_table(mirroring: Mirroring):
+    '''
+    PPU 地址 ($0000-$3FFF) => PPU._memory 里的实际位置
+    $0000-$1FFF 图样表, 不变
+    $2000-$2FFF 名称表, 按镜像方式映射到 $2000 开始的 1K 显存块上
+    $3000-$3EFF 是 $2000-$2EFF 的镜像
+    $3F00-$3FFF 每 32 字节是调色板的镜像, $3F10 $3F14 $3F18 $3F1C 是 $3F00 $3F04 $3F08 $3F0C 的镜像
+    :return: (numpy 数组, list), 渲染时用数组做批量下标, CPU 读写 $2007 时用 list
+    '''
+    banks = NAMETABLE_BANKS[mirroring]
+    table = list(range(0x2000))
+    for address in range(0x2000, 0x3F00):
+        offset = address & 0x0FFF
+        table.append(0x2000 + banks[offset >> 10] * 0x400 + (offset & 0x3FF))
+    for address in range(0x3F00, 0x4000):
+        offset = address & 0x1F
+        if offset & 0x13 == 0x10:
+            offset &= 0x0F
+        table.append(0x3F00 + offset)
+    return np.array(table, dtype=np.intp), table
+
+
+# 所有镜像方式的地址表在载入模块时就建好, 切换镜像方式只是换一个引用
+ADDRESS_TABLES = {mirroring: build_address_table(mirroring) for mirroring in Mirroring}
+
+
+def decode_pattern(data):
+    '''
+    把图样数据解码成 (n, 8, 8) 的图块像素, 每个像素是 0 - 3
+    每个图块 16 字节, 前 8 字节是颜色的第 0 位, 后 8 字节是第 1 位, 每个字节是一行, 最高位在最左边
+    '''
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(-1, 2, 8)
+    low = np.unpackbits(planes[:, 0, :, None], axis=-1)
+    high = np.unpackbits(planes[:, 1, :, None], axis=-1)
+    return low | (high << 1)
+
+
+def build_background_addresses():
+    '''
+    4 个名称表拼成的 60 x 64 个图块里, 每个图块的名称表地址, 属性表地址, 和颜色高 2 位在属性字节里的位置
+    '''
+    tile_y, tile_x = np.mgrid[0:60, 0:64]
+    base = 0x2000 + (tile_y // 30) * 0x800 + (tile_x >> 5) * 0x400
+    row, column = tile_y % 30, tile_x & 31
+    nametable = base + row * 32 + column
+    attribute = base + 0x3C0 + (row >> 2) * 8 + (column >> 2)
+    shift = ((row & 2) << 1) | (column & 2)
+    return nametable, attribute, shift
+
+
+NAMETABLE_ADDRESSES, ATTRIBUTE_ADDRESSES, ATTRIBUTE_SHIFTS = build_background_addresses()
+
+
 class Registers:
-    PPUCTRL = 0
-    PPUMASK = 0
-    PPUSTATUS = 0b10100000
-    OAMADDR = 0
-    OAMDATA = 0
-    PPUSCROLL = 0
-    _PPUADDR = bytearray(2)  # 16位, 高低两部分分别读取
-    PPUDATA = 0
-    OAMDMA = 0
+    '''
+    每个 PPU 实例都有自己的一组寄存器, 全部是普通的整数字段
+
+    PPU 内部的滚动寄存器, $2000 $2005 $2006 $2007 共用:
+        v: 当前的 VRAM 地址, 15 位
+        t: 临时的 VRAM 地址, 15 位, 也就是屏幕左上角的位置
+        fine_x: 水平方向的精细滚动, 3 位
+        w: 写入开关, 0 表示下一次 $2005 / $2006 写第一个字节, 读 $2002 时清零
+    v 和 t 的格式:
+        yyy NN YYYYY XXXXX
+        ||| || ||||| +++++-- 图块的列 (coarse X)
+        ||| || +++++-------- 图块的行 (coarse Y)
+        ||| ++-------------- 名称表
+        +++----------------- 图块内的行 (fine Y)
+    '''
+    __slots__ = ('PPUCTRL', 'PPUMASK', 'PPUSTATUS', 'OAMADDR', 'OAMDATA', 'PPUDATA', 'OAMDMA',
+                 'CACHE', 'LATCH', 'v', 't', 'fine_x', 'w')
 
     ADD_RANGE = (0x2000, 0x2001, 0x2002, 0x2003, 0x2004, 0x2005, 0x2006, 0x2007, 0x4014)
-    _PPUADDR_WRITE_COUNT = 1
 
-    _CACHE = 0  # 内部的缓存区
+    def __init__(self):
+        self.PPUCTRL = 0
+        self.PPUMASK = 0
+        self.PPUSTATUS = 0b10100000
+        self.OAMADDR = 0
+        self.OAMDATA = 0
+        self.PPUDATA = 0
+        self.OAMDMA = 0
+
+        self.CACHE = 0  # 内部的缓存区
+        self.LATCH = 0  # CPU 和 PPU 之间数据总线上最后一个值, 读只写的寄存器时读到的是它 (open bus)
+        self.v = 0
+        self.t = 0
+        self.fine_x = 0
+        self.w = 0
 
     @property
     def PPUADDR(self):
-        v = FlagByte(0x0)
-        v[0:8] = self._PPUADDR[0]
-        v[8:16] = self._PPUADDR[1]
-        return v.value
-
-    @PPUADDR.setter
-    def PPUADDR(self, value):
-        if self._PPUADDR_WRITE_COUNT % 2 == 0:
-            self._PPUADDR[0] = value  # write low
-        else:
-            self._PPUADDR[1] = value  # write high
-        self._PPUADDR_WRITE_COUNT += 1
+        # PPU 的地址总线只有 14 位
+        return self.v & 0x3FFF
 
-    def PPUADDR_INC(self, value=1):
-        v = FlagByte(0x0)
-        v[0:8] = self._PPUADDR[0]
-        v[8:16] = self._PPUADDR[1]
-        v.value += value
-        self._PPUADDR[0] = v[0:8]
-        self._PPUADDR[1] = v[8:16]
+    def write_PPUCTRL(self, value):
+        self.PPUCTRL = value
+        self.t = (self.t & 0x73FF) | ((value & 0x03) << 10)
 
-    @property
-    def CACHE(self):
-        return self._CACHE
+    def read_PPUSTATUS(self):
+        # 读 $2002 会清掉写入开关和 vblank 标志
+        self.w = 0
+        status = self.PPUSTATUS
+        self.PPUSTATUS = status & 0x7F
+        return status
 
-    @CACHE.setter
-    def CACHE(self, value):
-        self._CACHE = value
+    def write_PPUSCROLL(self, value):
+        if self.w == 0:
+            self.t = (self.t & 0x7FE0) | (value >> 3)
+            self.fine_x = value & 0x07
+            self.w = 1
+        else:
+            self.t = (self.t & 0x0C1F) | ((value & 0x07) << 12) | ((value & 0xF8) << 2)
+            self.w = 0
+
+    def write_PPUADDR(self, value):
+        if self.w == 0:
+            self.t = (self.t & 0x00FF) | ((value & 0x3F) << 8)  # write high
+            self.w = 1
+        else:
+            self.t = (self.t & 0x7F00) | value  # write low
+            self.v = self.t
+            self.w = 0
+
+    def PPUADDR_INC(self):
+        # PPUCTRL 第 2 位: 0 表示每次加 1 (横着走), 1 表示每次加 32 (竖着走一行)
+        self.v = (self.v + (32 if self.PPUCTRL & 0x04 else 1)) & 0x7FFF
 
 
 class PPU(BaseClass):
-    def __init__(self):
+    WIDTH = 256
+    HEIGHT = 240
+
+    # 一条扫描线 341 个点, 一帧 262 条扫描线, 一个 CPU 周期等于 3 个点
+    DOTS_PER_LINE = 341
+    LINES_PER_FRAME = 262
+    DOTS_PER_FRAME = DOTS_PER_LINE * LINES_PER_FRAME
+    VBLANK_DOT = 241 * DOTS_PER_LINE + 1  # 第 241 条扫描线的第 1 个点进入 vblank
+    PRE_RENDER_DOT = 261 * DOTS_PER_LINE + 1  # 预渲染线的第 1 个点离开 vblank, 清掉标志位
+
+    def __init__(self, framebuffer=None):
         super(PPU, self).__init__()
         self._running = True
 
         self._memory: bytearray = bytearray(16 * 1024)
         self._registers = Registers()
 
+        # 图样表 $0000-$1FFF 分成 8 个 1K 窗口, 每个窗口是一段 memoryview
+        # 默认指向自己的显存 (CHR-RAM), 有 CHR-ROM 的卡带由 mapper 直接指向 ROM 数据, 切换 bank 只是换一个引用
+        self.chr_pages = [memoryview(self._memory)[i << 10:(i + 1) << 10] for i in range(8)]
+        # 图样表里 512 个图块解码后的像素, 每个像素是 0 - 3
+        # 切换 CHR bank 时换上 mapper 预先解码好的图块, CHR-RAM 写入时只重新解码被写的那个图块
+        self.tiles = np.zeros((512, 8, 8), dtype=np.uint8)
+        # 没有插卡带时 4 个名称表各自独立, 载入 ROM 时按卡带设置
+        self.mirroring = Mirroring.FOUR_SCREEN
+        self._address_array, self._address_table = ADDRESS_TABLES[self.mirroring]
+        # 精灵属性表, 64 个精灵, 每个 4 字节: Y, 图块编号, 属性, X
+        self.oam = bytearray(256)
+        # 渲染结果, 每个像素是调色板内存里的下标 (0 - 31), 颜色转换留到最后一步
+        # 可以传入外面分配好的 (240, 256) uint8 数组, PPU 只在原地修改它
+        if framebuffer is None:
+            framebuffer = np.zeros((self.HEIGHT, self.WIDTH), dtype=np.uint8)
+        self.framebuffer = framebuffer
+        self.render_version = 0  # framebuffer 每次被修改都加 1
+
+        # 追赶式同步: PPU 不和 CPU 一个点一个点地同步, 而是记下已经跑到的点, 需要时一次追上
+        self.dot = 0  # 上电以来已经处理到的点
+        self.frame_count = 0
+        self._frame_start = 0  # 当前帧开始的点
+        self._line = 0  # 当前帧下一条要渲染的可见扫描线
+        self._phase = 0  # 0: 渲染可见扫描线, 1: 等待 vblank, 2: vblank 中, 3: 等待这一帧结束
+        self._scroll_y = 0  # 这一帧开始时从 t 取出的垂直滚动位置
+        # 事件调度: 下一个 PPU 事件 (vblank 开始和结束, 帧结束, sprite 0 命中) 安排在 CPU 的调度器里
+        self.scheduler = None
+        self._nmi = None  # 发出 NMI 时调用, 一般是 Cpu.nmi
+        self._event_name = None
+
+        # 4 个名称表拼成的 480 x 512 的背景缓存, 每帧只重画变过的图块, 滚动只是换一个取景的窗口
+        self._background = np.zeros((480, 512), dtype=np.uint8)
+        # 显存 $2000-$2FFF 里被写过的字节 (名称表和属性表), 和被重新解码过的图块
+        self._dirty_nametable = bytearray(0x1000)
+        self._dirty_patterns = np.zeros(512, dtype=bool)
+        self._background_pattern = None  # 背景缓存用的图样表, PPUCTRL 切换后要全部重画
+        self._background_full = True  # 下一帧全部重画
+        # 调色板查找表的缓存, 调色板内存或者灰度模式变了才重新计算
+        self._palette_dirty = True
+        self._palette_cache = None
+        self._palette_grayscale = 0
+
     def run(self):
         while self._running:
             self.execute()
@@ -68,8 +254,249 @@ class PPU(BaseClass):
     def ADD_range(self):
         return self._registers.ADD_RANGE
 
+    @property
+    def rendering_enabled(self):
+        # PPUMASK 打开了背景或者精灵, PPU 才会去取图样数据 (MMC3 靠这个数扫描线)
+        return self._registers.PPUMASK & 0x18 != 0
+
+    def set_mirroring(self, mirroring: Mirroring):
+        # 载入 ROM 或者 mapper 切换镜像方式时调用
+        self.mirroring = mirroring
+        self._address_array, self._address_table = ADDRESS_TABLES[mirroring]
+        self._background_full = True
+
+    def invalidate_render_cache(self):
+        # 不经过 $2007 直接改了 PPU 内存之后调用, 下一帧全部重新计算
+        self._background_full = True
+        self._palette_dirty = True
+
     def execute(self):
-        pass
+        # 新的一帧开始时清掉 sprite 0 hit 和精灵溢出
+        self._registers.PPUSTATUS &= 0x9F
+        self.latch_scroll_y()
+        self.render_background()
+        self.render_sprites()
+
+    def latch_scroll_y(self):
+        # 垂直滚动只在预渲染线从 t 复制到 v, 一帧中间写 $2005 不会影响这一帧剩下的部分
+        t = self._registers.t
+        self._scroll_y = ((t >> 11) & 1) * 240 + ((t >> 5) & 0x1F) * 8 + (t >> 12)
+
+    def render_lines(self, start, end):
+        self.render_background(start, end)
+        self.render_sprites(start, end)
+
+    def connect(self, scheduler, nmi):
+        self.scheduler = scheduler
+        self._nmi = nmi
+        self.schedule_next_event()
+
+    def schedule_next_event(self):
+        # 影响下一个事件时间的状态变了 (追赶, 写 PPUCTRL PPUMASK OAM) 之后重新安排
+        scheduler = self.scheduler
+        if scheduler is None:
+            return
+        cycle, name = self.next_event()
+        if name != self._event_name and self._event_name is not None:
+            scheduler.cancel(self._event_name)
+        self._event_name = name
+        scheduler.schedule(name, cycle, self.on_event)
+
+    def on_event(self, cycle):
+        # 事件到期时已经从调度器里移除了, 追赶之后安排下一个
+        self._event_name = None
+        self.catch_up(cycle)
+        if self._event_name is None:
+            self.schedule_next_event()
+
+    def request_nmi(self, dot):
+        if self._nmi is not None:
+            self.scheduler.schedule('nmi', -(-dot // 3), self._nmi)
+
+    def catch_up(self, cycle):
+        '''
+        把 PPU 推进到 CPU 的第 cycle 个周期
+        只在几个时间点做事情, 中间的点直接跳过:
+            可见扫描线在第 256 个点画完, 追赶时把已经画完的扫描线一批渲染出来
+            第 241 条扫描线进入 vblank, 预渲染线离开 vblank, 第 262 条扫描线结束时开始新的一帧
+        CPU 读写 PPU 寄存器之前, 以及 FC.run_frame 到了 next_event_cycle 时调用
+        '''
+        target = cycle * 3
+        registers = self._registers
+        if self.dot >= target:
+            return
+        before = (self._phase, self._line)
+        while self.dot < target:
+            start = self._frame_start
+            if self._phase == 0:
+                # 到 target 为止画完了的扫描线
+                end = min(self.HEIGHT, (target - start - 256) // self.DOTS_PER_LINE + 1)
+                if end > self._line:
+                    self.render_lines(self._line, end)
+                    self._line = end
+                if end < self.HEIGHT:
+                    self.dot = target
+                    break
+                self.dot = start + (self.HEIGHT - 1) * self.DOTS_PER_LINE + 256
+                self._phase = 1
+            elif self._phase == 1:
+                if start + self.VBLANK_DOT > target:
+                    self.dot = target
+                    break
+                self.dot = start + self.VBLANK_DOT
+                registers.PPUSTATUS |= 0x80
+                if registers.PPUCTRL & 0x80:
+                    self.request_nmi(self.dot)
+                self._phase = 2
+            elif self._phase == 2:
+                if start + self.PRE_RENDER_DOT > target:
+                    self.dot = target
+                    break
+                self.dot = start + self.PRE_RENDER_DOT
+                # 离开 vblank, 清掉 vblank, sprite 0 hit 和精灵溢出
+                registers.PPUSTATUS &= 0x1F
+                self._phase = 3
+            else:
+                if start + self.DOTS_PER_FRAME > target:
+                    self.dot = target
+                    break
+                self.latch_scroll_y()
+                self._frame_start = self.dot = start + self.DOTS_PER_FRAME
+                self._line = 0
+                self._phase = 0
+                self.frame_count += 1
+        if (self._phase, self._line) != before:
+            self.schedule_next_event()
+
+    def next_event(self):
+        '''
+        CPU 最多可以不管 PPU 一直跑到这个周期:
+        vblank 开始和结束, 一帧结束, 以及 sprite 0 可能命中的扫描线 (轮询 $2002 的空转循环不能跳过它)
+        :return: (周期, 事件名)
+        '''
+        start = self._frame_start
+        if self._phase == 0:
+            dot, name = start + self.VBLANK_DOT, 'vblank'
+            line = self.sprite_zero_line()
+            if line is not None:
+                dot, name = start + line * self.DOTS_PER_LINE + 256, 'sprite0'
+        elif self._phase == 1:
+            dot, name = start + self.VBLANK_DOT, 'vblank'
+        elif self._phase == 2:
+            dot, name = start + self.PRE_RENDER_DOT, 'vblank_end'
+        else:
+            dot, name = start + self.DOTS_PER_FRAME, 'frame_end'
+        return -(-dot // 3), name
+
+    def next_event_cycle(self):
+        return self.next_event()[0]
+
+    def frame_end_cycle(self):
+        return -(-(self._frame_start + self.DOTS_PER_FRAME) // 3)
+
+    def sprite_zero_line(self):
+        # 这一帧接下来 sprite 0 可能命中的第一条扫描线, 不可能命中时返回 None
+        registers = self._registers
+        if registers.PPUSTATUS & 0x40 or registers.PPUMASK & 0x18 != 0x18:
+            return None
+        top = self.oam[0] + 1
+        bottom = min(top + (16 if registers.PPUCTRL & 0x20 else 8), self.HEIGHT)
+        line = max(self._line, top)
+        if line >= bottom:
+            return None
+        return line
+
+    def decode_tiles(self, start=0, end=512):
+        # 从图样表窗口里解码第 start 到 end - 1 个图块, 每个 1K 窗口 64 个图块
+        for window in range(start >> 6, (end + 63) >> 6):
+            base = window << 6
+            first, last = max(start, base), min(end, base + 64)
+            page = self.chr_pages[window]
+            self.tiles[first:last] = decode_pattern(page[(first - base) * 16:(last - base) * 16])
+        self._dirty_patterns[start:end] = True
+
+    def reset_chr(self):
+        # 换卡带时把 8 个窗口指回自己的显存 (CHR-RAM) 并清空, 有 CHR-ROM 的卡带之后再由 mapper 装上
+        self._memory[0:0x2000] = bytes(0x2000)
+        self.chr_pages = [memoryview(self._memory)[i << 10:(i + 1) << 10] for i in range(8)]
+        self.decode_tiles()
+
+    def map_chr(self, window, page, tiles=None):
+        '''
+        把图样表的第 window 个 1K 窗口 ($0000 + window * $400) 指向 page
+        page 是 1K 的 memoryview, CHR-ROM 的是只读的, 写入会被忽略
+        tiles 是 page 预先解码好的 64 个图块, 没有时现场解码
+        '''
+        self.chr_pages[window] = page
+        start = window << 6
+        if tiles is None:
+            self.decode_tiles(start, start + 64)
+        else:
+            self.tiles[start:start + 64] = tiles
+            self._dirty_patterns[start:start + 64] = True
+
+    def update_background(self):
+        '''
+        把变过的图块重画到背景缓存里
+        一个图块要重画: 它的名称表字节或者属性字节被写过, 或者它用的图块被重新解码过
+        切换镜像方式或者图样表时全部重画
+        '''
+        memory = np.frombuffer(self._memory, dtype=np.uint8)
+        table = self._address_array
+        pattern = 256 if self._registers.PPUCTRL & 0x10 else 0  # 图样表 $1000 从第 256 个图块开始
+        nametable = table[NAMETABLE_ADDRESSES]
+        attribute = table[ATTRIBUTE_ADDRESSES]
+        tiles = memory[nametable].astype(np.intp) + pattern
+
+        written = np.frombuffer(self._dirty_nametable, dtype=bool)
+        if self._background_full or pattern != self._background_pattern:
+            dirty = np.ones(tiles.shape, dtype=bool)
+        else:
+            dirty = written[nametable - 0x2000] | written[attribute - 0x2000] | self._dirty_patterns[tiles]
+        tile_y, tile_x = np.nonzero(dirty)
+        if len(tile_y):
+            attributes = (memory[attribute[tile_y, tile_x]] >> ATTRIBUTE_SHIFTS[tile_y, tile_x]) & 3
+            pixels = self.tiles[tiles[tile_y, tile_x]]
+            values = np.where(pixels, (attributes[:, None, None] << 2) | pixels, 0)
+            # (480, 512) 看成 (60 行图块, 8, 64 列图块, 8), 一次把所有脏图块写回去
+            self._background.reshape(60, 8, 64, 8)[tile_y, :, tile_x, :] = values
+
+        written[:] = False
+        self._dirty_patterns[:] = False
+        self._background_pattern = pattern
+        self._background_full = False
+
+    def render_background(self, start=0, end=240):
+        '''
+        渲染第 start 到 end - 1 条扫描线的背景, 整块用 NumPy 一次算完, 没有逐像素的 Python 循环
+
+        4 个名称表拼成 64 x 60 个图块 (512 x 480 像素) 的一整张图, 屏幕是从滚动位置开始的 256 x 240 的窗口,
+        超出右边或下边时回绕到另一侧
+        每个像素:
+            名称表 -> 图块编号, 图块编号 + 图块内的行和列 -> 解码好的图块 (self.tiles) -> 颜色的低 2 位
+            属性表 -> 图块所在的 2 x 2 图块区域 -> 颜色的高 2 位
+        低 2 位是 0 的像素是透明的, 使用背景色 $3F00
+        整张图缓存在 self._background 里, 由 update_background 增量更新
+        '''
+        registers = self._registers
+        if not registers.PPUMASK & 0x08:
+            self.framebuffer[start:end] = 0
+            self.render_version += 1
+            return
+
+        self.update_background()
+
+        # 水平滚动每条扫描线都从 t 和 fine_x 取, 垂直滚动用这一帧开始时的位置, 换算成背景缓存里的坐标
+        t = registers.t
+        scroll_x = ((t >> 10) & 1) * 256 + (t & 0x1F) * 8 + registers.fine_x
+        x = (scroll_x + np.arange(self.WIDTH)) % 512
+        y = (self._scroll_y + np.arange(start, end)) % 480
+        frame = self._background[y[:, None], x[None, :]]
+        if not registers.PPUMASK & 0x02:
+            # 不显示最左边 8 个像素的背景
+            frame[:, :8] = 0
+        self.framebuffer[start:end] = frame
+        self.render_version += 1
 
     def read_address_from_cpu(self, address: int):
         '''
@@ -123,71 +550,182 @@ class PPU(BaseClass):
 
         对上述地址进行读写，就可以读写 PPU 内部寄存器的值了
         '''
-        address = self.memory_mapper(address)
-
-        if address == 0x2007:
-            if 0x3F00 <= self._registers.PPUADDR <= 0x3FFF:
-                return self._memory[address]
+        registers = self._registers
+        if address == 0x2002:
+            d = registers.read_PPUSTATUS()
+        elif address == 0x2004:
+            d = self.oam[registers.OAMADDR]
+        elif address == 0x2007:
+            address = self._address_table[registers.PPUADDR]
+            registers.PPUADDR_INC()
+            if address >= 0x3F00:
+                # 调色板不经过缓存区, 直接返回
+                d = self._memory[address]
             else:
-                d = self._registers.CACHE
-                self._registers.CACHE = self._memory[self._registers.PPUADDR]
-                self._registers.PPUADDR_INC()
-                return d
-
-        return self._memory[address]
+                d = registers.CACHE
+                if address < 0x2000:
+                    registers.CACHE = self.chr_pages[address >> 10][address & 0x3FF]
+                else:
+                    registers.CACHE = self._memory[address]
+        else:
+            # 其他寄存器只能写
+            return registers.LATCH
+        registers.LATCH = d
+        return d
 
     def write_address_from_cpu(self, address: int, data):
-        address = self.memory_mapper(address)
-        if address == 0x2006:
-            self._registers.PPUADDR = data
+        self._registers.LATCH = data
+        if address == 0x2000:
+            registers = self._registers
+            if data & ~registers.PPUCTRL & 0x80 and registers.PPUSTATUS & 0x80:
+                # vblank 期间打开 NMI 会立刻触发一次
+                self.request_nmi(self.dot)
+            registers.write_PPUCTRL(data)
+            self.schedule_next_event()
+        elif address == 0x2001:
+            self._registers.PPUMASK = data
+            self.schedule_next_event()
+        elif address == 0x2003:
+            self._registers.OAMADDR = data
+        elif address == 0x2004:
+            self.oam[self._registers.OAMADDR] = data
+            self._registers.OAMADDR = (self._registers.OAMADDR + 1) & 0xFF
+            self.schedule_next_event()
+        elif address == 0x2005:
+            self._registers.write_PPUSCROLL(data)
+        elif address == 0x2006:
+            self._registers.write_PPUADDR(data)
         elif address == 0x2007:
-            self._memory[self._registers.PPUADDR] = data
+            address = self._address_table[self._registers.PPUADDR]
+            if address < 0x2000:
+                # 只有 CHR-RAM 可以写, 写完重新解码被写的图块
+                page = self.chr_pages[address >> 10]
+                if not page.readonly:
+                    page[address & 0x3FF] = data
+                    tile = address >> 4
+                    self.decode_tiles(tile, tile + 1)
+            else:
+                self._memory[address] = data
+                if address < 0x3F00:
+                    self._dirty_nametable[address - 0x2000] = 1
+                else:
+                    self._palette_dirty = True
             self._registers.PPUADDR_INC()
 
+    def evaluate_sprites(self, start=0, end=240):
+        '''
+        精灵评估: 找出第 start 到 end - 1 条扫描线上要显示的精灵
+        每条扫描线最多 8 个, OAM 里靠前的优先, 超过 8 个时设置精灵溢出标志
+        :return: (end - start, 64) 的 bool 数组, [行, 精灵] 为 True 表示这个精灵出现在这一行
+        '''
+        sprites = np.frombuffer(self.oam, dtype=np.uint8).reshape(64, 4)
+        height = 16 if self._registers.PPUCTRL & 0x20 else 8
+        # 精灵在 OAM 里的 Y 比实际显示的位置小 1
+        top = sprites[:, 0].astype(np.intp) + 1
+        rows = np.arange(start, end)[:, None]
+        visible = (rows >= top) & (rows < top + height)
+        if visible.sum(axis=1).max(initial=0) > 8:
+            self._registers.PPUSTATUS |= 0x20
+        return visible & (np.cumsum(visible, axis=1) <= 8)
+
+    def sprite_pixels(self, tile, attribute):
+        # 一个精灵的像素, 8 x 8 或者 8 x 16, 已经处理了翻转
+        ctrl = self._registers.PPUCTRL
+        if ctrl & 0x20:
+            # 8 x 16 的精灵: 图块编号的第 0 位选图样表, 上下两个图块连续
+            first = (tile & 1) * 256 + (tile & 0xFE)
+            pixels = self.tiles[first:first + 2].reshape(16, 8)
+        else:
+            pixels = self.tiles[(256 if ctrl & 0x08 else 0) + tile]
+        if attribute & 0x40:
+            pixels = pixels[:, ::-1]
+        if attribute & 0x80:
+            pixels = pixels[::-1]
+        return pixels
+
+    def render_sprites(self, start=0, end=240):
+        '''
+        把精灵画到 render_background 画好的扫描线上
+        先在精灵层里按 OAM 倒序画, 这样靠前的精灵覆盖靠后的; 再和背景合成一次:
+        属性第 5 位为 1 的精灵在背景后面, 只在背景透明的地方显示
+        sprite 0 的不透明像素和背景的不透明像素重叠时设置 sprite 0 hit
+        '''
+        registers = self._registers
+        mask = registers.PPUMASK
+        if not mask & 0x10:
+            return
+
+        visible = self.evaluate_sprites(start, end)
+        height = end - start
+        layer = np.zeros((height, self.WIDTH), dtype=np.uint8)
+        behind = np.zeros((height, self.WIDTH), dtype=bool)
+        zero = np.zeros((height, self.WIDTH), dtype=bool)
+        oam = self.oam
+        for index in np.flatnonzero(visible.any(axis=0))[::-1]:
+            y, tile, attribute, x = oam[index * 4:index * 4 + 4]
+            rows = np.flatnonzero(visible[:, index])
+            columns = np.arange(x, min(x + 8, self.WIDTH))
+            pixels = self.sprite_pixels(tile, attribute)[rows + start - (y + 1), :len(columns)]
+            opaque = pixels != 0
+            area = np.ix_(rows, columns)
+            value = 0x10 | ((attribute & 3) << 2) | pixels
+            layer[area] = np.where(opaque, value, layer[area])
+            behind[area] = np.where(opaque, bool(attribute & 0x20), behind[area])
+            if index == 0:
+                zero[area] = opaque
+        if not mask & 0x04:
+            # 不显示最左边 8 个像素的精灵
+            layer[:, :8] = 0
+            zero[:, :8] = False
+
+        frame = self.framebuffer[start:end]
+        background = (frame & 3) != 0
+        if (zero & background)[:, :255].any():
+            registers.PPUSTATUS |= 0x40
+        show = (layer != 0) & ~(behind & background)
+        frame[show] = layer[show]
+
+    def oam_dma(self, page: bytes):
+        # OAMDMA: 从 OAMADDR 开始写入 256 字节, 超过末尾时回到 OAM 开头
+        offset = self._registers.OAMADDR
+        self.oam[offset:] = page[:256 - offset]
+        self.oam[:offset] = page[256 - offset:]
+        self.schedule_next_event()
+
     def palette_table(self):  # 调色板的内存是32字节, 所以同一时刻, 屏幕上有32个颜色可用, 前16个给背景用, 后16个给精灵用
-        # r g b a # 第一个像素的颜色可以有16种, 那么它的颜色的索引可以用4位来表示, 低2位的信息在图样表, 高2位的信息在属性表
-        palette = [
-            (0x7F, 0x7F, 0x7F, 0xFF), (0x20, 0x00, 0xB0, 0xFF), (0x28, 0x00, 0xB8, 0xFF), (0x60, 0x10, 0xA0, 0xFF),
-            (0x98, 0x20, 0x78, 0xFF), (0xB0, 0x10, 0x30, 0xFF), (0xA0, 0x30, 0x00, 0xFF), (0x78, 0x40, 0x00, 0xFF),
-            (0x48, 0x58, 0x00, 0xFF), (0x38, 0x68, 0x00, 0xFF), (0x38, 0x6C, 0x00, 0xFF), (0x30, 0x60, 0x40, 0xFF),
-            (0x30, 0x50, 0x80, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF),
-
-            (0xBC, 0xBC, 0xBC, 0xFF), (0x40, 0x60, 0xF8, 0xFF), (0x40, 0x40, 0xFF, 0xFF), (0x90, 0x40, 0xF0, 0xFF),
-            (0xD8, 0x40, 0xC0, 0xFF), (0xD8, 0x40, 0x60, 0xFF), (0xE0, 0x50, 0x00, 0xFF), (0xC0, 0x70, 0x00, 0xFF),
-            (0x88, 0x88, 0x00, 0xFF), (0x50, 0xA0, 0x00, 0xFF), (0x48, 0xA8, 0x10, 0xFF), (0x48, 0xA0, 0x68, 0xFF),
-            (0x40, 0x90, 0xC0, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF),
-
-            (0xFF, 0xFF, 0xFF, 0xFF), (0x60, 0xA0, 0xFF, 0xFF), (0x50, 0x80, 0xFF, 0xFF), (0xA0, 0x70, 0xFF, 0xFF),
-            (0xF0, 0x60, 0xFF, 0xFF), (0xFF, 0x60, 0xB0, 0xFF), (0xFF, 0x78, 0x30, 0xFF), (0xFF, 0xA0, 0x00, 0xFF),
-            (0xE8, 0xD0, 0x20, 0xFF), (0x98, 0xE8, 0x00, 0xFF), (0x70, 0xF0, 0x40, 0xFF), (0x70, 0xE0, 0x90, 0xFF),
-            (0x60, 0xD0, 0xE0, 0xFF), (0x60, 0x60, 0x60, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF),
-
-            (0xFF, 0xFF, 0xFF, 0xFF), (0x90, 0xD0, 0xFF, 0xFF), (0xA0, 0xB8, 0xFF, 0xFF), (0xC0, 0xB0, 0xFF, 0xFF),
-            (0xE0, 0xB0, 0xFF, 0xFF), (0xFF, 0xB8, 0xE8, 0xFF), (0xFF, 0xC8, 0xB8, 0xFF), (0xFF, 0xD8, 0xA0, 0xFF),
-            (0xFF, 0xF0, 0x90, 0xFF), (0xC8, 0xF0, 0x80, 0xFF), (0xA0, 0xF0, 0xA0, 0xFF), (0xA0, 0xFF, 0xC8, 0xFF),
-            (0xA0, 0xFF, 0xF0, 0xFF), (0xA0, 0xA0, 0xA0, 0xFF), (0x00, 0x00, 0x00, 0xFF), (0x00, 0x00, 0x00, 0xFF),
-        ]
-        return palette
+        # 第一个像素的颜色可以有16种, 那么它的颜色的索引可以用4位来表示, 低2位的信息在图样表, 高2位的信息在属性表
+        return PALETTE
+
+    def palette_indices(self):
+        '''
+        把调色板内存 $3F00-$3F1F 解析成这一帧的 32 项查找表, 每一项是 PALETTE 里的下标
+        $3F10 $3F14 $3F18 $3F1C 是 $3F00 $3F04 $3F08 $3F0C 的镜像
+        '''
+        grayscale = self._registers.PPUMASK & 0x01
+        if self._palette_dirty or grayscale != self._palette_grayscale:
+            memory = np.frombuffer(self._memory, dtype=np.uint8)
+            indices = memory[self._address_array[0x3F00:0x3F20]]
+            # PPUMASK 第 0 位: 灰度模式, 只保留亮度
+            self._palette_cache = indices & (0x30 if grayscale else 0x3F)
+            self._palette_dirty = False
+            self._palette_grayscale = grayscale
+        return self._palette_cache
+
+    def to_rgba(self, out=None):
+        # 索引帧 -> (240, 256, 4) 的 RGBA, 查一次表就完成; 传入 out 时直接写进去, 不分配新内存
+        return np.take(PALETTE[self.palette_indices()], self.framebuffer, axis=0, out=out)
+
+    def to_rgb24(self, out=None):
+        return np.take(PALETTE[self.palette_indices(), :3], self.framebuffer, axis=0, out=out)
+
+    def to_uint32(self, out=None):
+        # 每个像素一个 32 位整数, 内存中的字节顺序是 R G B A
+        return np.take(PALETTE_PACKED[self.palette_indices()], self.framebuffer, out=out)
 
     def memory_mapper(self, address):
         '''
-        3F10 是 3F00 的镜像
-        3F14 是 3F04 的镜像
-        3F18 是 3F08 的镜像
-        3F1C 是 3F0C 的镜像
+        PPU 地址 => PPU._memory 里的实际位置, 镜像规则见 build_address_table
         :param address:
         :return:
         '''
-        mapper = {
-            0x3F10: 0x3F00,
-            0x3F14: 0x3F04,
-            0x3F18: 0x3F08,
-            0x3F1C: 0x3F0C,
-        }
-        if 0x3000 <= address <= 0x3eff:
-            address -= 4096
-            return address
-        elif address in mapper:
-            return mapper[address]
-        else:
-            return address
+        return self._address_table[address & 0x3FFF]
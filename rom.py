@@ -1,4 +1,6 @@
-from enum import IntFlag, unique
+import mmap
+import os
+from enum import IntEnum, IntFlag, unique
 
 
 @unique
@@ -13,30 +15,86 @@ class Control1(IntFlag):
 class Control2(IntFlag):
     VS_UNISYSTEM = 0x01
     Playchoice10 = 0x02
+    NES2 = 0x08  # 第 2 3 位是 10 时是 NES 2.0 的文件头
+
+
+@unique
+class Timing(IntEnum):
+    NTSC = 0
+    PAL = 1
+    MULTIPLE = 2  # 两种制式都能运行
+    DENDY = 3
+
+
+def nes2_rom_size(low: int, high: int, unit: int):
+    '''
+    NES 2.0 里 PRG-ROM CHR-ROM 的大小
+    高 4 位不是 $F 时, 高 4 位和低 8 位拼成以 unit 为单位的数量
+    否则低 8 位是指数-乘数形式: 2 ^ E * (MM * 2 + 1) 字节, E 是高 6 位, MM 是低 2 位
+    '''
+    if high == 0x0F:
+        return (1 << (low >> 2)) * ((low & 0x03) * 2 + 1)
+    return ((high << 8) | low) * unit
+
+
+def nes2_ram_size(shift: int):
+    # NES 2.0 里 RAM 的大小: 0 表示没有, 否则是 64 << shift 字节
+    return 64 << shift if shift else 0
 
 
 class NesHeader:
+    '''
+    iNES 和 NES 2.0 文件头, 16 字节
+    两种格式的前 8 字节一样, NES 2.0 用后 8 字节扩展了 mapper 编号, ROM RAM 的大小和制式
+    '''
+
     def __init__(self, header: bytes):
-        if len(header) < 8:
-            raise ValueError('length must bigger or equal 8')
+        if len(header) < 16:
+            raise ValueError('length must bigger or equal 16')
 
         self.id: bytes = b'NES\x1a'
-        if header[:4] != self.id:
+        if bytes(header[:4]) != self.id:
             raise ValueError('unsupported header')
 
-        self.count_prgrom16kb: int = header[4]  # 16k 程序只读储存器 数量, 一个字节
-        self.count_chrrom_8kb: int = header[5]  # 8k 角色只读存储器 数量, 一个字节
         self.control1: int = header[6]  # 控制信息1, 一个字节
         self.control2: int = header[7]  # # 控制信息2, 一个字节
-        self.reserved: bytes = header[7:16]  # # 保留数据, 8个字节
+        self.reserved: bytes = bytes(header[8:16])  # # 扩展数据, 8个字节
+
+        if self.nes2:
+            self.mapper_number: int = (self.control1 >> 4) | (self.control2 & 0xF0) | ((header[8] & 0x0F) << 8)
+            self.submapper: int = header[8] >> 4
+            self.prgrom_size: int = nes2_rom_size(header[4], header[9] & 0x0F, 16 * 1024)
+            self.chrrom_size: int = nes2_rom_size(header[5], header[9] >> 4, 8 * 1024)
+            self.prgram_size: int = nes2_ram_size(header[10] & 0x0F)
+            self.prgnvram_size: int = nes2_ram_size(header[10] >> 4)
+            self.chrram_size: int = nes2_ram_size(header[11] & 0x0F)
+            self.chrnvram_size: int = nes2_ram_size(header[11] >> 4)
+            self.timing: Timing = Timing(header[12] & 0x03)
+        else:
+            # 有些老的整理工具在第 7-15 字节写了别的东西, 这时 mapper 编号的高 4 位不可信
+            high = self.control2 & 0xF0 if not any(header[12:16]) else 0
+            self.mapper_number: int = (self.control1 >> 4) | high
+            self.submapper: int = 0
+            self.prgrom_size: int = header[4] * 16 * 1024
+            self.chrrom_size: int = header[5] * 8 * 1024
+            # iNES 只能表示有没有电池, PRG-RAM 按 8K 算, 没有 CHR-ROM 时有 8K CHR-RAM
+            prgram_size = (header[8] or 1) * 8 * 1024
+            self.prgram_size: int = 0 if self.save_ram else prgram_size
+            self.prgnvram_size: int = prgram_size if self.save_ram else 0
+            self.chrram_size: int = 0 if header[5] else 8 * 1024
+            self.chrnvram_size: int = 0
+            self.timing: Timing = Timing.PAL if header[9] & 0x01 else Timing.NTSC
+
+        self.count_prgrom16kb: int = self.prgrom_size // (16 * 1024)  # 16k 程序只读储存器 数量
+        self.count_chrrom_8kb: int = self.chrrom_size // (8 * 1024)  # 8k 角色只读存储器 数量
 
     @property
-    def trainer(self):
-        return self.control1 & Control1.TRAINER
+    def nes2(self):
+        return self.control2 & 0x0C == Control2.NES2
 
     @property
-    def mapper_number(self):
-        return (self.control1 >> 4) | (self.control2 & 0xF0)
+    def trainer(self):
+        return self.control1 & Control1.TRAINER
 
     @property
     def vmirroring(self):
@@ -60,25 +118,48 @@ class NesHeader:
 
 
 class ROM:
-    def __init__(self, rom: bytes):
+    '''
+    rom 可以是文件路径, 也可以是已经读进内存的数据
+    传入路径时把文件 mmap 进来, PRG-ROM CHR-ROM trainer 都是这块映射上的 memoryview, 不复制
+    同一个游戏开多个实例时, 它们共享操作系统的页缓存, 而不是各自持有一份
+    '''
+
+    def __init__(self, rom):
+        if isinstance(rom, (str, os.PathLike)):
+            with open(rom, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < 16:
+                    raise ValueError('{} is not a NES ROM'.format(rom))
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(self._mmap)
+        else:
+            self._mmap = None
+            data = memoryview(rom)
+        self._data = data
+
         offset = 0
-        header = NesHeader(rom[offset: offset + 16])
+        header = NesHeader(data[offset: offset + 16])
+        self.header: NesHeader = header
         offset += 16
 
-        # TODO 实现对于 Trainer 的处理
+        #  Trainer, 512 字节, 载入 ROM 时放到 $7000-$71FF
+        self.trainer = None
         if header.trainer:
+            self.trainer = data[offset: offset + 512]
             offset += 512
 
         #  PRG-ROM 程序只读储存器 数据指针
-        size1 = 16 * 1024 * header.count_prgrom16kb
-        self.data_prgrom: bytes = rom[offset: offset + size1]
+        size1 = header.prgrom_size
+        self.data_prgrom: memoryview = data[offset: offset + size1]
         offset += size1
 
         #  CHR-ROM 角色只读存储器 数据指针
-        size2 = 8 * 1024 * header.count_chrrom_8kb
-        self.data_chrrom: bytes = rom[offset: offset + size2]
+        size2 = header.chrrom_size
+        self.data_chrrom: memoryview = data[offset: offset + size2]
         offset += size2
 
+        if offset > len(data):
+            raise ValueError('ROM is truncated: need {} bytes, got {}'.format(offset, len(data)))
+
         #  16KB为单位 程序只读储存器 数据长度
         self.count_prgrom16kb: int = header.count_prgrom16kb
 
@@ -87,6 +168,7 @@ class ROM:
 
         #  Mapper 编号
         self.mapper_number: int = header.mapper_number
+        self.submapper: int = header.submapper
 
         #  是否Vertical Mirroring(否即为水平)
         self.vmirroring: int = header.vmirroring
@@ -97,9 +179,36 @@ class ROM:
         #  是否有SRAM(电池供电的)
         self.save_ram: int = header.save_ram
 
-        #  保留以对齐
-        self.reserved: int = header.reserved
+        #  PRG-RAM CHR-RAM 的大小, NVRAM 是电池供电的部分
+        self.prgram_size: int = header.prgram_size
+        self.prgnvram_size: int = header.prgnvram_size
+        self.chrram_size: int = header.chrram_size
+        self.chrnvram_size: int = header.chrnvram_size
+
+        #  制式
+        self.timing: Timing = header.timing
 
-        assert not header.trainer, "unsupported"
-        assert not header.vs_unisystem, "unsupported"
-        assert not header.play_choice_10, "unsupported"
+        #  VS System 和 PlayChoice-10 的卡带按普通卡带运行, 它们额外的硬件不模拟
+        self.vs_unisystem: int = header.vs_unisystem
+        self.play_choice_10: int = header.play_choice_10
+
+        #  保留以对齐
+        self.reserved: bytes = header.reserved
+
+    def close(self):
+        '''
+        释放 PRG CHR trainer 的 memoryview, 再关闭文件映射
+        之前要先让 mapper 和总线放开从它们切出来的页 (FC.unload_rom 会这样做)
+        '''
+        for view in (self.data_prgrom, self.data_chrrom, self.trainer, self._data):
+            if view is not None:
+                view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
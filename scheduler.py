@@ -0,0 +1,56 @@
+import heapq
+
+
+class Scheduler:
+    '''
+    按 CPU 周期排序的事件队列 (最小堆)
+    每个事件有一个名字, 同名的事件同时只有一个, 重新安排时旧的作废 (留在堆里, 弹出时跳过)
+    CPU 不在每条指令之后检查中断, 而是一直跑到最早的事件的时间, 再执行到期的事件
+    '''
+
+    def __init__(self, cpu=None):
+        self._cpu = cpu
+        self._heap = []
+        self._events = {}  # 名字 => 堆里有效的那一项
+        self._sequence = 0  # 同一周期的事件按安排的先后执行
+
+    def schedule(self, name, cycle, callback):
+        '''
+        在第 cycle 个周期执行 callback(cycle)
+        如果比 CPU 当前时间片的结束更早, 缩短时间片, CPU 执行完当前指令就会停下来处理它
+        '''
+        old = self._events.get(name)
+        if old is not None:
+            old[3] = None
+        entry = [cycle, self._sequence, name, callback]
+        self._sequence += 1
+        self._events[name] = entry
+        heapq.heappush(self._heap, entry)
+
+        cpu = self._cpu
+        if cpu is not None and cpu.next_event_cycle is not None and cycle < cpu.next_event_cycle:
+            cpu.next_event_cycle = cycle
+
+    def cancel(self, name):
+        entry = self._events.pop(name, None)
+        if entry is not None:
+            entry[3] = None
+
+    def next_cycle(self, default=None):
+        heap = self._heap
+        while heap and heap[0][3] is None:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else default
+
+    def run_due(self, now):
+        # 执行所有到期 (周期 <= now) 的事件, 事件里新安排的到期事件也在这里执行
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            cycle, _, name, callback = heapq.heappop(heap)
+            if callback is None:
+                continue
+            del self._events[name]
+            callback(cycle)
+
+    def __contains__(self, name):
+        return name in self._events
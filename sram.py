@@ -0,0 +1,81 @@
+# 电池供电的 SRAM: $6000-$7FFF 直接映射到 ROM 旁边的 .sav 文件
+import atexit
+import mmap
+import os
+import threading
+
+
+class SaveRam:
+    '''
+    SRAM, 是 .sav 文件的一块共享 mmap, 大小按 ROM 文件头里的 PRG-NVRAM, 没有写时是 8K
+    比 $6000-$7FFF 小的 SRAM 在这 8K 里重复出现
+    读直接从页表里的 memoryview 读; 写经过 write, 除了写进映射, 只在每页 (256 字节) 的脏标记上记一下
+    写进映射的数据已经在操作系统的页缓存里了, 后台线程每隔 interval 秒把脏页所在的范围 msync 到磁盘
+    模拟器线程从不等待磁盘, 关闭 (或者进程退出) 时再同步一次
+    '''
+    SIZE = 0x2000
+    BASE = 0x6000
+
+    def __init__(self, path, size=SIZE, interval=1.0):
+        self.path = path
+        self.interval = interval
+        with open(path, 'a+b') as f:
+            # 已有的存档比需要的大时 (别的模拟器写的, 或者文件头改过) 整个保留, 只会加长, 不会截掉存档
+            # 小于一页的 SRAM 也按一页映射, 页表里每一项都是完整的 256 字节
+            existing = os.fstat(f.fileno()).st_size
+            self.size = max(size, 0x100, existing)
+            if existing < self.size:
+                f.truncate(self.size)
+            self._mmap = mmap.mmap(f.fileno(), self.size)
+        self.view = memoryview(self._mmap)
+        self._dirty = bytearray((self.size + 0xFF) >> 8)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._work, name='sram-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def page(self, page):
+        # CPU 的第 page 页 ($60-$7F) 对应的 256 字节
+        offset = ((page << 8) - self.BASE) % self.size
+        return self.view[offset:offset + 0x100]
+
+    def write(self, address, data):
+        offset = (address - self.BASE) % self.size
+        self.view[offset] = data
+        self._dirty[offset >> 8] = 1
+
+    @property
+    def dirty(self):
+        return any(self._dirty)
+
+    def flush(self):
+        '''
+        把脏页同步到磁盘
+        先清标记再同步: 同步期间又被写的页会重新标记, 下一轮再同步, 不需要加锁
+        msync 的起点要按系统页对齐, 所以按系统页合并
+        '''
+        step = mmap.PAGESIZE >> 8
+        dirty = self._dirty
+        for first in range(0, len(dirty), step):
+            if any(dirty[first:first + step]):
+                dirty[first:first + step] = bytes(len(dirty[first:first + step]))
+                offset = first << 8
+                self._mmap.flush(offset, min(mmap.PAGESIZE, self.size - offset))
+
+    def _work(self):
+        while not self._closed.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join()
+        atexit.unregister(self.close)
+        self.flush()
+        self.view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # 外面还拿着这块映射的切片 (没有调用 FC.close 就退出时, 页表里还是它), 数据已经同步过了, 留给垃圾回收
+            pass
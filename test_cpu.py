@@ -1,4 +1,5 @@
 from my_fc.cpu import Cpu
+from my_fc.fc import FC
 
 
 def test_split_bit():
@@ -9,5 +10,168 @@ def test_split_bit():
     assert v == origin_v, 'test_split_bit fail'
 
 
+def test_registers_per_instance():
+    fc1, fc2 = FC(), FC()
+    fc1.cpu._registers.A = 0x12
+    fc1.cpu._registers.S = 0x80
+    fc1.ppu._registers.write_PPUADDR(0x21)
+    assert fc2.cpu._registers.A == 0, 'test_registers_per_instance fail'
+    assert fc2.cpu._registers.S == 0xFD, 'test_registers_per_instance fail'
+    assert fc2.ppu._registers.PPUADDR == 0, 'test_registers_per_instance fail'
+
+
+def test_ram_and_register_mirrors():
+    fc = FC()
+    cpu = fc.cpu
+    cpu.write_address(0x1805, 0x09)
+    assert cpu.read_address(0x0005) == 0x09, 'test_ram_and_register_mirrors fail'
+    cpu.write_address(0x3FFE, 0x21)  # $2006 的镜像
+    cpu.write_address(0x200E, 0x08)
+    assert fc.ppu._registers.PPUADDR == 0x2108, 'test_ram_and_register_mirrors fail'
+
+
+def test_bank_windows():
+    # PRG CHR 都是直接指向 ROM 数据的窗口, 切换 bank 不复制数据
+    fc = FC()
+    fc.load_rom()
+    cpu, ppu, rom = fc.cpu, fc.ppu, fc.rom
+    assert cpu.read_address(0xC004) == rom.data_prgrom[0x0004], 'test_bank_windows fail'
+    cpu.write_address(0xC004, 0xFF)
+    assert cpu.read_address(0xC004) == rom.data_prgrom[0x0004], 'test_bank_windows fail'
+    fc.mapper.load_prgrom_8k(0, 1)
+    assert cpu.read_address(0x8010) == rom.data_prgrom[0x2010], 'test_bank_windows fail'
+    assert cpu.prg_banks == [1, 1, 0, 1], 'test_bank_windows fail'
+
+    tiles = ppu.tiles[256:320].copy()
+    fc.mapper.load_chrrom_1k(0, 4)
+    assert ppu.chr_pages[0].obj is ppu.chr_pages[4].obj, 'test_bank_windows fail'
+    assert (ppu.tiles[0:64] == tiles).all(), 'test_bank_windows fail'
+    # CHR-ROM 不能通过 $2007 写入
+    ppu.write_address_from_cpu(0x2006, 0x00)
+    ppu.write_address_from_cpu(0x2006, 0x00)
+    ppu.write_address_from_cpu(0x2007, 0xFF)
+    assert (ppu.tiles[0:64] == tiles).all(), 'test_bank_windows fail'
+
+
+def test_ram_code_written_through_mirror():
+    # $0300: LDA $0010 / JMP $0300, 经过镜像 $0B01 把操作数改成 $20, 缓存的指令和翻译好的块都要丢掉
+    for translate in (False, True):
+        fc = FC()
+        cpu = fc.cpu
+        cpu.translate = translate
+        cpu._memory[0x0300:0x0306] = bytes([0xAD, 0x10, 0x00, 0x4C, 0x00, 0x03])
+        cpu._memory[0x10], cpu._memory[0x20] = 0x10, 0x20
+        cpu._registers.PC = 0x0300
+        cpu.run_cycles(10)
+        assert cpu._registers.A == 0x10, 'test_ram_code_written_through_mirror fail'
+        cpu.write_address(0x0B01, 0x20)
+        cpu._registers.PC = 0x0300
+        cpu.run_cycles(10)
+        assert cpu._registers.A == 0x20, 'test_ram_code_written_through_mirror fail'
+
+
+def test_self_modifying_block():
+    # $0300: LDA #$E8 / STA $0305 / NOP / JMP *, 块把自己后面的 NOP 改成 INX, 要执行改过的指令
+    result = {}
+    for translate in (False, True):
+        fc = FC()
+        cpu = fc.cpu
+        cpu.translate = translate
+        cpu._memory[0x0300:0x0309] = bytes([0xA9, 0xE8, 0x8D, 0x05, 0x03, 0xEA, 0x4C, 0x06, 0x03])
+        cpu._registers.PC = 0x0300
+        cpu.run_cycles(20)
+        result[translate] = (cpu._registers.X, cpu._registers.PC, cpu.cycles)
+    assert result[False] == result[True], 'test_self_modifying_block fail'
+    assert result[True][:2] == (1, 0x0306), 'test_self_modifying_block fail'
+
+
+def test_io_access_cycles(tmp_path):
+    # NOP x 6 / LDA $2002 / INX / LDA $1FFF,X / JMP *: 读 PPU 寄存器时 PPU 要追到这条指令的时间
+    # 翻译执行时块内的周期数也要在读写之前记上, 和解释执行一样
+    synced = {}
+    for translate in (False, True):
+        fc = FC()
+        cpu = fc.cpu
+        cpu.translate = translate
+        cpu._memory[0x8000:0x8010] = bytes([0xEA] * 6 + [0xAD, 0x02, 0x20, 0xE8, 0xBD, 0xFF, 0x1F, 0x4C, 0x0D, 0x80])
+        cpu._registers.PC = 0x8000
+        cycles = synced[translate] = []
+        sync_ppu = cpu.bus.sync_ppu
+        cpu.bus.sync_ppu = lambda: cycles.append(cpu.cycles) or sync_ppu()
+        cpu.run_cycles(40)
+    # 6 * 2 + 4 = 16; 16 + 2 + 4 + 1 (跨页) = 23
+    assert synced[False] == synced[True] == [16, 23], 'test_io_access_cycles fail'
+
+    # MMC3: NOP x 6 / LDA #$02 / STA $8000 / STA $8001 / JMP *, 切换 CHR bank 时 PPU 也要追到写入的时间
+    code = bytes([0xEA] * 6 + [0xA9, 0x02, 0x8D, 0x00, 0x80, 0x8D, 0x01, 0x80, 0x4C, 0x0E, 0xE0])
+    prg = bytearray(0x8000)
+    prg[0x6000:0x6000 + len(code)] = code
+    (tmp_path / 'mmc3.nes').write_bytes(b'NES\x1a' + bytes([0x02, 0x01, 0x40, 0x00]) + bytes(8) + prg + bytes(0x2000))
+    for translate in (False, True):
+        fc = FC()
+        fc.load_rom(str(tmp_path / 'mmc3.nes'))
+        cpu = fc.cpu
+        cpu.translate = translate
+        cpu._registers.PC = 0xE000
+        cycles = synced[translate] = []
+        sync_ppu = cpu.bus.sync_ppu
+        cpu.bus.sync_ppu = lambda: cycles.append(cpu.cycles) or sync_ppu()
+        start = cpu.cycles
+        cpu.run_cycles(40)
+        cycles[:] = [cycle - start for cycle in cycles]
+    # 选择寄存器时 bank 没变, 写 R2 时才切换: 6 * 2 + 2 + 4 + 4 = 22
+    assert synced[False] == synced[True] == [22], 'test_io_access_cycles fail'
+
+
+def test_idle_loop_fast_forward():
+    # LDA $00 / BEQ 轮询一个不会变的内存, 应该快进到时间片结束, 而不是真的执行上万条指令
+    for translate in (False, True):
+        fc = FC()
+        cpu = fc.cpu
+        cpu.translate = translate
+        cpu._memory[0x8000:0x8004] = bytes([0xA5, 0x00, 0xF0, 0xFC])
+        cpu._registers.PC = 0x8000
+        spent = cpu.run_cycles(29781)
+        assert 29781 <= spent < 29781 + 7, 'test_idle_loop_fast_forward fail'
+        # 每个 PPU 事件 (vblank 开始和结束, 帧结束) 都会打断时间片, 之后要再执行几轮才重新快进
+        assert cpu._count < 30, 'test_idle_loop_fast_forward fail'
+
+
+def test_nmi_and_brk():
+    # 主程序: CLI / BRK / 填充字节 / JMP *; NMI 处理程序: INX / RTI; IRQ/BRK 处理程序: INY / RTI
+    fc = FC()
+    cpu = fc.cpu
+    memory = cpu._memory
+    memory[0x8000:0x8007] = bytes([0x58, 0x00, 0xEA, 0x4C, 0x03, 0x80, 0x00])
+    memory[0x9000:0x9002] = bytes([0xE8, 0x40])
+    memory[0x9100:0x9102] = bytes([0xC8, 0x40])
+    memory[0xFFFA:0xFFFC] = bytes([0x00, 0x90])
+    memory[0xFFFE:0x10000] = bytes([0x00, 0x91])
+    fc.ppu._registers.PPUSTATUS = 0
+    fc.ppu.write_address_from_cpu(0x2000, 0x80)
+    cpu._registers.PC = 0x8000
+    cpu._registers.interrupt_disable = 1
+    for _ in range(3):
+        fc.run_frame()
+    registers = cpu._registers
+    assert registers.Y == 1 and registers.PC == 0x8003, 'test_nmi_and_brk fail'
+    assert registers.X == 3, 'test_nmi_and_brk fail'
+
+    # IRQ 是电平触发的, 设备拉着 IRQ 线时每次 RTI 之后都会再进入, 释放后回到主程序
+    registers.interrupt_disable = 1
+    cpu.set_irq('test', True)
+    cpu.run_cycles(100)
+    assert registers.Y == 1, 'test_nmi_and_brk fail'
+    registers.interrupt_disable = 0
+    cpu.poll_irq()
+    cpu.run_cycles(100)
+    assert registers.Y > 2, 'test_nmi_and_brk fail'
+    cpu.set_irq('test', False)
+    cpu.run_cycles(100)  # 可能还在处理程序里, 先让它返回
+    y = registers.Y
+    cpu.run_cycles(100)
+    assert registers.Y == y and 0x8003 <= registers.PC <= 0x8005, 'test_nmi_and_brk fail'
+
+
 if __name__ == '__main__':
     test_split_bit()
@@ -0,0 +1,48 @@
+import zlib
+
+import numpy as np
+
+from my_fc.fc import FC
+from my_fc.ppu import PALETTE
+
+
+def test_frame_views_share_one_buffer():
+    fc = FC()
+    frame = fc.frame
+    assert fc.ppu.framebuffer is frame.indexed, 'test_frame_views_share_one_buffer fail'
+    rgba, rgb24 = frame.rgba, frame.rgb24
+    # 三种格式在同一块内存里依次排列
+    address = frame.indexed.__array_interface__['data'][0]
+    assert rgb24.__array_interface__['data'][0] - address == 240 * 256, 'test_frame_views_share_one_buffer fail'
+    assert rgba.__array_interface__['data'][0] - address == 240 * 256 * 4, 'test_frame_views_share_one_buffer fail'
+    assert memoryview(rgba).nbytes == 240 * 256 * 4, 'test_frame_views_share_one_buffer fail'
+
+    fc.ppu.memory[0x3F00] = 0x21
+    fc.ppu.invalidate_render_cache()
+    fc.ppu.execute()
+    assert frame.rgba is rgba, 'test_frame_views_share_one_buffer fail'
+    assert (frame.rgba == PALETTE[0x21]).all(), 'test_frame_views_share_one_buffer fail'
+    assert (frame.rgb24 == PALETTE[0x21, :3]).all(), 'test_frame_views_share_one_buffer fail'
+
+
+def test_dump_frames(tmp_path):
+    fc = FC()
+    fc.cpu._memory[0x8000:0x8003] = bytes([0x4C, 0x00, 0x80])  # JMP $8000
+    fc.cpu._registers.PC = 0x8000
+    fc.start_dump(str(tmp_path / 'png'), every=2, fmt='png')
+    for _ in range(4):
+        fc.run_frame()
+    fc.start_dump(str(tmp_path / 'ppm'), every=1, fmt='ppm')
+    fc.run_frame()
+    fc.stop_dump()
+
+    assert sorted(p.name for p in (tmp_path / 'png').iterdir()) == ['frame_000002.png', 'frame_000004.png']
+    data = (tmp_path / 'png' / 'frame_000002.png').read_bytes()
+    assert data.startswith(b'\x89PNG\r\n\x1a\n'), 'test_dump_frames fail'
+    idat = data.index(b'IDAT')
+    length = int.from_bytes(data[idat - 4:idat], 'big')
+    rows = np.frombuffer(zlib.decompress(data[idat + 4:idat + 4 + length]), dtype=np.uint8).reshape(240, -1)
+    assert (rows[:, 1:].reshape(240, 256, 3) == fc.frame.rgb24).all(), 'test_dump_frames fail'
+
+    data = (tmp_path / 'ppm' / 'frame_000005.ppm').read_bytes()
+    assert data.startswith(b'P6\n256 240\n255\n') and len(data) == 15 + 240 * 256 * 3, 'test_dump_frames fail'
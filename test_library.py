@@ -0,0 +1,45 @@
+import hashlib
+import os
+import shutil
+import zlib
+
+from my_fc.library import RomLibrary
+
+
+def test_rom_library(tmp_path):
+    roms = tmp_path / 'roms'
+    (roms / 'sub').mkdir(parents=True)
+    shutil.copy('nestest.nes', str(roms / 'nestest.nes'))
+    mmc3 = b'NES\x1a' + bytes([0x02, 0x01, 0x41, 0x00]) + bytes(8) + bytes(0x8000) + bytes(0x2000)
+    (roms / 'sub' / 'mmc3.NES').write_bytes(mmc3)
+    (roms / 'broken.nes').write_bytes(b'not a rom')
+    (roms / 'readme.txt').write_bytes(b'ignored')
+
+    index = str(tmp_path / 'index.db')
+    with RomLibrary(index) as library:
+        assert library.scan(str(roms), workers=2) == {'scanned': 3, 'removed': 0, 'unchanged': 0}, \
+            'test_rom_library fail'
+        assert len(library) == 2 and len(library.errors()) == 1, 'test_rom_library fail'
+        found = library.by_mapper(4)
+        assert [os.path.basename(rom['path']) for rom in found] == ['mmc3.NES'], 'test_rom_library fail'
+        assert found[0]['vmirroring'] == 1 and found[0]['prg_size'] == 0x8000, 'test_rom_library fail'
+
+    with open('nestest.nes', 'rb') as f:
+        data = f.read()
+    prg_sha1 = hashlib.sha1(data[16:16 + 0x4000]).hexdigest()
+    crc32 = zlib.crc32(data[16:])
+
+    # 重新打开索引, 没变的文件不再解析
+    with RomLibrary(index) as library:
+        assert library.scan(str(roms), workers=0) == {'scanned': 0, 'removed': 0, 'unchanged': 3}, \
+            'test_rom_library fail'
+        assert library.find_by_hash(prg_sha1.upper())[0]['path'].endswith('nestest.nes'), 'test_rom_library fail'
+        assert library.find_by_hash('{:08x}'.format(crc32))[0]['mapper'] == 0, 'test_rom_library fail'
+
+        os.remove(str(roms / 'broken.nes'))
+        (roms / 'sub' / 'mmc3.NES').write_bytes(mmc3[:6] + b'\x11' + mmc3[7:])
+        os.utime(str(roms / 'sub' / 'mmc3.NES'), ns=(0, 0))  # 大小没变, 靠修改时间发现变化
+        assert library.scan(str(roms), workers=0) == {'scanned': 1, 'removed': 1, 'unchanged': 1}, \
+            'test_rom_library fail'
+        assert not library.by_mapper(4) and len(library.by_mapper(1)) == 1, 'test_rom_library fail'
+        assert library.errors() == [], 'test_rom_library fail'
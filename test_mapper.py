@@ -0,0 +1,167 @@
+import pytest
+
+from my_fc.fc import FC
+from my_fc.mapper import MAPPERS, load_mapper
+from my_fc.ppu import Mirroring
+
+
+def make_rom(path, mapper, count_prgrom16kb, count_chrrom_8kb, code=None):
+    '''
+    生成一个测试用的 ROM 文件: PRG 的每个 8K bank 填满自己的编号, CHR 的每个 1K bank 也一样
+    code 是 {CPU 地址: 机器码}, 放在最后一个 16K bank ($C000-$FFFF) 里
+    '''
+    header = b'NES\x1a' + bytes([count_prgrom16kb, count_chrrom_8kb, (mapper & 0x0F) << 4, mapper & 0xF0]) + bytes(8)
+    prg = bytearray(b''.join(bytes([bank]) * 0x2000 for bank in range(count_prgrom16kb * 2)))
+    for address, data in (code or {}).items():
+        offset = len(prg) - 0x10000 + address
+        prg[offset:offset + len(data)] = data
+    chr_ = b''.join(bytes([bank]) * 0x400 for bank in range(count_chrrom_8kb * 8))
+    path.write_bytes(header + prg + chr_)
+    fc = FC()
+    fc.load_rom(str(path))
+    return fc
+
+
+def test_mapper_registry():
+    assert sorted(MAPPERS) == [0, 1, 2, 3, 4], 'test_mapper_registry fail'
+    assert all(MAPPERS[_id]._id == _id for _id in MAPPERS), 'test_mapper_registry fail'
+    with pytest.raises(ValueError):
+        load_mapper(FC(), 99)
+
+
+def test_mmc1(tmp_path):
+    fc = make_rom(tmp_path / 'mmc1.nes', 1, 16, 16)
+    cpu, ppu = fc.cpu, fc.ppu
+
+    def write(address, value):
+        # 串行写入, 低位在先
+        for i in range(5):
+            cpu.write_address(address, (value >> i) & 1)
+
+    # 上电时 $C000 固定为最后一个 16K bank
+    assert cpu.read_address(0xC000) == 30 and cpu.read_address(0xE000) == 31, 'test_mmc1 fail'
+    write(0xE000, 3)
+    assert cpu.read_address(0x8000) == 6 and cpu.read_address(0xA000) == 7, 'test_mmc1 fail'
+    # 竖直镜像, $8000 固定为第一个 bank, CHR 按 4K 切换
+    write(0x8000, 0x10 | 0x08 | 0x02)
+    write(0xC000, 5)
+    assert ppu.mirroring == Mirroring.VERTICAL, 'test_mmc1 fail'
+    assert cpu.read_address(0x8000) == 0 and cpu.read_address(0xC000) == 6, 'test_mmc1 fail'
+    assert ppu.chr_pages[4][0] == 20 and ppu.chr_pages[7][0] == 23, 'test_mmc1 fail'
+    # 第 7 位清空移位寄存器, 写到一半的值作废
+    cpu.write_address(0xE000, 1)
+    cpu.write_address(0xE000, 0x80)
+    write(0xE000, 2)
+    assert cpu.read_address(0x8000) == 4, 'test_mmc1 fail'
+
+
+def test_uxrom_and_cnrom(tmp_path):
+    fc = make_rom(tmp_path / 'uxrom.nes', 2, 8, 0)
+    cpu = fc.cpu
+    cpu.write_address(0x8000, 2)
+    assert cpu.read_address(0x8000) == 4 and cpu.read_address(0xA000) == 5, 'test_uxrom_and_cnrom fail'
+    assert cpu.read_address(0xC000) == 14, 'test_uxrom_and_cnrom fail'
+
+    fc = make_rom(tmp_path / 'cnrom.nes', 3, 2, 4)
+    fc.cpu.write_address(0x8000, 3)
+    assert fc.ppu.chr_pages[0][0] == 24 and fc.ppu.chr_pages[7][0] == 31, 'test_uxrom_and_cnrom fail'
+
+
+def test_mmc3_banks(tmp_path):
+    fc = make_rom(tmp_path / 'mmc3.nes', 4, 8, 4)
+    cpu, ppu = fc.cpu, fc.ppu
+    cpu.write_address(0x8000, 6)
+    cpu.write_address(0x8001, 5)
+    assert cpu.read_address(0x8000) == 5 and cpu.read_address(0xC000) == 14, 'test_mmc3_banks fail'
+    cpu.write_address(0x8000, 0x40)
+    assert cpu.read_address(0x8000) == 14 and cpu.read_address(0xC000) == 5, 'test_mmc3_banks fail'
+    # R0 是 2K bank, 第 7 位把它移到 $1000
+    cpu.write_address(0x8000, 0x80)
+    cpu.write_address(0x8001, 9)
+    assert ppu.chr_pages[4][0] == 8 and ppu.chr_pages[5][0] == 9, 'test_mmc3_banks fail'
+    cpu.write_address(0xA000, 1)
+    assert ppu.mirroring == Mirroring.HORIZONTAL, 'test_mmc3_banks fail'
+
+
+def test_mmc3_scanline_irq(tmp_path):
+    # 主程序: CLI / JMP *; IRQ 处理程序: INY / STA $E000 / STA $E001 / RTI
+    code = {
+        0xE000: bytes([0x58, 0x4C, 0x01, 0xE0]),
+        0xE100: bytes([0xC8, 0x8D, 0x00, 0xE0, 0x8D, 0x01, 0xE0, 0x40]),
+        0xE200: bytes([0x40]),
+        0xFFFA: bytes([0x00, 0xE2, 0x00, 0xE0, 0x00, 0xE1]),
+    }
+    fc = make_rom(tmp_path / 'mmc3.nes', 4, 8, 4, code)
+    cpu, mapper = fc.cpu, fc.mapper
+    fc.ppu.write_address_from_cpu(0x2001, 0x18)
+    cpu.reset()
+    cpu._registers.interrupt_disable = 1
+    cpu.write_address(0xC000, 10)
+    cpu.write_address(0xC001, 0)
+    cpu.write_address(0xE001, 0)
+
+    # 第 1 次驱动重载成 10, 再数 10 次减到 0: 第 10 条扫描线的第 260 个点, 也就是第 1224 个周期
+    cpu._registers.PC = 0xE001
+    cpu.run_cycles(1220 - cpu.cycles)
+    assert mapper not in cpu._irq_sources, 'test_mmc3_scanline_irq fail'
+    cpu.run_cycles(10)
+    assert mapper in cpu._irq_sources, 'test_mmc3_scanline_irq fail'
+    cpu.write_address(0xE000, 0)
+    assert mapper not in cpu._irq_sources, 'test_mmc3_scanline_irq fail'
+
+    # 处理程序每次确认后重新打开, 一帧 241 次驱动里每 11 次触发一次
+    fc = make_rom(tmp_path / 'mmc3.nes', 4, 8, 4, code)
+    cpu = fc.cpu
+    fc.ppu.write_address_from_cpu(0x2001, 0x18)
+    cpu.reset()
+    cpu.write_address(0xC000, 10)
+    cpu.write_address(0xC001, 0)
+    cpu.write_address(0xE001, 0)
+    fc.run_frame()
+    assert cpu._registers.Y == 21, 'test_mmc3_scanline_irq fail'
+
+
+def test_reload_rom(tmp_path):
+    # 两张卡带在同一个地址放着不同的代码, 换卡带之后不能再执行上一张的缓存
+    for translate in (False, True):
+        fc = make_rom(tmp_path / 'a.nes', 0, 1, 1, {0xC000: bytes([0xAD, 0x11, 0x00, 0x4C, 0x00, 0xC0])})
+        make_rom(tmp_path / 'b.nes', 0, 1, 1, {0xC000: bytes([0xAD, 0x22, 0x00, 0x4C, 0x00, 0xC0])})
+        cpu = fc.cpu
+        cpu.translate = translate
+        cpu._memory[0x11], cpu._memory[0x22] = 0x11, 0x22
+        cpu._registers.PC = 0xC000
+        cpu.run_cycles(20)
+        assert cpu._registers.A == 0x11, 'test_reload_rom fail'
+        fc.load_rom(str(tmp_path / 'b.nes'))
+        cpu._registers.PC = 0xC000
+        cpu.run_cycles(20)
+        assert cpu._registers.A == 0x22, 'test_reload_rom fail'
+
+
+def test_reload_chrram_rom(tmp_path):
+    # 先插有 CHR-ROM 的卡带, 再换成 CHR-RAM 的, 图样表要重新可写
+    fc = make_rom(tmp_path / 'nrom.nes', 0, 1, 1)
+    make_rom(tmp_path / 'uxrom.nes', 2, 2, 0)
+    fc.load_rom(str(tmp_path / 'uxrom.nes'))
+    ppu = fc.ppu
+    assert not any(page.readonly for page in ppu.chr_pages), 'test_reload_chrram_rom fail'
+    ppu.write_address_from_cpu(0x2006, 0x00)
+    ppu.write_address_from_cpu(0x2006, 0x00)
+    ppu.write_address_from_cpu(0x2007, 0xFF)
+    assert ppu.chr_pages[0][0] == 0xFF and (ppu.tiles[0, 0] == 1).all(), 'test_reload_chrram_rom fail'
+
+
+def test_switch_own_bank(tmp_path):
+    # UxROM, $8000 的 bank 0: LDA #1 / STA $8000 / INX / JMP $8005, 把自己所在的 bank 换成 bank 1
+    # bank 1 的同一个位置 ($C005): INY / JMP $C005, 切换之后要从 bank 1 接着执行, 不能再执行 bank 0 的 INX
+    code = {
+        0x8000: bytes([0xA9, 0x01, 0x8D, 0x00, 0x80, 0xE8, 0x4C, 0x05, 0x80]),
+        0xC005: bytes([0xC8, 0x4C, 0x05, 0xC0]),
+    }
+    for translate in (False, True):
+        fc = make_rom(tmp_path / 'uxrom.nes', 2, 2, 0, code)
+        cpu = fc.cpu
+        cpu.translate = translate
+        cpu._registers.PC = 0x8000
+        cpu.run_cycles(40)
+        assert cpu._registers.X == 0 and cpu._registers.Y > 0, 'test_switch_own_bank fail'
@@ -0,0 +1,77 @@
+from my_fc.fc import FC
+from my_fc import logdiffer
+
+
+def nestest_fc():
+    # nestest 的 automation 模式: 从 $C000 开始运行, 和 nestest.log 逐行对比
+    fc = FC()
+    fc.load_rom()
+    registers = fc.cpu._registers
+    registers.PC = 0xC000
+    registers.A, registers.X, registers.Y = 0, 0, 0
+    registers.S = 0xFD
+    registers.P = 0x24
+    return fc
+
+
+def test_interpreter_trace():
+    fc = nestest_fc()
+    cpu = fc.cpu
+    differ = logdiffer.LogDiffer.from_json('nestest_log.json')
+    try:
+        while True:
+            differ.diff(cpu.trace_info())
+            cpu.execute()
+    except logdiffer.AllTestsPassed:
+        pass
+
+
+def nestest_ppu_dots(log_path='nestest.log'):
+    # nestest.log 的 CYC 是当前扫描线上的 PPU 点, SL 是扫描线 (-1 是预渲染线)
+    # 换算成一帧内的 PPU 点的位置, 一个 CPU 周期等于 3 个 PPU 点
+    dots = []
+    with open(log_path) as f:
+        for line in f:
+            cyc = int(line[line.index('CYC:') + 4:line.index('SL:')])
+            sl = int(line[line.index('SL:') + 3:])
+            dots.append((sl % 262) * 341 + cyc)
+    return dots
+
+
+def test_interpreter_cycles():
+    fc = nestest_fc()
+    cpu = fc.cpu
+    dots = nestest_ppu_dots()
+    start = dots[0]
+    for line, expected in enumerate(dots, 1):
+        result = (start + cpu.cycles * 3) % (262 * 341)
+        assert result == expected, 'line {}: expect {}, result {}'.format(line, expected, result)
+        cpu.execute()
+
+
+def run_translator_trace(max_block_size):
+    # 块内的指令不会停下来, 所以只在每个块开始的地方对比, 块内执行过的行直接跳过
+    fc = nestest_fc()
+    cpu = fc.cpu
+    cpu._translator.max_block_size = max_block_size
+    differ = logdiffer.LogDiffer.from_json('nestest_log.json')
+    dots = nestest_ppu_dots()
+    try:
+        while True:
+            line = differ.cursor
+            if line < len(dots):
+                assert (dots[0] + cpu.cycles * 3) % (262 * 341) == dots[line], 'line {}: cycles'.format(line + 1)
+            differ.diff(cpu.trace_info())
+            count = cpu.execute_block()
+            for _ in range(count - 1):
+                differ.pop_log()
+    except logdiffer.AllTestsPassed:
+        pass
+
+
+def test_translator_trace():
+    run_translator_trace(64)
+
+
+def test_translator_single_instruction_trace():
+    run_translator_trace(1)
@@ -0,0 +1,235 @@
+from my_fc.fc import FC
+from my_fc.ppu import PALETTE, Mirroring
+
+
+def reset_scroll(ppu):
+    # 写 $2006 会改掉 t, 和游戏里一样, 写完显存后重新设置滚动位置
+    ppu.write_address_from_cpu(0x2000, 0x00)
+    ppu.write_address_from_cpu(0x2005, 0x00)
+    ppu.write_address_from_cpu(0x2005, 0x00)
+
+
+def solid_tile_fc():
+    # 图块 1 的每个像素都是 3, 放在名称表 0 的左上角, 用 2 号背景调色板
+    fc = FC()
+    ppu = fc.ppu
+    ppu.write_address_from_cpu(0x2006, 0x00)
+    ppu.write_address_from_cpu(0x2006, 0x10)
+    for _ in range(16):
+        ppu.write_address_from_cpu(0x2007, 0xFF)
+    ppu.memory[0x2000] = 1
+    ppu.memory[0x23C0] = 0b10
+    ppu.write_address_from_cpu(0x2001, 0x0A)
+    reset_scroll(ppu)
+    return fc
+
+
+def test_decode_tiles():
+    fc = FC()
+    fc.load_rom()
+    ppu = fc.ppu
+    chrrom = fc.rom.data_chrrom
+    for tile in (0, 0x41, 0x1FF):
+        for y in range(8):
+            low, high = chrrom[tile * 16 + y], chrrom[tile * 16 + y + 8]
+            row = [((low >> (7 - x)) & 1) | (((high >> (7 - x)) & 1) << 1) for x in range(8)]
+            assert list(ppu.tiles[tile, y]) == row, 'test_decode_tiles fail'
+
+
+def test_render_background():
+    ppu = solid_tile_fc().ppu
+    ppu.execute()
+    frame = ppu.framebuffer
+    assert frame.shape == (240, 256), 'test_render_background fail'
+    assert (frame[:8, :8] == 0b1011).all(), 'test_render_background fail'
+    assert frame.sum() == 0b1011 * 64, 'test_render_background fail'
+
+
+def test_render_background_fine_scroll():
+    ppu = solid_tile_fc().ppu
+    # 名称表 1 的左上角也放一个, 滚动后出现在屏幕右边
+    ppu.memory[0x2400] = 1
+    ppu.memory[0x27C0] = 0b01
+    ppu.write_address_from_cpu(0x2005, 4)
+    ppu.write_address_from_cpu(0x2005, 2)
+    ppu.execute()
+    frame = ppu.framebuffer
+    assert (frame[:6, :4] == 0b1011).all(), 'test_render_background_fine_scroll fail'
+    assert (frame[:6, 252:] == 0b0111).all(), 'test_render_background_fine_scroll fail'
+    assert frame.sum() == (0b1011 + 0b0111) * 24, 'test_render_background_fine_scroll fail'
+
+
+def test_palette_conversion():
+    ppu = solid_tile_fc().ppu
+    ppu.write_address_from_cpu(0x2006, 0x3F)
+    ppu.write_address_from_cpu(0x2006, 0x00)
+    for color in (0x0F, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x21):
+        ppu.write_address_from_cpu(0x2007, color)
+    reset_scroll(ppu)
+    ppu.execute()
+    rgba = ppu.to_rgba()
+    assert rgba.shape == (240, 256, 4), 'test_palette_conversion fail'
+    assert tuple(rgba[0, 0]) == tuple(PALETTE[0x21]), 'test_palette_conversion fail'
+    assert tuple(ppu.to_rgb24()[8, 8]) == tuple(PALETTE[0x0F, :3]), 'test_palette_conversion fail'
+    assert ppu.to_uint32()[0, 0] == int.from_bytes(bytes(PALETTE[0x21]), 'little'), 'test_palette_conversion fail'
+
+    # $3F10 是 $3F00 的镜像
+    ppu.write_address_from_cpu(0x2006, 0x3F)
+    ppu.write_address_from_cpu(0x2006, 0x10)
+    ppu.write_address_from_cpu(0x2007, 0x30)
+    assert tuple(ppu.to_rgba()[8, 8]) == tuple(PALETTE[0x30]), 'test_palette_conversion fail'
+
+
+def test_oam_dma():
+    fc = FC()
+    cpu = fc.cpu
+    cpu._memory[0x0200:0x0300] = bytes(range(256))
+    fc.ppu.write_address_from_cpu(0x2003, 0x10)
+    before = cpu.cycles
+    cpu.write_address(0x4014, 0x02)
+    assert fc.ppu.oam[0x10:] == bytes(range(0xF0)), 'test_oam_dma fail'
+    assert fc.ppu.oam[:0x10] == bytes(range(0xF0, 0x100)), 'test_oam_dma fail'
+    assert cpu.cycles - before in (513, 514), 'test_oam_dma fail'
+
+
+def test_render_sprites():
+    fc = solid_tile_fc()
+    ppu = fc.ppu
+    ppu.write_address_from_cpu(0x2001, 0x1E)
+    # sprite 0 压在背景图块上, sprite 1 在背景后面, sprite 2 水平翻转
+    ppu.memory[0x0020:0x0028] = b'\x80' * 8
+    ppu.oam[0:4] = bytes([3, 1, 0x01, 4])
+    ppu.oam[4:8] = bytes([39, 1, 0x22, 0])
+    ppu.oam[8:12] = bytes([99, 2, 0x40, 100])
+    ppu.decode_tiles()
+    ppu.execute()
+    frame = ppu.framebuffer
+    assert frame[4, 4] == 0b10111, 'test_render_sprites fail'
+    assert frame[4, 11] == 0b10111, 'test_render_sprites fail'
+    assert frame[40, 0] == 0b11011, 'test_render_sprites fail'
+    assert frame[100, 107] == 0b10001 and frame[100, 100] == 0, 'test_render_sprites fail'
+    assert ppu._registers.PPUSTATUS & 0x40, 'test_render_sprites fail'
+
+
+def test_sprite_evaluation_limit():
+    ppu = FC().ppu
+    for i in range(10):
+        ppu.oam[i * 4:i * 4 + 4] = bytes([49, 0, 0, i * 8])
+    visible = ppu.evaluate_sprites()
+    assert visible[50].sum() == 8 and visible[50, :8].all(), 'test_sprite_evaluation_limit fail'
+    assert ppu._registers.PPUSTATUS & 0x20, 'test_sprite_evaluation_limit fail'
+
+
+def test_scroll_registers():
+    ppu = FC().ppu
+    registers = ppu._registers
+    ppu.write_address_from_cpu(0x2000, 0x03)
+    ppu.write_address_from_cpu(0x2005, 0x7D)
+    ppu.write_address_from_cpu(0x2005, 0x5E)
+    assert registers.t == 0b110110101101111 and registers.fine_x == 0b101, 'test_scroll_registers fail'
+    # 读 $2002 会清掉写入开关, 接下来的 $2006 写入重新从高字节开始
+    ppu.write_address_from_cpu(0x2006, 0x3D)
+    ppu.read_address_from_cpu(0x2002)
+    ppu.write_address_from_cpu(0x2006, 0x24)
+    ppu.write_address_from_cpu(0x2006, 0x00)
+    assert registers.v == 0x2400, 'test_scroll_registers fail'
+
+
+def test_ppudata_increment_32():
+    ppu = FC().ppu
+    ppu.write_address_from_cpu(0x2000, 0x04)
+    ppu.write_address_from_cpu(0x2006, 0x20)
+    ppu.write_address_from_cpu(0x2006, 0x05)
+    for value in (1, 2, 3):
+        ppu.write_address_from_cpu(0x2007, value)
+    assert ppu.memory[0x2005:0x2065:32] == bytes([1, 2, 3]), 'test_ppudata_increment_32 fail'
+    assert ppu._registers.PPUADDR == 0x2065, 'test_ppudata_increment_32 fail'
+
+
+def test_nametable_mirroring():
+    fc = FC()
+    fc.load_rom()
+    ppu = fc.ppu
+    assert ppu.mirroring == Mirroring.from_rom(fc.rom), 'test_nametable_mirroring fail'
+    for mirroring, same, different in (
+            (Mirroring.HORIZONTAL, 0x2400, 0x2800),
+            (Mirroring.VERTICAL, 0x2800, 0x2400),
+            (Mirroring.SINGLE_LOW, 0x2C00, None),
+    ):
+        fc.mapper.set_mirroring(mirroring)
+        ppu.memory[0x2000:0x3000] = bytes(0x1000)
+        ppu.write_address_from_cpu(0x2006, 0x20)
+        ppu.write_address_from_cpu(0x2006, 0x42)
+        ppu.write_address_from_cpu(0x2007, 0x5A)
+        assert ppu.memory[ppu.memory_mapper(same + 0x42)] == 0x5A, 'test_nametable_mirroring fail'
+        assert ppu.memory[ppu.memory_mapper(0x3042)] == 0x5A, 'test_nametable_mirroring fail'
+        if different is not None:
+            assert ppu.memory[ppu.memory_mapper(different + 0x42)] == 0, 'test_nametable_mirroring fail'
+    # $3F30 -> $3F10 -> $3F00
+    assert ppu.memory_mapper(0x3F30) == 0x3F00, 'test_nametable_mirroring fail'
+
+
+def test_incremental_background():
+    fc = solid_tile_fc()
+    ppu = fc.ppu
+    ppu.execute()
+    # 通过 $2007 改一个名称表字节和一个属性字节, 只有对应的图块会重画, 结果要和全部重画一样
+    for address, value in ((0x2021, 1), (0x23C0, 0b11)):
+        ppu.write_address_from_cpu(0x2006, address >> 8)
+        ppu.write_address_from_cpu(0x2006, address & 0xFF)
+        ppu.write_address_from_cpu(0x2007, value)
+    reset_scroll(ppu)
+    ppu.execute()
+    assert (ppu.framebuffer[:8, :8] == 0b1111).all(), 'test_incremental_background fail'
+    assert (ppu.framebuffer[8:16, 8:16] == 0b1111).all(), 'test_incremental_background fail'
+    frame = ppu.framebuffer.copy()
+    ppu.invalidate_render_cache()
+    ppu.execute()
+    assert (ppu.framebuffer == frame).all(), 'test_incremental_background fail'
+
+
+def test_run_frame_catch_up():
+    # 轮询 vblank, 每一帧 X 加 1: LDA $2002 / BPL / INX / JMP $8000
+    fc = FC()
+    cpu = fc.cpu
+    cpu._memory[0x8000:0x8009] = bytes([0xAD, 0x02, 0x20, 0x10, 0xFB, 0xE8, 0x4C, 0x00, 0x80])
+    fc.ppu._registers.PPUSTATUS = 0
+    cpu._registers.PC = 0x8000
+    for _ in range(3):
+        fc.run_frame()
+    assert cpu._registers.X == 3, 'test_run_frame_catch_up fail'
+    assert fc.ppu.frame_count == 3, 'test_run_frame_catch_up fail'
+    assert abs(cpu.cycles - 3 * fc.ppu.DOTS_PER_FRAME // 3) < 10, 'test_run_frame_catch_up fail'
+    # 空转循环被快进了, 实际执行的指令很少
+    assert cpu._count < 100, 'test_run_frame_catch_up fail'
+
+
+def test_sprite_zero_hit_polling():
+    # 先等 sprite 0 hit 被清掉, 再等它出现: BIT $2002 / BVS / BIT $2002 / BVC, 然后停在 BRK
+    fc = solid_tile_fc()
+    ppu = fc.ppu
+    ppu.write_address_from_cpu(0x2001, 0x1E)
+    ppu.oam[0:4] = bytes([99, 1, 0, 0])
+    ppu.memory[0x2000 + 13 * 32] = 1
+    ppu.invalidate_render_cache()
+    cpu = fc.cpu
+    cpu._memory[0x8000:0x800A] = bytes([0x2C, 0x02, 0x20, 0x70, 0xFB, 0x2C, 0x02, 0x20, 0x50, 0xFB])
+    cpu._registers.PC = 0x8000
+    cpu.stop_on_brk = True
+    fc.run_frame()
+    fc.run_frame()
+    line = (ppu.dot - ppu._frame_start) // ppu.DOTS_PER_LINE
+    assert cpu._registers.PC == 0x800B and line == 104, 'test_sprite_zero_hit_polling fail'
+
+
+def test_read_write_only_registers():
+    # 只写的寄存器读到的是总线上最后一个值, 不会读到显存, 也不会出错
+    fc = FC()
+    cpu, ppu = fc.cpu, fc.ppu
+    ppu.memory[0x2000] = 0x77
+    cpu.write_address(0x2000, 0x5A)
+    assert cpu.read_address(0x2000) == 0x5A and cpu.read_address(0x2006) == 0x5A, \
+        'test_read_write_only_registers fail'
+    status = cpu.read_address(0x2002)
+    assert cpu.read_address(0x2005) == status, 'test_read_write_only_registers fail'
+    assert cpu.read_address(0x4014) == 0x40, 'test_read_write_only_registers fail'
@@ -0,0 +1,58 @@
+import mmap
+
+from my_fc.fc import FC
+from my_fc.rom import ROM, NesHeader, Timing
+
+
+def test_rom_is_mapped_not_copied():
+    rom = ROM('nestest.nes')
+    with open('nestest.nes', 'rb') as f:
+        data = f.read()
+    assert isinstance(rom.data_prgrom.obj, mmap.mmap), 'test_rom_is_mapped_not_copied fail'
+    assert rom.data_prgrom.readonly and rom.data_chrrom.readonly, 'test_rom_is_mapped_not_copied fail'
+    assert rom.data_prgrom == data[16:16 + 0x4000], 'test_rom_is_mapped_not_copied fail'
+    assert rom.data_chrrom == data[16 + 0x4000:16 + 0x6000], 'test_rom_is_mapped_not_copied fail'
+    # 也可以直接传入数据
+    assert ROM(data).data_chrrom == rom.data_chrrom, 'test_rom_is_mapped_not_copied fail'
+
+
+def test_nes2_header():
+    # mapper 260 子类型 3, PRG 2 x 16K, CHR 用指数-乘数形式表示 2 ^ 13 * 3 = 24K, 8K PRG-NVRAM, PAL
+    header = NesHeader(b'NES\x1a' + bytes([0x02, 0x35, 0x42, 0x08, 0x31, 0xF0, 0x70, 0x07, 0x01, 0, 0, 0]))
+    assert header.nes2, 'test_nes2_header fail'
+    assert header.mapper_number == 0x104 and header.submapper == 3, 'test_nes2_header fail'
+    assert header.prgrom_size == 0x8000 and header.chrrom_size == 0x6000, 'test_nes2_header fail'
+    assert header.prgram_size == 0 and header.prgnvram_size == 0x2000, 'test_nes2_header fail'
+    assert header.chrram_size == 0x2000 and header.timing == Timing.PAL, 'test_nes2_header fail'
+
+    # iNES 1.0: 第 12-15 字节不是 0 时不信任 mapper 编号的高 4 位
+    header = NesHeader(b'NES\x1a' + bytes([0x01, 0x00, 0x12, 0x40]) + b'\x00\x00\x00\x00DiSk')
+    assert not header.nes2 and header.mapper_number == 1, 'test_nes2_header fail'
+    assert header.save_ram and header.prgnvram_size == 0x2000, 'test_nes2_header fail'
+    assert header.chrram_size == 0x2000, 'test_nes2_header fail'
+
+
+def test_trainer(tmp_path):
+    trainer = bytes(range(256)) * 2
+    prg = bytes([0xEA]) * 0x4000
+    path = tmp_path / 'trainer.nes'
+    path.write_bytes(b'NES\x1a' + bytes([0x01, 0x01, 0x04, 0x00]) + bytes(8) + trainer + prg + bytes(0x2000))
+    fc = FC()
+    fc.load_rom(str(path))
+    assert bytes(fc.cpu.read_address(0x7000 + i) for i in range(512)) == trainer, 'test_trainer fail'
+    assert fc.cpu.read_address(0x8000) == 0xEA and fc.cpu.read_address(0xC000) == 0xEA, 'test_trainer fail'
+
+
+def test_unload_closes_rom(tmp_path):
+    fc = FC()
+    fc.load_rom()
+    rom = fc.rom
+    fc.unload_rom()
+    assert rom._mmap is None and fc.rom is None, 'test_unload_closes_rom fail'
+    assert fc.cpu.read_address(0xC000) == 0, 'test_unload_closes_rom fail'
+    # 卸载之后还能载入别的卡带
+    fc.load_rom()
+    assert fc.cpu.read_address(0xC004) == fc.rom.data_prgrom[4], 'test_unload_closes_rom fail'
+    with ROM('nestest.nes') as rom:
+        assert len(rom.data_chrrom) == 0x2000, 'test_unload_closes_rom fail'
+    assert rom._mmap is None, 'test_unload_closes_rom fail'
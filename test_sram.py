@@ -0,0 +1,57 @@
+from my_fc.fc import FC
+
+
+def battery_rom(path, header=bytes([0x01, 0x01, 0x02, 0x00]) + bytes(8)):
+    # NROM, 有电池: 第 6 字节的第 1 位
+    path.write_bytes(b'NES\x1a' + header + bytes(0x4000) + bytes(0x2000))
+    fc = FC()
+    fc.load_rom(str(path))
+    return fc
+
+
+def test_save_ram(tmp_path):
+    fc = battery_rom(tmp_path / 'game.nes')
+    cpu, sram = fc.cpu, fc.sram
+    assert (tmp_path / 'game.sav').stat().st_size == 0x2000, 'test_save_ram fail'
+    assert not sram.dirty, 'test_save_ram fail'
+    cpu.write_address(0x6000, 0x12)
+    cpu.write_address(0x7FFF, 0x34)
+    assert cpu.read_address(0x6000) == 0x12 and sram.dirty, 'test_save_ram fail'
+    # 写进映射的数据在文件里马上就能看到, flush 只是同步到磁盘
+    data = (tmp_path / 'game.sav').read_bytes()
+    assert data[0] == 0x12 and data[0x1FFF] == 0x34, 'test_save_ram fail'
+    sram.flush()
+    assert not sram.dirty, 'test_save_ram fail'
+    cpu.write_address(0x6001, 0x56)
+    fc.close()
+    assert fc.sram is None and cpu.read_address(0x6001) == 0, 'test_save_ram fail'
+    assert sram._mmap.closed, 'test_save_ram fail'
+
+    # 重新载入时读回存档, 翻译执行的绝对寻址也从存档读
+    fc = battery_rom(tmp_path / 'game.nes')
+    cpu = fc.cpu
+    assert cpu.read_address(0x6001) == 0x56 and cpu.read_address(0x7FFF) == 0x34, 'test_save_ram fail'
+    cpu.translate = True
+    cpu._memory[0x0300:0x0306] = bytes([0xAD, 0x00, 0x60, 0x4C, 0x03, 0x03])  # LDA $6000 / JMP *
+    cpu._registers.PC = 0x0300
+    cpu.run_cycles(20)
+    assert cpu._registers.A == 0x12, 'test_save_ram fail'
+    fc.close()
+
+
+def test_save_ram_size(tmp_path):
+    # 已有的存档比 8K 大时不能被截短
+    (tmp_path / 'big.sav').write_bytes(bytes([0x11]) + bytes(0x7FFE) + bytes([0x22]))
+    fc = battery_rom(tmp_path / 'big.nes')
+    assert fc.cpu.read_address(0x6000) == 0x11, 'test_save_ram_size fail'
+    fc.close()
+    data = (tmp_path / 'big.sav').read_bytes()
+    assert len(data) == 0x8000 and data[-1] == 0x22, 'test_save_ram_size fail'
+
+    # NES 2.0 文件头: 2K PRG-NVRAM (64 << 5), 在 $6000-$7FFF 里重复出现
+    fc = battery_rom(tmp_path / 'small.nes', bytes([0x01, 0x01, 0x02, 0x08, 0x00, 0x00, 0x50]) + bytes(5))
+    cpu = fc.cpu
+    assert (tmp_path / 'small.sav').stat().st_size == 0x800, 'test_save_ram_size fail'
+    cpu.write_address(0x6801, 0x33)
+    assert cpu.read_address(0x6001) == 0x33 and cpu.read_address(0x7801) == 0x33, 'test_save_ram_size fail'
+    fc.close()
@@ -0,0 +1,630 @@
+# 基本块翻译执行引擎
+#
+# 从某个 PC 开始, 顺序解码指令直到遇到分支 / JMP / JSR / RTS / RTI / BRK, 这一段就是一个基本块
+# 把整个基本块翻译成一段 Python 源码, 用 compile() 编译成代码对象, 之后每次执行到这个 PC 就直接调用
+# 寄存器 A X Y S 和各个标志位在块内都是局部变量, 块结束时才写回 Registers
+# 标志位做了活跃分析: 只有后面的代码 (或者块结束后) 会读到的标志位才会真正计算
+# 翻译好的块以 (bank, PC) 为键缓存, 代码所在的页被写入时丢弃
+# 块内的写入改写了代码或者切换了 PRG bank 时, 块在这条指令之后提前结束, 后面的指令重新翻译
+# PRG-ROM 里的块不跨 8K 窗口, mapper 切换 bank 后只是按新的键找块, 旧 bank 的块换回来时还能接着用
+# BRK 和未实现的指令不翻译, 块在它们前面结束, 由解释器单独执行
+
+from my_fc import opcodes
+
+
+FLAGS = 'CZIDVN'
+FLAG_BITS = {
+    'C': 0,
+    'Z': 1,
+    'I': 2,
+    'D': 3,
+    'V': 6,
+    'N': 7,
+}
+
+# 每个助记符 => (读取的标志位, 写入的标志位)
+FLAG_USAGE = {
+    'ADC': ('C', 'CZNV'),
+    'AND': ('', 'ZN'),
+    'ASL': ('', 'CZN'),
+    'BCC': ('C', ''),
+    'BCS': ('C', ''),
+    'BEQ': ('Z', ''),
+    'BIT': ('', 'ZNV'),
+    'BMI': ('N', ''),
+    'BNE': ('Z', ''),
+    'BPL': ('N', ''),
+    'BVC': ('V', ''),
+    'BVS': ('V', ''),
+    'CLC': ('', 'C'),
+    'CLD': ('', 'D'),
+    'CLI': ('', 'I'),
+    'CLV': ('', 'V'),
+    'CMP': ('', 'CZN'),
+    'CPX': ('', 'CZN'),
+    'CPY': ('', 'CZN'),
+    'DCP': ('', 'CZN'),
+    'DEC': ('', 'ZN'),
+    'DEX': ('', 'ZN'),
+    'DEY': ('', 'ZN'),
+    'EOR': ('', 'ZN'),
+    'INC': ('', 'ZN'),
+    'INX': ('', 'ZN'),
+    'INY': ('', 'ZN'),
+    'ISB': ('C', 'CZNV'),
+    'JMP': ('', ''),
+    'JSR': ('', ''),
+    'LAX': ('', 'ZN'),
+    'LDA': ('', 'ZN'),
+    'LDX': ('', 'ZN'),
+    'LDY': ('', 'ZN'),
+    'LSR': ('', 'CZN'),
+    'NOP': ('', ''),
+    'ORA': ('', 'ZN'),
+    'PHA': ('', ''),
+    'PHP': (FLAGS, ''),
+    'PLA': ('', 'ZN'),
+    'PLP': ('', FLAGS),
+    'RLA': ('C', 'CZN'),
+    'ROL': ('C', 'CZN'),
+    'ROR': ('C', 'CZN'),
+    'RRA': ('C', 'CZNV'),
+    'RTI': ('', FLAGS),
+    'RTS': ('', ''),
+    'SAX': ('', ''),
+    'SBC': ('C', 'CZNV'),
+    'SEC': ('', 'C'),
+    'SED': ('', 'D'),
+    'SEI': ('', 'I'),
+    'SLO': ('', 'CZN'),
+    'SRE': ('', 'CZN'),
+    'STA': ('', ''),
+    'STX': ('', ''),
+    'STY': ('', ''),
+    'TAX': ('', 'ZN'),
+    'TAY': ('', 'ZN'),
+    'TSX': ('', 'ZN'),
+    'TXA': ('', 'ZN'),
+    'TXS': ('', ''),
+    'TYA': ('', 'ZN'),
+}
+
+BRANCHES = {
+    'BCC': 'not C',
+    'BCS': 'C',
+    'BEQ': 'Z',
+    'BNE': 'not Z',
+    'BMI': 'N',
+    'BPL': 'not N',
+    'BVC': 'not V',
+    'BVS': 'V',
+}
+
+TERMINATORS = set(BRANCHES) | {'JMP', 'JSR', 'RTS', 'RTI', 'BRK'}
+
+# 不读取操作数的指令
+STORES = {'STA', 'STX', 'STY', 'SAX', 'NOP', 'JMP'}
+
+# 写内存的指令 (移位指令是累加器寻址时不写内存)
+WRITES = {
+    'STA', 'STX', 'STY', 'SAX', 'INC', 'DEC', 'ASL', 'LSR', 'ROL', 'ROR',
+    'DCP', 'ISB', 'SLO', 'RLA', 'SRE', 'RRA',
+}
+
+
+class Instruction:
+    def __init__(self, pc, code, ins, mode, operand, length):
+        self.pc = pc
+        self.code = code
+        self.ins = ins
+        self.mode = mode
+        self.operand = operand
+        self.length = length
+
+
+def fallback(cpu, r, m, read, write):
+    # 无法翻译的指令 (未实现的指令) 交给解释器执行
+    cpu.execute()
+    return 1
+
+
+class Translator:
+    def __init__(self, cpu, max_block_size=64):
+        self.cpu = cpu
+        self.max_block_size = max_block_size
+        self._blocks = {}  # (bank, pc) => 编译好的函数
+        self._pages = {}  # RAM 页号 => 该页上的块的键
+
+    def execute(self):
+        '''
+        执行从当前 PC 开始的一个基本块
+        :return: 执行的指令条数
+        '''
+        cpu = self.cpu
+        pc = cpu._registers.PC
+        key = (cpu.bank_of(pc), pc)
+        block = self._blocks.get(key)
+        if block is None:
+            block = self.translate(key)
+        return block(cpu, cpu._registers, cpu._memory, cpu.read_address, cpu.write_address)
+
+    def invalidate(self, address):
+        # RAM 中 address (折叠后的实际位置) 处被写入, 丢弃这一页上的所有块
+        keys = self._pages.pop(address >> 8, None)
+        if keys:
+            for key in keys:
+                self.drop(key)
+
+    def clear(self):
+        self._blocks.clear()
+        self._pages.clear()
+
+    def drop(self, key):
+        self._blocks.pop(key, None)
+
+    def scan(self, pc):
+        read = self.cpu.read_address
+        address_len = self.cpu.address_len
+        handlers = self.cpu._handlers_by_name
+        block = []
+        # PRG-ROM 里的块在所在的 8K 窗口结束前停下
+        limit = (pc | 0x1FFF) + 1 if pc >= 0x8000 else 0x8000
+        while len(block) < self.max_block_size:
+            code = read(pc)
+            ins, mode = opcodes.codes[code]
+            if ins not in FLAG_USAGE or ins not in handlers:
+                break
+            length = address_len[mode]
+            if pc + length > limit:
+                break
+            if length == 1:
+                operand = 0
+            elif length == 2:
+                operand = read(pc + 1)
+            else:
+                operand = read(pc + 1) | (read(pc + 2) << 8)
+            block.append(Instruction(pc, code, ins, mode, operand, length))
+            pc += length
+            if ins in TERMINATORS:
+                break
+        return block
+
+    def translate(self, key):
+        start = key[1]
+        block = self.scan(start)
+        if not block:
+            function = fallback
+            end = start + 1
+        else:
+            source = self.generate(block)
+            code = compile(source, '<block {:04X}>'.format(start), 'exec')
+            namespace = {}
+            exec(code, namespace)
+            function = namespace['block']
+            end = block[-1].pc + block[-1].length
+
+        self._blocks[key] = function
+        if start < 0x8000:
+            self.cpu.mark_code(start, end)
+            for page in range(start >> 8, ((end - 1) >> 8) + 1):
+                # 和代码标记一样, $0800-$1FFF 折叠到 2K RAM 的页上
+                page = page & 0x07 if page < 0x20 else page
+                self._pages.setdefault(page, set()).add(key)
+        return function
+
+    def generate(self, block):
+        # 可能改写代码或者切换 PRG bank 的写入之后检查 cpu._code_version, 变了就在这条指令之后离开块
+        # 最后一条指令之后块本来就结束了, 不用检查
+        checks = [self.may_change_code(instruction) for instruction in block[:-1]] + [False]
+
+        # 活跃分析: 倒着遍历, 算出每条指令之后仍然会被读到的标志位
+        # 块结束时只需要写回块内改过的标志位, 没改过的直接沿用 P 里原来的值
+        # 中途离开的地方也是出口, 到那里为止改过的标志位都要算出来
+        written = set()
+        written_so_far = []
+        for instruction in block:
+            written |= set(FLAG_USAGE[instruction.ins][1])
+            written_so_far.append(set(written))
+        live = set(written)
+        lives = []
+        for instruction, check, done in zip(reversed(block), reversed(checks), reversed(written_so_far)):
+            if check:
+                live = live | done
+            lives.append(live)
+            reads, writes = FLAG_USAGE[instruction.ins]
+            live = (live - set(writes)) | set(reads)
+        lives.reverse()
+        entry_live = live
+
+        lines = [
+            'def block(cpu, r, m, read, write):',
+            '    A = r.A',
+            '    X = r.X',
+            '    Y = r.Y',
+            '    S = r.S',
+            '    P = r.P',
+        ]
+        for flag in FLAGS:
+            if flag in entry_live:
+                lines.append('    {} = (P >> {}) & 1'.format(flag, FLAG_BITS[flag]))
+        if any(checks):
+            lines.append('    version = cpu._code_version')
+
+        # 周期数在翻译时就能算出来, 跨页和分支跳转的额外周期在块内累加到 cycles
+        # 可能访问 I/O 或者 mapper 寄存器的指令之前先把到这条指令为止的周期记到 cpu.cycles 上, 总线让 PPU 追赶时时间才对
+        page_cross = any(instruction.code in opcodes.PAGE_CROSS for instruction in block)
+        if page_cross:
+            lines.insert(1, '    cycles = 0')
+        pending = 0
+
+        last = block[-1]
+        pc = '0x{:04X}'.format(last.pc + last.length)
+        for count, (instruction, live, check) in enumerate(zip(block, lives, checks), 1):
+            pending += opcodes.cycles[instruction.code]
+            sync = None
+            if self.may_access_io(instruction):
+                if page_cross:
+                    sync = ['cpu.cycles += {} + cycles'.format(pending), 'cycles = 0']
+                else:
+                    sync = ['cpu.cycles += {}'.format(pending)]
+                pending = 0
+            body, exit_pc = self.generate_instruction(instruction, live, sync)
+            lines.append('    # {:04X} {} {}'.format(instruction.pc, instruction.ins, instruction.mode))
+            lines.extend('    ' + line for line in body)
+            if exit_pc is not None:
+                pc = exit_pc
+            if check:
+                # 改写了自己后面的代码, 或者把自己所在的 bank 换掉了, 剩下的指令已经过期
+                cycles = '{} + cycles'.format(pending) if page_cross else str(pending)
+                exit_lines = ['cpu.cycles += {}'.format(cycles)] if cycles != '0' else []
+                exit_lines += self.write_back(written_so_far[count - 1], '0x{:04X}'.format(instruction.pc + instruction.length))
+                if any(i.ins in ('CLI', 'PLP') for i in block[:count]):
+                    exit_lines.append('cpu.poll_irq()')
+                exit_lines += ['cpu._count += {}'.format(count), 'return {}'.format(count)]
+                lines.append('    if cpu._code_version != version:')
+                lines.extend('        ' + line for line in exit_lines)
+
+        # 还没有记上的周期
+        cycles = '{} + cycles'.format(pending) if page_cross else str(pending)
+        if last.ins in BRANCHES:
+            offset = last.operand
+            target = pc_after = last.pc + last.length
+            target += offset - 256 if offset > 127 else offset
+            extra = 2 if (target ^ pc_after) & 0xFF00 else 1
+            cycles = '{} + ({} if {} else 0)'.format(cycles, extra, BRANCHES[last.ins])
+
+        # 清掉 I 标志的指令之后, 如果还有设备拉着 IRQ 线, 块结束时安排中断
+        irq_lines = []
+        if any(instruction.ins in ('CLI', 'PLP', 'RTI') for instruction in block):
+            irq_lines = ['    cpu.poll_irq()']
+
+        exit_lines = []
+        if last.ins in BRANCHES and target < pc_after:
+            # 向回跳的分支可能是空转循环, 交给 cpu 判断要不要快进
+            exit_lines = [
+                '    if {} and cpu.next_event_cycle is not None:'.format(BRANCHES[last.ins]),
+                '        cpu.skip_idle_loop(0x{:04X}, 0x{:04X})'.format(target, pc_after),
+            ]
+
+        lines.append('    cpu.cycles += {}'.format(cycles))
+        lines.extend('    ' + line for line in self.write_back(written, pc))
+        lines.extend(exit_lines + irq_lines + [
+            '    cpu._count += {}'.format(len(block)),
+            '    return {}'.format(len(block)),
+        ])
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def write_back(written, pc):
+        # 把局部变量写回寄存器, written 是块内 (到这里为止) 改过的标志位
+        keep = 0xFF
+        p = ['(P & 0x{:02X})']
+        for flag in FLAGS:
+            if flag in written:
+                bit = FLAG_BITS[flag]
+                keep &= ~(1 << bit)
+                p.append('{} << {}'.format(flag, bit) if bit else flag)
+        p[0] = p[0].format(keep)
+        return [
+            'r.A = A',
+            'r.X = X',
+            'r.Y = Y',
+            'r.S = S',
+            'r.P = {}'.format(' | '.join(p)),
+            'r.PC = {}'.format(pc),
+        ]
+
+    @staticmethod
+    def operand(instruction):
+        '''
+        生成寻址代码
+        :return: lines, 有效地址表达式, 操作数表达式
+        '''
+        mode = instruction.mode
+        op = instruction.operand
+        if mode == 'IMM':
+            return [], None, str(op)
+        elif mode == 'ZPG':
+            return [], str(op), 'm[{}]'.format(op)
+        elif mode == 'ABS':
+            # 只有 RAM 直接读内存, RAM 的镜像在翻译时就解析掉
+            # I/O 寄存器, SRAM (可能是存档文件的映射) 和 PRG-ROM (mapper 会切换) 都走 read()
+            if op >= 0x2000:
+                return [], str(op), 'read({})'.format(op)
+            return [], str(op), 'm[{}]'.format(op & 0x07FF)
+        elif mode == 'ZPX':
+            return ['ea = ({} + X) & 0xFF'.format(op)], 'ea', 'm[ea]'
+        elif mode == 'ZPY':
+            return ['ea = ({} + Y) & 0xFF'.format(op)], 'ea', 'm[ea]'
+        elif mode == 'ABX':
+            lines = ['ea = ({} + X) & 0xFFFF'.format(op)]
+            base = str(op)
+        elif mode == 'ABY':
+            lines = ['ea = ({} + Y) & 0xFFFF'.format(op)]
+            base = str(op)
+        elif mode == 'INX':
+            lines = [
+                't = ({} + X) & 0xFF'.format(op),
+                'ea = m[t] | (m[(t + 1) & 0xFF] << 8)',
+            ]
+        elif mode == 'INY':
+            lines = [
+                'base = m[{}] | (m[{}] << 8)'.format(op, (op + 1) & 0xFF),
+                'ea = (base + Y) & 0xFFFF',
+            ]
+            base = 'base'
+        elif mode == 'IND':
+            addr2 = (op & 0xFF00) | ((op + 1) & 0x00FF)
+            lines = ['ea = read({}) | (read({}) << 8)'.format(op, addr2)]
+        else:
+            return [], None, None
+        if instruction.code in opcodes.PAGE_CROSS:
+            lines.append('if (ea ^ {}) & 0xFF00:'.format(base))
+            lines.append('    cycles += 1')
+        return lines, 'ea', 'read(ea)'
+
+    @staticmethod
+    def zero_negative(value, live):
+        lines = []
+        if 'Z' in live:
+            lines.append('Z = 0 if {} else 1'.format(value))
+        if 'N' in live:
+            lines.append('N = ({} >> 7) & 1'.format(value))
+        return lines
+
+    @staticmethod
+    def push(value):
+        return [
+            'write(0x100 | S, {})'.format(value),
+            'S = (S - 1) & 0xFF',
+        ]
+
+    @staticmethod
+    def pop(name):
+        return [
+            'S = (S + 1) & 0xFF',
+            '{} = m[0x100 | S]'.format(name),
+        ]
+
+    @staticmethod
+    def writes_memory(instruction):
+        return instruction.ins in WRITES and instruction.mode != 'IMP'
+
+    @staticmethod
+    def may_access_io(instruction):
+        '''
+        指令会不会读写 $2000-$5FFF (PPU APU 手柄等寄存器), 或者写 $6000-$FFFF
+        后者是有处理函数的页 (SRAM, mapper 寄存器), mapper 切换 CHR bank 和镜像, 数 IRQ 时都要用到 cpu.cycles
+        间接寻址算出来的地址翻译时不知道, 都当作会
+        '''
+        ins, mode, op = instruction.ins, instruction.mode, instruction.operand
+        end = 0x10000 if Translator.writes_memory(instruction) else 0x6000
+        if ins in ('JMP', 'JSR', 'NOP'):
+            return mode == 'IND' and 0x2000 <= op < 0x6000
+        if mode == 'ABS':
+            return 0x2000 <= op < end
+        if mode in ('ABX', 'ABY'):
+            return op < end and op + 0xFF >= 0x2000
+        return mode in ('INX', 'INY')
+
+    @staticmethod
+    def may_change_code(instruction):
+        '''
+        写入会不会让缓存的代码失效: 改写 RAM (或 SRAM) 里翻译过的代码, 或者写 mapper 寄存器切换 PRG bank
+        压栈也可能写到栈页上的代码; 只有写 PPU APU 寄存器的绝对寻址肯定不会
+        '''
+        if instruction.ins in ('PHA', 'PHP'):
+            return True
+        if not Translator.writes_memory(instruction):
+            return False
+        return not (instruction.mode == 'ABS' and 0x2000 <= instruction.operand < 0x4020)
+
+    def generate_instruction(self, instruction, live, sync=None):
+        '''
+        :param sync: 算出有效地址之后, 读写之前插入的同步周期数的代码
+        :return: lines, 块的出口 PC 表达式 (只有块结束指令才有)
+        '''
+        ins = instruction.ins
+        mode = instruction.mode
+        lines, ea, value = self.operand(instruction)
+        if sync:
+            lines += sync
+        if ins not in STORES and value is not None and mode != 'IMM':
+            lines.append('val = {}'.format(value))
+            value = 'val'
+        next_pc = instruction.pc + instruction.length
+        nz = self.zero_negative
+
+        if ins in BRANCHES:
+            offset = instruction.operand
+            target = next_pc + (offset - 256 if offset > 127 else offset)
+            return [], '0x{:04X} if {} else 0x{:04X}'.format(target, BRANCHES[ins], next_pc)
+        elif ins == 'JMP':
+            if mode == 'IND':
+                return lines, 'ea'
+            return [], '0x{:04X}'.format(instruction.operand)
+        elif ins == 'JSR':
+            ret = next_pc - 1
+            lines = self.push(ret >> 8) + self.push(ret & 0xFF)
+            return lines, '0x{:04X}'.format(instruction.operand)
+        elif ins == 'RTS':
+            lines = self.pop('low') + self.pop('high')
+            return lines, '((low | (high << 8)) + 1) & 0xFFFF'
+        elif ins == 'RTI':
+            lines = self.pop('t')
+            lines += ['{} = (t >> {}) & 1'.format(flag, FLAG_BITS[flag]) for flag in FLAGS]
+            lines += ['P |= 0x20']
+            lines += self.pop('low') + self.pop('high')
+            return lines, 'low | (high << 8)'
+
+        if ins in ('LDA', 'LDX', 'LDY'):
+            reg = ins[2]
+            lines.append('{} = {}'.format(reg, value))
+            lines += nz(reg, live)
+        elif ins == 'LAX':
+            lines.append('A = X = {}'.format(value))
+            lines += nz('A', live)
+        elif ins in ('STA', 'STX', 'STY'):
+            lines.append('write({}, {})'.format(ea, ins[2]))
+        elif ins == 'SAX':
+            lines.append('write({}, A & X)'.format(ea))
+        elif ins in ('AND', 'ORA', 'EOR'):
+            operator = {'AND': '&', 'ORA': '|', 'EOR': '^'}[ins]
+            lines.append('A {}= {}'.format(operator, value))
+            lines += nz('A', live)
+        elif ins in ('CMP', 'CPX', 'CPY'):
+            reg = 'A' if ins == 'CMP' else ins[2]
+            lines.append('t = {} - {}'.format(reg, value))
+            if 'C' in live:
+                lines.append('C = 1 if t >= 0 else 0')
+            lines += nz('t', live)
+        elif ins == 'BIT':
+            if 'Z' in live:
+                lines.append('Z = 0 if A & {} else 1'.format(value))
+            if 'N' in live:
+                lines.append('N = ({} >> 7) & 1'.format(value))
+            if 'V' in live:
+                lines.append('V = ({} >> 6) & 1'.format(value))
+        elif ins == 'ADC':
+            lines.append('t = A + {} + C'.format(value))
+            if 'C' in live:
+                lines.append('C = t >> 8')
+            lines.append('t &= 0xFF')
+            if 'V' in live:
+                lines.append('V = 1 if not ((A ^ {0}) & 0x80) and ((A ^ t) & 0x80) else 0'.format(value))
+            lines.append('A = t')
+            lines += nz('A', live)
+        elif ins == 'SBC':
+            lines.append('t = A - {} - (1 - C)'.format(value))
+            lines.append('high = (t >> 8) & 0xFF')
+            if 'C' in live:
+                lines.append('C = 0 if high else 1')
+            if 'V' in live:
+                lines.append('V = 1 if ((A ^ {}) & 0x80) and ((A ^ high) & 0x80) else 0'.format(value))
+            lines.append('A = t & 0xFF')
+            lines += nz('A', live)
+        elif ins in ('INX', 'INY', 'DEX', 'DEY'):
+            reg = ins[2]
+            lines.append('{0} = ({0} {1} 1) & 0xFF'.format(reg, '+' if ins[0] == 'I' else '-'))
+            lines += nz(reg, live)
+        elif ins in ('INC', 'DEC'):
+            lines.append('t = ({} {} 1) & 0xFF'.format(value, '+' if ins == 'INC' else '-'))
+            lines.append('write({}, t)'.format(ea))
+            lines += nz('t', live)
+        elif ins in ('TAX', 'TAY', 'TXA', 'TYA', 'TSX', 'TXS'):
+            src, des = ins[1], ins[2]
+            lines.append('{} = {}'.format(des, src))
+            if ins != 'TXS':
+                lines += nz(des, live)
+        elif ins in ('ASL', 'LSR', 'ROL', 'ROR'):
+            if mode == 'IMP':
+                lines.append('val = A')
+            if ins == 'ASL':
+                carry, result = 'val >> 7', '(val << 1) & 0xFF'
+            elif ins == 'LSR':
+                carry, result = 'val & 1', 'val >> 1'
+            elif ins == 'ROL':
+                carry, result = 'val >> 7', '((val << 1) | C) & 0xFF'
+            else:
+                carry, result = 'val & 1', '(val >> 1) | (C << 7)'
+            lines.append('t = {}'.format(result))
+            if 'C' in live:
+                lines.append('C = {}'.format(carry))
+            if mode == 'IMP':
+                lines.append('A = t')
+            else:
+                lines.append('write({}, t)'.format(ea))
+            lines += nz('t', live)
+        elif ins in ('CLC', 'SEC', 'CLD', 'SED', 'SEI', 'CLV', 'CLI'):
+            lines.append('{} = {}'.format(ins[2], 1 if ins[0] == 'S' else 0))
+        elif ins == 'NOP':
+            # 只保留寻址 (跨页周期), 不读取操作数
+            pass
+        elif ins == 'PHA':
+            lines += self.push('A')
+        elif ins == 'PHP':
+            # 当 P 被 指令 PHP BRK 压入栈时， 压入的 P 的第 4 位被设置成 1
+            p = ' | '.join(['{} << {}'.format(flag, FLAG_BITS[flag]) for flag in FLAGS])
+            lines += self.push('(P & 0x30) | 0x10 | {}'.format(p))
+        elif ins == 'PLA':
+            lines += self.pop('A')
+            lines += nz('A', live)
+        elif ins == 'PLP':
+            lines += self.pop('t')
+            lines += ['{} = (t >> {}) & 1'.format(flag, FLAG_BITS[flag]) for flag in FLAGS]
+        elif ins == 'DCP':
+            lines.append('t = ({} - 1) & 0xFF'.format(value))
+            lines.append('write({}, t)'.format(ea))
+            lines.append('t = (A - t) & 0xFFFF')
+            if 'C' in live:
+                lines.append('C = 1 if t < 0x100 else 0')
+            lines += nz('(t & 0xFF)', live)
+        elif ins == 'ISB':
+            lines.append('val = ({} + 1) & 0xFF'.format(value))
+            lines.append('write({}, val)'.format(ea))
+            lines.append('t = (A - val - (1 - C)) & 0xFFFF')
+            if 'C' in live:
+                lines.append('C = 0 if t >> 8 else 1')
+            lines.append('t &= 0xFF')
+            if 'V' in live:
+                lines.append('V = 1 if ((A ^ t) & 0x80) and ((A ^ val) & 0x80) else 0')
+            lines.append('A = t')
+            lines += nz('A', live)
+        elif ins == 'SLO':
+            if 'C' in live:
+                lines.append('C = {} >> 7'.format(value))
+            lines.append('t = ({} << 1) & 0xFF'.format(value))
+            lines.append('write({}, t)'.format(ea))
+            lines.append('A |= t')
+            lines += nz('A', live)
+        elif ins == 'RLA':
+            lines.append('t = ({} << 1) | C'.format(value))
+            if 'C' in live:
+                lines.append('C = t >> 8')
+            lines.append('t &= 0xFF')
+            lines.append('write({}, t)'.format(ea))
+            lines.append('A &= t')
+            lines += nz('A', live)
+        elif ins == 'SRE':
+            if 'C' in live:
+                lines.append('C = {} & 1'.format(value))
+            lines.append('t = {} >> 1'.format(value))
+            lines.append('write({}, t)'.format(ea))
+            lines.append('A ^= t')
+            lines += nz('A', live)
+        elif ins == 'RRA':
+            lines.append('c = {} & 1'.format(value))
+            lines.append('val = ({} >> 1) | (C << 7)'.format(value))
+            lines.append('write({}, val)'.format(ea))
+            lines.append('t = A + val + c')
+            if 'C' in live:
+                lines.append('C = t >> 8')
+            lines.append('t &= 0xFF')
+            if 'V' in live:
+                lines.append('V = 1 if not ((A ^ val) & 0x80) and ((A ^ t) & 0x80) else 0')
+            lines.append('A = t')
+            lines += nz('A', live)
+        else:
+            raise NotImplementedError("稍等一下, {} 指令还没实现".format(ins))
+
+        return lines, None